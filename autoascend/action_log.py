@@ -0,0 +1,56 @@
+import struct
+from pathlib import Path
+
+# magic, format version, core seed, disp seed, reseed, number of actions
+_HEADER = struct.Struct('<6sBQQ?I')
+MAGIC = b'AALOG\0'
+VERSION = 1
+
+
+class ActionLog:
+    """ Seeds and the sequence of actions (indices in `env.actions`, one byte each) of an episode.
+    It's enough to deterministically replay the game without the agent.
+    """
+
+    def __init__(self, seeds, actions):
+        self.seeds = tuple(seeds)
+        self.actions = bytes(actions)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def dumps(self):
+        core, disp, reseed = self.seeds
+        return _HEADER.pack(MAGIC, VERSION, core, disp, reseed, len(self.actions)) + self.actions
+
+    @staticmethod
+    def loads(data):
+        magic, version, core, disp, reseed, length = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('not an action log')
+        if version != VERSION:
+            raise ValueError(f'unsupported action log version: {version}')
+        actions = data[_HEADER.size:_HEADER.size + length]
+        if len(actions) != length:
+            raise ValueError('truncated action log')
+        return ActionLog((core, disp, reseed), actions)
+
+    def save(self, path):
+        Path(path).write_bytes(self.dumps())
+
+    @staticmethod
+    def load(path):
+        return ActionLog.loads(Path(path).read_bytes())
+
+
+def replay(env, obs, actions, until=None):
+    """ Executes `actions` (indices) in NLE environment, that was just reset (returning `obs`), without any agent
+    logic. Stops after `until` actions or when the game ends.
+    Returns (last observation, number of executed actions, done).
+    """
+    done, i = False, 0
+    for i, action in enumerate(actions[:until], 1):
+        obs, _, done, _ = env.step(action)
+        if done:
+            break
+    return obs, i, done
@@ -1,5 +1,6 @@
 import contextlib
 import re
+import time
 from collections import namedtuple, Counter, defaultdict
 from functools import partial
 
@@ -9,8 +10,10 @@ import numpy as np
 from nle.nethack import actions as A
 
 from . import combat
+from . import snapshot
 from . import utils
 from .character import Character
+from .distance_cache import DistanceCache, Walkability
 from .exceptions import AgentPanic, AgentFinished, AgentChangeStrategy
 from .exploration_logic import ExplorationLogic
 from .global_logic import GlobalLogic
@@ -19,12 +22,16 @@ from .item import Item, flatten_items
 from .item.inventory import Inventory
 from .level import Level
 from .monster_tracker import MonsterTracker, disappearance_mask
+from .observation import ObservationBuffers
+from .step_cache import StepCache
 from .stats_logger import StatsLogger
 from .strategy import Strategy
 
 BLStats = namedtuple('BLStats',
                      'x y strength_percentage strength dexterity constitution intelligence wisdom charisma score hitpoints max_hitpoints depth gold energy max_energy armor_class monster_level experience_level experience_points time hunger_state carrying_capacity dungeon_number level_number prop_mask align')
 
+BLSTATS_TIME = BLStats._fields.index('time')
+
 
 class Agent:
     def __init__(self, env, seed=0, verbose=False, panic_on_errors=False,
@@ -49,6 +56,8 @@ class Agent:
         self._message_history = []
         self.cursor_pos = (0, 0)
         self.last_observation = None
+        self._observation_buffers = ObservationBuffers()
+        self.step_cache = StepCache()
 
         self._last_pet_seen = 0
 
@@ -58,10 +67,11 @@ class Agent:
         self.global_logic = GlobalLogic(self)
         self.monster_tracker = MonsterTracker(self)
 
-        self.last_bfs_dis = None
-        self.last_bfs_step = None
+        self.distance_cache = DistanceCache()
+        self._game_snapshot = None  # snapshot of the current step for `lookahead`
         self.last_prayer_turn = None
         self._previous_glyphs = None
+        self._level_update_glyphs = None  # (level key, glyphs) of the last `update_level`
         self._last_turn = -1
         self._inactivity_counter = 0
         self._is_updating_state = False
@@ -79,7 +89,7 @@ class Agent:
         self._allow_walking_through_traps_turn = -float('inf')
         self._allow_attack_all_turn = -float('inf')
 
-        self.last_cast_fail_turn = defaultdict(lambda: -float('inf'))
+        self.last_cast_fail_turn = defaultdict(partial(float, '-inf'))
 
         # uncomment to use RL-based fight decisions
         # combat.rl_scoring.init_fight2_model(self)
@@ -87,6 +97,19 @@ class Agent:
         self.stats_logger = StatsLogger()
 
         self.current_strategy = "initial"
+        self._strategy_stack = []  # accounting labels of strategies preempted by the current one (see `preempt`)
+        self._last_accounting = None  # (wall time, cpu time, turn) at the last step (see `_account_step`)
+
+    @property
+    def current_strategy(self):
+        """ Name of the running strategy (recorded in histories and datasets) """
+        return self._current_strategy
+
+    @current_strategy.setter
+    def current_strategy(self, name):
+        self._current_strategy = name
+        # the strategy steps are accounted to, unlike `current_strategy` it's restored after a preemption
+        self._accounting_strategy = name
 
     @property
     def has_pet(self):
@@ -96,6 +119,29 @@ class Agent:
     def in_atom_operation(self):
         return self.turns_in_atom_operation is not None
 
+    @property
+    def can_checkpoint(self):
+        """ Whether the last observation was fully processed, so the agent state can be saved (see `checkpoint.py`) """
+        return not self.in_atom_operation and not self._is_updating_state and not self._is_reading_message_or_popup
+
+    def __getstate__(self):
+        # Only the knowledge about the game is pickled. The environment, callbacks of running strategies
+        # and RL communication are transient -- a restored agent continues as after a panic (see `main`)
+        state = self.__dict__.copy()
+        state['env'] = None
+        state['on_update'] = []
+        state['rl_model_to_train'] = None
+        state['rl_model_training_comm'] = (None, None)
+        state['_observation'] = None
+        state['_observation_buffers'] = ObservationBuffers()
+        state['_level_update_glyphs'] = None
+        state['step_cache'] = StepCache()
+        state['distance_cache'] = DistanceCache()
+        state['_strategy_stack'] = []
+        state['_last_accounting'] = None
+        state['_game_snapshot'] = None
+        return state
+
     ######## CONVENIENCE FUNCTIONS
 
     @contextlib.contextmanager
@@ -255,11 +301,16 @@ class Agent:
                 iterator = e.args[1]
 
             if iterator is not None:
+                # steps of the preempted strategy are accounted to it again afterwards (see `_account_step`),
+                # `current_strategy` (recorded in histories and datasets) is left as set by the preempting one
+                self._strategy_stack.append(self._accounting_strategy)
                 try:
                     next(iterator)
                     assert 0, iterator
                 except StopIteration:
                     pass
+                finally:
+                    self._accounting_strategy = self._strategy_stack.pop()
 
                 if not continue_after_preemption:
                     break
@@ -271,6 +322,7 @@ class Agent:
     ######## UPDATE FUNCTIONS
 
     def on_panic(self):
+        self._level_update_glyphs = None
         self.check_terrain(force=True)
         self.inventory.on_panic()
         self.monster_tracker.on_panic()
@@ -371,8 +423,18 @@ class Agent:
         if isinstance(action, str):
             assert len(action) == 1
             action = A.ACTIONS[A.ACTIONS.index(ord(action))]
+        if self._game_snapshot is not None:
+            self._game_snapshot.close()
+            self._game_snapshot = None
+        strategy_chain = '/'.join(self._strategy_stack + [self._accounting_strategy])
+        env_start_time, env_start_cpu = time.perf_counter(), time.process_time()
         observation, reward, done, info = self.env.step(action)
-        observation = {k: v.copy() for k, v in observation.items()}
+        self._account_step(strategy_chain, time.perf_counter() - env_start_time, time.process_time() - env_start_cpu,
+                           observation)
+        # observations referenced by the agent are kept, see `ObservationBuffers` for ownership
+        observation = self._observation_buffers.copy(
+            observation, in_use=(self.last_observation, self._observation, self._previous_glyphs,
+                                 getattr(self, 'glyphs', None)))
         self.step_count += 1
         self.score += reward
 
@@ -390,6 +452,29 @@ class Agent:
 
         self.update(observation, additional_action_iterator)
 
+    def lookahead(self, candidates, evaluate):
+        """ Plays every candidate (a sequence of actions) on a copy of the game and returns a list
+        of tuples (`evaluate(agent)` after it, None) or (None, traceback) if the candidate failed
+        (e.g. the game ended). The game isn't changed. `evaluate` has to be picklable (e.g. a module level function).
+        The snapshot of the game is reused by further calls until the next step.
+        """
+        if self._game_snapshot is None:
+            self._game_snapshot = snapshot.GameSnapshot(self.env)
+        return [self._game_snapshot.evaluate(snapshot.play_actions, list(actions), evaluate)
+                for actions in candidates]
+
+    def _account_step(self, strategy_chain, env_time, env_cpu_time, observation):
+        """ Attributes the time since the previous step (agent decisions and this env step) to the strategy chain.
+        The CPU time is of the agent only, CPU time of the (in-process) env step is subtracted.
+        """
+        now, cpu_now = time.perf_counter(), time.process_time()
+        turn = observation['blstats'][BLSTATS_TIME]
+        if self._last_accounting is not None:
+            last_now, last_cpu, last_turn = self._last_accounting
+            self.stats_logger.log_strategy_step(strategy_chain, now - last_now, cpu_now - last_cpu - env_cpu_time,
+                                                env_time, turn - last_turn)
+        self._last_accounting = (now, cpu_now, turn)
+
     def update(self, observation, additional_action_iterator=None):
         self._observation = observation
         done = self.update_message_and_popup(observation)
@@ -452,6 +537,8 @@ class Agent:
 
         self.blstats = BLStats(*self.last_observation['blstats'])
         self.glyphs = self.last_observation['glyphs']
+        self.glyph_features = G.features(self.glyphs)
+        self.step_cache.clear()
 
         self.stats_logger.log_cumulative_value('max_turns_on_position',
                                                key=(self.current_level().dungeon_number,
@@ -479,10 +566,18 @@ class Agent:
         try:
             if allow_update:
                 # functions that are allowed to call state unchanging steps
-                for func in [self.character.update, self.inventory.update, self.monster_tracker.update,
-                             partial(self.check_terrain, force=False), self.update_level,
-                             self.global_logic.update]:
-                    func()
+                for name, func in [('character', self.character.update),
+                                   ('inventory', self.inventory.update),
+                                   ('monster_tracker', self.monster_tracker.update),
+                                   ('check_terrain', partial(self.check_terrain, force=False)),
+                                   ('update_level', self.update_level),
+                                   ('global_logic', self.global_logic.update)]:
+                    start_time, start_step = time.perf_counter(), self.step_count
+                    try:
+                        func()
+                    finally:
+                        self.stats_logger.log_phase(name, time.perf_counter() - start_time,
+                                                    self.step_count - start_step)
                     self.message = message
                     self.popup = popup
 
@@ -496,9 +591,13 @@ class Agent:
             funcs = self.on_update
         assert all((func in self.on_update for func in funcs))
 
-        with self.disallow_step_calling():
-            for func in funcs:
-                func()
+        start_time = time.perf_counter()
+        try:
+            with self.disallow_step_calling():
+                for func in funcs:
+                    func()
+        finally:
+            self.stats_logger.log_phase('on_update', time.perf_counter() - start_time, 0, calls=len(funcs))
 
     def _update_level_items(self):
         level = self.current_level()
@@ -507,7 +606,7 @@ class Agent:
         level.item_count[self.blstats.y, self.blstats.x] = len(self.inventory.items_below_me)
 
         # TODO: optimize
-        ignore_mask = utils.isin(self.glyphs, G.MONS, G.PETS)  # TODO: effects, etc
+        ignore_mask = self.glyph_mask(G.MONS, G.PETS)  # TODO: effects, etc
         item_mask = level.item_count != 0
         mask = item_mask & ~ignore_mask
         level.item_disagreement_counter[~mask] = 0
@@ -535,9 +634,9 @@ class Agent:
             shop_type = SHOP.name2id[shop_name]
 
         shopkeepers = list(
-            zip(*(utils.isin(self.glyphs, G.SHOPKEEPER) & self.monster_tracker.peaceful_monster_mask).nonzero()))
+            zip(*(self.glyph_mask(G.SHOPKEEPER) & self.monster_tracker.peaceful_monster_mask).nonzero()))
         for y, x in shopkeepers:
-            wall_mask = utils.isin(level.objects, G.WALL)
+            wall_mask = self.object_mask(G.WALL)
             entry = ((utils.translate(wall_mask, 1, 0) & utils.translate(wall_mask, -1, 0)) |
                      (utils.translate(wall_mask, 0, 1) & utils.translate(wall_mask, 0, -1))) & \
                     level.walkable
@@ -566,9 +665,9 @@ class Agent:
 
         if not self.character.prop.hallu and mnames:
             old_mons = self._previous_glyphs.copy()
-            old_mons[~utils.isin(self._previous_glyphs, G.MONS, G.INVISIBLE_MON)] = -1
+            old_mons[~G.isin(self._previous_glyphs, G.MONS, G.INVISIBLE_MON)] = -1
             new_mons = self.glyphs.copy()
-            new_mons[~utils.isin(self.glyphs, G.MONS, G.INVISIBLE_MON)] = -1
+            new_mons[~self.glyph_mask(G.MONS, G.INVISIBLE_MON)] = -1
             mask = disappearance_mask(old_mons, new_mons, 1)
             mons = old_mons.copy()
             mons[~mask] = -1
@@ -595,35 +694,59 @@ class Agent:
             level.corpses_to_eat[self.blstats.y, self.blstats.x][item.monster_id] = \
                 old_possible_corpses[item.monster_id]
 
-    def update_level(self):
-        if utils.isin(self.glyphs, G.SWALLOW).any():
+    def _update_level_terrain(self, level, ys, xs):
+        """ Updates `walkable`, `seen` and `objects` of the level in given cells from their glyphs """
+        glyphs = self.glyphs[ys, xs]
+        features = self.glyph_features[ys, xs]
+        walkable = level.walkable[ys, xs]
+        seen = level.seen[ys, xs]
+        objects = level.objects[ys, xs]
+
+        mask = G.mask(features, G.FLOOR, G.STAIR_UP, G.STAIR_DOWN, G.DOOR_OPENED, G.TRAPS, G.ALTAR, G.FOUNTAIN)
+        walkable[mask] = True
+        seen[mask] = True
+        objects[mask] = glyphs[mask]
+
+        mask = G.mask(features, G.MONS, G.PETS, G.BODIES, G.OBJECTS, G.STATUES)
+        seen[mask] = True
+        walkable[mask & (objects == -1)] = True
+
+        mask = G.mask(features, G.WALL, G.DOOR_CLOSED, G.BARS)
+        seen[mask] = True
+        objects[mask] = glyphs[mask]
+        walkable[mask] = False
+
+        level.walkable[ys, xs] = walkable
+        level.seen[ys, xs] = seen
+        level.objects[ys, xs] = objects
+        self.step_cache.clear()
+
+    def update_level(self, full=False):
+        """ Terrain is updated only in cells whose glyphs changed since the last update on the same level
+        (it gives the same result, because the update of a cell depends only on its glyph and its previous state).
+        `full` forces updating all cells, it's also done after a level change and a panic.
+        """
+        if self.glyph_mask(G.SWALLOW).any():
             return
 
-        if utils.any_in(self.glyphs, G.PETS):
+        if self.glyph_mask(G.PETS).any():
             self._last_pet_seen = self.blstats.time
 
         level = self.current_level()
 
-        mask = utils.isin(self.glyphs, G.FLOOR, G.STAIR_UP, G.STAIR_DOWN, G.DOOR_OPENED, G.TRAPS,
-                          G.ALTAR, G.FOUNTAIN)
-        level.walkable[mask] = True
-        level.seen[mask] = True
-        level.objects[mask] = self.glyphs[mask]
-
-        mask = utils.isin(self.glyphs, G.MONS, G.PETS, G.BODIES, G.OBJECTS, G.STATUES)
-        level.seen[mask] = True
-        level.walkable[mask & (level.objects == -1)] = True
-
-        mask = utils.isin(self.glyphs, G.WALL, G.DOOR_CLOSED, G.BARS)
-        level.seen[mask] = True
-        level.objects[mask] = self.glyphs[mask]
-        level.walkable[mask] = False
+        if full or self._level_update_glyphs is None or self._level_update_glyphs[0] != level.key():
+            ys, xs = np.indices(self.glyphs.shape).reshape(2, -1)
+        else:
+            ys, xs = (self.glyphs != self._level_update_glyphs[1]).nonzero()
+        self._level_update_glyphs = (level.key(), self.glyphs.copy())
+        self._update_level_terrain(level, ys, xs)
 
         self._update_level_items()
         self._update_level_shops()
         self._update_level_corpses()
 
-        for y, x in zip(*utils.isin(level.objects, G.ALTAR).nonzero()):
+        altar_mask = G.isin(level.objects[ys, xs], G.ALTAR)
+        for y, x in zip(ys[altar_mask], xs[altar_mask]):
             if (y, x) not in level.altars:
                 level.altars[y, x] = Character.UNKNOWN
 
@@ -645,8 +768,19 @@ class Agent:
                         and not level.walkable[y, x]:
                     level.forbidden[y, x] = True
 
+        self.step_cache.clear()
+
     ######## TRIVIAL HELPERS
 
+    def glyph_mask(self, *categories):
+        """ Mask of the current glyphs belonging to any of the categories (sets of `G`), read-only """
+        return self.step_cache.get(('glyphs', categories), G.mask, self.glyph_features, *categories)
+
+    def object_mask(self, *categories):
+        """ Mask of objects (the map) of the current level belonging to any of the categories, read-only """
+        features = self.step_cache.get('object_features', G.features, self.current_level().objects)
+        return self.step_cache.get(('objects', categories), G.mask, features, *categories)
+
     def current_level(self):
         key = (self.blstats.dungeon_number, self.blstats.level_number)
         if key not in self.levels:
@@ -680,7 +814,7 @@ class Agent:
             with self.atom_operation():
                 self.type_text('#te')
                 self.step(A.MiscAction.MORE, iter('b'))
-                self.update_level()
+                self.update_level(full=True)
                 self.step(A.Command.ESC)
 
     def wield_best_melee_weapon(self):
@@ -940,69 +1074,66 @@ class Agent:
         return ret
 
     def bfs(self, y=None, x=None):
+        """ Distances from (y, x) (the agent by default) on the current level, -1 if unreachable.
+        The array is shared with other calls (read-only), copy it before modifying.
+        """
         if y is None:
             y = self.blstats.y
         if x is None:
             x = self.blstats.x
 
-        if self.last_bfs_step == self.step_count and y == self.blstats.y and x == self.blstats.x:
-            return self.last_bfs_dis.copy()
+        return self.distance_cache.get(y, x, self.walkability())
+
+    def walkability(self):
+        """ Movement rules of `bfs` on the current level """
+        traps_walkable = self._last_turn - self._allow_walking_through_traps_turn <= 50
+        return self.step_cache.get(('walkability', traps_walkable), self._walkability, traps_walkable)
 
+    def _walkability(self, traps_walkable):
         level = self.current_level()
 
-        walkable = level.walkable & ~utils.isin(self.glyphs, G.BOULDER) & \
+        walkable = level.walkable & ~self.glyph_mask(G.BOULDER) & \
                    ~self.monster_tracker.peaceful_monster_mask & \
                    ~level.forbidden
 
-        if self._last_turn - self._allow_walking_through_traps_turn > 50:
-            walkable &= ~utils.isin(level.objects, G.TRAPS)
+        if not traps_walkable:
+            walkable &= ~self.object_mask(G.TRAPS)
 
-        for my, mx in list(zip(*np.nonzero(utils.isin(self.glyphs, G.MONS)))):
+        for my, mx in list(zip(*np.nonzero(self.glyph_mask(G.MONS)))):
             mon = MON.permonst(self.glyphs[my][mx])
             if mon.mname in combat.monster_utils.ONLY_RANGED_SLOW_MONSTERS:
                 walkable[my, mx] = False
 
-        dis = utils.bfs(y, x,
-                        walkable=walkable,
-                        walkable_diagonally=walkable & ~utils.isin(level.objects, G.DOORS) & (level.objects != -1),
-                        can_squeeze=self.inventory.items.total_weight <= 600 and \
-                                    self.current_level().dungeon_number != Level.SOKOBAN,
-                        )
-
-        if y == self.blstats.y and x == self.blstats.x:
-            self.last_bfs_dis = dis
-            self.last_bfs_step = self.step_count
-
-        return dis.copy()
+        return Walkability(walkable,
+                           walkable_diagonally=walkable & ~self.object_mask(G.DOORS) & (level.objects != -1),
+                           can_squeeze=self.inventory.items.total_weight <= 600 and \
+                                       self.current_level().dungeon_number != Level.SOKOBAN,
+                           )
 
     def path(self, from_y, from_x, to_y, to_x, dis=None):
+        """ Returns a shortest path [(from_y, from_x), ..., (to_y, to_x)], ties are broken at random """
         if from_y == to_y and from_x == to_x:
             return [(to_y, to_x)]
 
-        if dis is None:
-            dis = self.bfs(from_y, from_x)
-
-        assert dis[to_y, to_x] != -1
-
         # FIXME: currently the path can lead through diagonally inwalkable tiles.
         #        The path is the shortest possible, so the agent is guaranteed to
         #        unstuck itself eventually (usually a few panic exceptions) if that happens
 
-        cur_y, cur_x = to_y, to_x
-        path_rev = [(cur_y, cur_x)]
-        while cur_y != from_y or cur_x != from_x:
-            for y, x in self.neighbors(cur_y, cur_x):
-                if dis[y, x] == dis[cur_y, cur_x] - 1 and dis[y, x] >= 0:
-                    path_rev.append((y, x))
-                    cur_y, cur_x = y, x
-                    break
-            else:
-                assert 0
+        seed = self.rng.randint(2 ** 31)
+        if dis is None:
+            walkability = self.walkability()
+            dis = self.distance_cache.lookup(from_y, from_x, walkability)
+            if dis is None:
+                # the whole distance map isn't needed, stop BFS at the target
+                path = utils.bfs_path(int(from_y), int(from_x), int(to_y), int(to_x),
+                                      walkability.walkable, walkability.walkable_diagonally,
+                                      walkability.can_squeeze, seed)
+                assert len(path) > 0
+                return list(map(tuple, path.tolist()))
 
-        assert dis[cur_y, cur_x] == 0 and from_y == cur_y and from_x == cur_x
-        path = path_rev[::-1]
-        assert path[0] == (from_y, from_x) and path[-1] == (to_y, to_x)
-        return path
+        assert dis[to_y, to_x] != -1
+        path = utils.shortest_path(dis, int(from_y), int(from_x), int(to_y), int(to_x), seed)
+        return list(map(tuple, path.tolist()))
 
     ######## NON-TRIVIAL ACTIONS
 
@@ -1083,6 +1214,9 @@ class Agent:
     def get_visible_monsters(self):
         """ Returns list of tuples (distance, y, x, permonst, monster_glyph)
         """
+        return list(self.step_cache.get('visible_monsters', self._get_visible_monsters))
+
+    def _get_visible_monsters(self):
         mask = self.monster_tracker.monster_mask & ~self.monster_tracker.peaceful_monster_mask
         if not mask.any():
             return []
@@ -1243,12 +1377,12 @@ class Agent:
     @utils.debug_log('engulfed_fight')
     @Strategy.wrap
     def engulfed_fight(self):
-        if not utils.any_in(self.glyphs, G.SWALLOW):
+        if not self.glyph_mask(G.SWALLOW).any():
             yield False
         yield True
         self.current_strategy = "engulfed_fight"
         while True:
-            mask = utils.isin(self.glyphs, G.SWALLOW)
+            mask = self.glyph_mask(G.SWALLOW)
             if not mask.any():
                 break
             assert self.melee_attack(*list(zip(*mask.nonzero()))[0])
@@ -1527,23 +1661,25 @@ class Agent:
             if self.verbose:
                 print(f'PANIC!!!! : {exc}')
 
-    def main(self):
+    def main(self, resumed=False):
+        """ `resumed` -- the agent was restored from a checkpoint, so the initialization is skipped """
         try:
-            init_finished = False
+            init_finished = resumed
             try:
-                with self.atom_operation():
-                    self.step(A.Command.ESC)
-                    self.step(A.Command.ESC)
-
-                    self.current_level().stair_destination[self.blstats.y, self.blstats.x] = \
-                        ((Level.PLANE, 1), (None, None))  # TODO: check level num
-                    self.character.parse()
-                    self.character.parse_enhance_view()
-                    # self.character.parse_spellcast_view()
-                    self.step(A.Command.AUTOPICKUP)
-                    if 'Autopickup: ON' in self.message:
+                if not resumed:
+                    with self.atom_operation():
+                        self.step(A.Command.ESC)
+                        self.step(A.Command.ESC)
+
+                        self.current_level().stair_destination[self.blstats.y, self.blstats.x] = \
+                            ((Level.PLANE, 1), (None, None))  # TODO: check level num
+                        self.character.parse()
+                        self.character.parse_enhance_view()
+                        # self.character.parse_spellcast_view()
                         self.step(A.Command.AUTOPICKUP)
-                    init_finished = True
+                        if 'Autopickup: ON' in self.message:
+                            self.step(A.Command.AUTOPICKUP)
+                        init_finished = True
             except BaseException as e:
                 self.handle_exception(e)
 
@@ -0,0 +1,72 @@
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+from .action_log import ActionLog, replay
+
+CHECKPOINT_VERSION = 1
+
+
+class CheckpointMismatch(Exception):
+    pass
+
+
+def save_checkpoint(path, env):
+    """ Saves the state of the episode played by `env` (an `EnvWrapper`).
+
+    The state of the NLE game is in the memory of the process (besides level files that NetHack writes
+    to the vardir) and can't be serialized, so the game is stored as the seeds and the sequence of actions,
+    that is deterministically replayed on restore. The restore cost thus grows linearly with the episode length
+    (all actions since the beginning are replayed). The agent state (levels, inventory, item manager mappings,
+    milestone, statistics, ...) is pickled.
+    """
+    path = Path(path)
+    blstats = env.last_observation['blstats']
+    data = pickle.dumps({
+        'version': CHECKPOINT_VERSION,
+        'action_log': env.get_action_log().dumps(),
+        'step_count': env.step_count,
+        'score': env.score,
+        'blstats': np.asarray(blstats).tolist(),
+        'agent': pickle.dumps(env.agent, protocol=pickle.HIGHEST_PROTOCOL),
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    with tmp_path.open('wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    with Path(path).open('rb') as f:
+        checkpoint = pickle.load(f)
+    if checkpoint['version'] != CHECKPOINT_VERSION:
+        raise CheckpointMismatch(f'unsupported checkpoint version: {checkpoint["version"]}')
+    return checkpoint
+
+
+def restore_checkpoint(env, checkpoint):
+    """ Replays the game to the checkpoint without running the agent and returns the restored agent.
+    Raises `CheckpointMismatch` if the replayed game diverged (e.g. different NLE version).
+    """
+    action_log = ActionLog.loads(checkpoint['action_log'])
+    env.env.seed(*action_log.seeds)
+    obs = env.reset()
+    obs, _, done = replay(env.env, obs, action_log.actions)
+    if done:
+        raise CheckpointMismatch('the game ended during the replay')
+    if np.asarray(obs['blstats']).tolist() != checkpoint['blstats']:
+        raise CheckpointMismatch('the replayed game diverged from the checkpoint')
+
+    env.last_observation = obs
+    env.actions = bytearray(action_log.actions)
+    env.step_count = checkpoint['step_count']
+    env.score = checkpoint['score']
+
+    agent = pickle.loads(checkpoint['agent'])
+    agent.env = env
+    return agent
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+
+import numba as nb
+import numpy as np
+
+from . import utils
+
+
+@nb.njit(cache=True)
+def _can_move(walkable, walkable_diagonally, can_squeeze, y, x, py, px):
+    """ The movement rule of `utils.bfs` """
+    return walkable[py, px] and \
+           (abs(py - y) + abs(px - x) <= 1 or
+            (walkable_diagonally[py, px] and walkable_diagonally[y, x] and
+             (can_squeeze or walkable[py, x] or walkable[y, px])))
+
+
+@nb.njit(cache=True)
+def _sorted_by_distance(dis, mask):
+    """ Returns (ys, xs, distances) of reachable cells of the mask, sorted by the distance """
+    ys, xs = np.nonzero(mask & (dis >= 0))
+    keys = np.empty(len(ys), dtype=np.int32)
+    for i in range(len(ys)):
+        keys[i] = dis[ys[i], xs[i]]
+    order = np.argsort(keys, kind='mergesort')
+    return ys[order], xs[order], keys[order]
+
+
+@nb.njit(cache=True)
+def repair_distances(old_dis, old_walkable, old_walkable_diagonally,
+                     walkable, walkable_diagonally, can_squeeze, sy, sx):
+    """ Returns `utils.bfs` distances from (sy, sx) given distances for the old walkability (dynamic BFS).
+    Only cells around changed ones and the ones whose shortest paths led through them are visited.
+    """
+    h, w = walkable.shape
+    dis = old_dis.copy()
+
+    # cells whose incoming moves may have changed
+    near = np.zeros((h, w), dtype=nb.b1)
+    for y in range(h):
+        for x in range(w):
+            if old_walkable[y, x] != walkable[y, x] or old_walkable_diagonally[y, x] != walkable_diagonally[y, x]:
+                near[max(y - 1, 0):y + 2, max(x - 1, 0):x + 2] = True
+
+    # Invalidate cells without a shortest path predecessor left, in the order of the old distance
+    # (merging sorted seeds with the FIFO of successors of invalidated cells).
+    invalid = np.zeros((h, w), dtype=nb.b1)
+    checked = np.zeros((h, w), dtype=nb.b1)
+    seed_ys, seed_xs, seed_keys = _sorted_by_distance(dis, near)
+    queue = np.zeros((h * w * 8, 2), dtype=np.int64)
+    seed_index, head, tail = 0, 0, 0
+    while seed_index < len(seed_ys) or head < tail:
+        if head == tail or (seed_index < len(seed_ys) and
+                            seed_keys[seed_index] <= old_dis[queue[head, 0], queue[head, 1]]):
+            y, x = seed_ys[seed_index], seed_xs[seed_index]
+            seed_index += 1
+        else:
+            y, x = queue[head]
+            head += 1
+        if checked[y, x] or (y == sy and x == sx):
+            continue
+        checked[y, x] = True
+
+        d = old_dis[y, x]
+        supported = False
+        for py in range(max(y - 1, 0), min(y + 2, h)):
+            for px in range(max(x - 1, 0), min(x + 2, w)):
+                if dis[py, px] == d - 1 and _can_move(walkable, walkable_diagonally, can_squeeze, py, px, y, x):
+                    supported = True
+        if supported:
+            continue
+
+        dis[y, x] = -1
+        invalid[y, x] = True
+        for py in range(max(y - 1, 0), min(y + 2, h)):
+            for px in range(max(x - 1, 0), min(x + 2, w)):
+                if old_dis[py, px] == d + 1 and not checked[py, px]:
+                    queue[tail] = (py, px)
+                    tail += 1
+
+    # relax from the known cells around changed and invalidated ones (Dial's algorithm with unit weights)
+    boundary = near.copy()
+    for y in range(h):
+        for x in range(w):
+            if invalid[y, x]:
+                boundary[max(y - 1, 0):y + 2, max(x - 1, 0):x + 2] = True
+    seed_ys, seed_xs, seed_keys = _sorted_by_distance(dis, boundary)
+    keys = np.zeros(h * w * 8, dtype=np.int32)
+    seed_index, head, tail = 0, 0, 0
+    while seed_index < len(seed_ys) or head < tail:
+        if head == tail or (seed_index < len(seed_ys) and seed_keys[seed_index] <= keys[head]):
+            y, x = seed_ys[seed_index], seed_xs[seed_index]
+            key = seed_keys[seed_index]
+            seed_index += 1
+        else:
+            y, x = queue[head]
+            key = keys[head]
+            head += 1
+        if dis[y, x] != key:
+            continue
+
+        for py in range(max(y - 1, 0), min(y + 2, h)):
+            for px in range(max(x - 1, 0), min(x + 2, w)):
+                if (py != y or px != x) and (dis[py, px] == -1 or dis[py, px] > key + 1) and \
+                        _can_move(walkable, walkable_diagonally, can_squeeze, y, x, py, px):
+                    dis[py, px] = key + 1
+                    queue[tail] = (py, px)
+                    keys[tail] = key + 1
+                    tail += 1
+
+    return dis
+
+
+class Walkability:
+    """ Movement rules on a level (arguments of `utils.bfs`), the arrays are frozen (read-only) """
+
+    def __init__(self, walkable, walkable_diagonally, can_squeeze):
+        walkable.setflags(write=False)
+        walkable_diagonally.setflags(write=False)
+        self.walkable = walkable
+        self.walkable_diagonally = walkable_diagonally
+        self.can_squeeze = bool(can_squeeze)
+        self.key = (np.packbits(walkable).tobytes(), np.packbits(walkable_diagonally).tobytes(), self.can_squeeze)
+
+
+class DistanceCache:
+    """ LRU cache of BFS distance maps keyed by the source and the walkability (not the step or the level,
+    the same walkability gives the same distances).
+
+    Returned distances are shared (read-only), copy them before modifying. When the walkability
+    changed only in a few cells since the last map of the same source (e.g. a monster moved), the old map
+    is repaired with `repair_distances` instead of running the whole BFS again.
+    """
+
+    def __init__(self, max_entries=64, max_repair_changes=32):
+        self.max_entries = max_entries
+        self.max_repair_changes = max_repair_changes
+        self._entries = OrderedDict()  # (y, x, walkability key) -> (distances, walkability)
+        self._latest = {}  # (y, x) -> the most recent entry key of the source
+
+    def _repair(self, y, x, walkability):
+        latest = self._entries.get(self._latest.get((y, x)))
+        if latest is None:
+            return None
+        old_dis, old = latest
+        if old.can_squeeze != walkability.can_squeeze:
+            return None
+        changes = np.count_nonzero(old.walkable != walkability.walkable) + \
+                  np.count_nonzero(old.walkable_diagonally != walkability.walkable_diagonally)
+        if changes > self.max_repair_changes:
+            return None
+        return repair_distances(old_dis, old.walkable, old.walkable_diagonally,
+                                walkability.walkable, walkability.walkable_diagonally, walkability.can_squeeze,
+                                y, x)
+
+    def lookup(self, y, x, walkability):
+        """ Returns cached distances from (y, x) or None (nothing is computed) """
+        key = (int(y), int(x), walkability.key)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, y, x, walkability):
+        """ Returns `utils.bfs` distances from (y, x) """
+        y, x = int(y), int(x)
+        dis = self.lookup(y, x, walkability)
+        if dis is not None:
+            return dis
+        key = (y, x, walkability.key)
+
+        dis = self._repair(y, x, walkability)
+        if dis is None:
+            dis = utils.bfs(y, x, walkable=walkability.walkable, walkable_diagonally=walkability.walkable_diagonally,
+                            can_squeeze=walkability.can_squeeze)
+        dis.setflags(write=False)
+        self._entries[key] = (dis, walkability)
+        self._latest[(y, x)] = key
+        if len(self._entries) > self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            if self._latest.get(old_key[:2]) == old_key:
+                del self._latest[old_key[:2]]
+        return dis
+
+    def clear(self):
+        self._entries.clear()
+        self._latest.clear()
@@ -7,6 +7,7 @@ import shutil
 import sys
 import tempfile
 import termios
+import time
 import tty
 from pathlib import Path
 from pprint import pprint
@@ -14,6 +15,10 @@ import h5py
 
 import nle.nethack as nh
 
+from autoascend import checkpoint as checkpoint_lib
+from autoascend.action_log import ActionLog
+from autoascend.exceptions import AgentTimeout, ShadowDivergence
+from autoascend.history import EpisodeHistory
 from autoascend.visualization import visualizer
 from autoascend import agent as agent_lib  # the library can be reloaded in `reload_agent` function
 
@@ -63,12 +68,23 @@ class ReloadAgent(KeyboardInterrupt):
 
 class EnvWrapper:
     def __init__(self, env, to_skip=0, visualizer_args=dict(enable=False),
-                 step_limit=None, agent_args={}, interactive=False):
+                 step_limit=None, time_limit=None, agent_args={}, interactive=False,
+                 checkpoint_path=None, checkpoint_every=None, shadow_log=None, memory_profiler=None,
+                 history_args={}):
         self.env = env
         self.agent_args = agent_args
         self.interactive = interactive
         self.to_skip = to_skip
         self.step_limit = step_limit
+        self.time_limit = time_limit  # in seconds, measured from `reset`
+        self.deadline = None
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every  # in steps
+        self._next_checkpoint_step = None
+        self.resumed_step = None
+        # `ActionLog` to verify that the agent makes the same decisions (see `step`)
+        self.shadow_log = shadow_log
+        self.memory_profiler = memory_profiler  # `simulation.memory.MemoryProfiler`
         self.visualizer = None
         if visualizer_args['enable']:
             visualizer_args.pop('enable')
@@ -82,17 +98,32 @@ class EnvWrapper:
 
         self.is_done = False
 
-        self.history = []
+        # `EpisodeHistory` arguments, None disables recording
+        self.history = EpisodeHistory(**history_args) if history_args is not None else None
+        self.actions = bytearray()  # indices of actions in `env.actions`
 
     def _init_agent(self):
         self.agent = agent_lib.Agent(self, **self.agent_args)
 
-    def main(self):
-        self.reset()
+    def main(self, checkpoint=None):
+        """ `checkpoint` -- a loaded checkpoint (see `checkpoint.py`) to resume the episode from """
+        if self.memory_profiler is not None:
+            self.memory_profiler.start()
+        if checkpoint is not None:
+            self.agent = checkpoint_lib.restore_checkpoint(self, checkpoint)
+            self.resumed_step = self.step_count
+        else:
+            self.reset()
+        if self.checkpoint_every is not None:
+            self._next_checkpoint_step = self.step_count + self.checkpoint_every
         while 1:
             try:
-                self._init_agent()
-                self.agent.main()
+                if self.agent is None:
+                    self._init_agent()
+                    self.agent.main()
+                else:
+                    # restored from the checkpoint
+                    self.agent.main(resumed=True)
                 break
             except ReloadAgent:
                 pass
@@ -109,7 +140,11 @@ class EnvWrapper:
         self.end_reason = ''
         self.last_observation = obs
         self.is_done = False
-        self.history = []
+        if self.history is not None:
+            self.history.clear()
+        self.actions = bytearray()
+        if self.time_limit is not None:
+            self.deadline = time.perf_counter() + self.time_limit
 
         if self.agent is not None:
             self.render()
@@ -297,7 +332,45 @@ class EnvWrapper:
                 action = actions[0]
                 return action
 
+    def check_limits(self):
+        """ Stops the episode (through the whole agent stack) if the step or time budget is exhausted """
+        if self.step_limit is not None and self.step_count > self.step_limit:
+            self.end_reason = self.end_reason or 'steplimit'
+            raise AgentTimeout(self.end_reason)
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            self.end_reason = self.end_reason or 'timeout'
+            raise AgentTimeout(self.end_reason)
+
+    def maybe_checkpoint(self):
+        """ Saves a checkpoint every `checkpoint_every` steps (postponed until the agent is in a consistent state) """
+        if self.checkpoint_path is None or self._next_checkpoint_step is None or \
+                self.step_count < self._next_checkpoint_step or not self.agent.can_checkpoint:
+            return
+        self._next_checkpoint_step = self.step_count + self.checkpoint_every
+        try:
+            checkpoint_lib.save_checkpoint(self.checkpoint_path, self)
+        except Exception as e:
+            # the episode shouldn't fail because of the checkpoint
+            print(f'Seed {self.env.get_seeds()}, step {self.step_count}: checkpoint failed: {e!r}')
+
+    def get_action_log(self):
+        return ActionLog(self.env.get_seeds(), self.actions)
+
+    def check_shadow(self, action_index):
+        if self.step_count >= len(self.shadow_log):
+            self.end_reason = 'shadow: end of the log'
+            raise ShadowDivergence(self.end_reason)
+        expected = self.shadow_log.actions[self.step_count]
+        if action_index != expected:
+            self.end_reason = (f'shadow: divergence at step {self.step_count}: '
+                               f'{self.env.actions[action_index]!r} instead of {self.env.actions[expected]!r} '
+                               f'(strategy: {self.agent.current_strategy})')
+            raise ShadowDivergence(self.end_reason)
+
     def step(self, agent_action):
+        self.check_limits()
+        self.maybe_checkpoint()
+
         if self.visualizer is not None and self.visualizer.video_writer is None:
             self.visualizer.step(self.last_observation, repr(chr(int(agent_action))))
 
@@ -327,20 +400,18 @@ class EnvWrapper:
                 self.visualizer.step(self.last_observation, repr(chr(int(agent_action))))
             action = agent_action
         
-        log_dict = {
-            'step': self.step_count,
-            'tty_chars': self.last_observation['tty_chars'],
-            'tty_colors': self.last_observation['tty_colors'],
-            'tty_cursor': self.last_observation['tty_cursor'],
-            'strategy': self.agent.current_strategy,
-            'act': action,
-        }
-        
-        self.history.append(log_dict)
-        
-        obs, reward, done, info = self.env.step(self.env.actions.index(action))
+        if self.history is not None:
+            self.history.append(self.step_count, self.last_observation, self.agent.current_strategy, action)
+
+        action_index = self.env.actions.index(action)
+        if self.shadow_log is not None:
+            self.check_shadow(action_index)
+        self.actions.append(action_index)
+        obs, reward, done, info = self.env.step(action_index)
         self.score += reward
         self.step_count += 1
+        if self.memory_profiler is not None:
+            self.memory_profiler.maybe_sample(self.step_count)
         # if not done:
         #     agent_lib.G.assert_map(obs['glyphs'], obs['chars'])
 
@@ -363,12 +434,6 @@ class EnvWrapper:
             self.end_reason = info['end_status'].name + ': ' + \
                               (' '.join(first_sentence[:first_sentence.index('in')]) + '. ' +
                                '.'.join(end_reason.split('.')[1:]).strip()).strip()
-        if self.step_limit is not None and self.step_count == self.step_limit + 1:
-            self.end_reason = self.end_reason or 'steplimit'
-            done = True
-        elif self.step_limit is not None and self.step_count > self.step_limit + 1:
-            assert 0
-
         self.last_observation = obs
 
         if done:
@@ -392,7 +457,7 @@ class EnvWrapper:
         return contextlib.suppress()
 
     def get_summary(self):
-        return {
+        summary = {
             'score': self.score,
             'steps': self.env._steps,
             'turns': self.agent.blstats.time,
@@ -403,5 +468,9 @@ class EnvWrapper:
             'character': str(self.agent.character).split()[0],
             'end_reason': self.end_reason,
             'seed': self.env.get_seeds(),
+            'resumed_step': self.resumed_step,
             **self.agent.stats_logger.get_stats_dict(),
         }
+        if self.memory_profiler is not None:
+            summary.update(self.memory_profiler.summary(self))
+        return summary
@@ -2,6 +2,16 @@ class AgentFinished(Exception):
     pass
 
 
+class AgentTimeout(AgentFinished):
+    # it inherits from AgentFinished, so the agent stops the episode the same way as when the game ends
+    pass
+
+
+class ShadowDivergence(AgentFinished):
+    # the agent running in the shadow mode chose a different action than the replayed log (see `EnvWrapper.step`)
+    pass
+
+
 class AgentPanic(Exception):
     pass
 
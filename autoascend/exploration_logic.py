@@ -112,9 +112,9 @@ class ExplorationLogic:
         go_to_strategy(y, x).run()
         assert (self.agent.blstats.y, self.agent.blstats.x) == (y, x)
         while self.agent.has_pet:
-            if utils.any_in(self.agent.glyphs[max(self.agent.blstats.y - 1, 0) : self.agent.blstats.y + 2,
-                                              max(self.agent.blstats.x - 1, 0) : self.agent.blstats.x + 2],
-                            G.PETS):
+            if G.mask(self.agent.glyph_features[max(self.agent.blstats.y - 1, 0) : self.agent.blstats.y + 2,
+                                                max(self.agent.blstats.x - 1, 0) : self.agent.blstats.x + 2],
+                      G.PETS).any():
                 break
             self.agent.move('.')
         self.agent.move(dir)
@@ -129,9 +129,9 @@ class ExplorationLogic:
             go_to_strategy(y, x).run()
             assert (self.agent.blstats.y, self.agent.blstats.x) == (y, x)
             while self.agent.has_pet:
-                if utils.any_in(self.agent.glyphs[max(self.agent.blstats.y - 1, 0) : self.agent.blstats.y + 2,
-                                                max(self.agent.blstats.x - 1, 0) : self.agent.blstats.x + 2],
-                                G.PETS):
+                if G.mask(self.agent.glyph_features[max(self.agent.blstats.y - 1, 0) : self.agent.blstats.y + 2,
+                                                    max(self.agent.blstats.x - 1, 0) : self.agent.blstats.x + 2],
+                          G.PETS).any():
                     break
                 self.agent.move('.')
             self.agent.move(dir)
@@ -249,7 +249,7 @@ class ExplorationLogic:
     def patrol(self):
         yielded = False
         while True:
-            reachable = self.agent.bfs()
+            reachable = self.agent.bfs().copy()
             reachable[reachable < 0] = 0
             if (reachable == 0).all():
                 if not yielded:
@@ -304,8 +304,8 @@ class ExplorationLogic:
         def to_visit_func():
             level = self.agent.current_level()
 
-            stone = ~level.seen & utils.isin(self.agent.glyphs, G.STONE)
-            doors = utils.isin(self.agent.glyphs, G.DOOR_CLOSED) & (level.door_open_count < door_open_count)
+            stone = ~level.seen & self.agent.glyph_mask(G.STONE)
+            doors = self.agent.glyph_mask(G.DOOR_CLOSED) & (level.door_open_count < door_open_count)
             if not stone.any() and not doors.any():
                 return stone
 
@@ -342,17 +342,19 @@ class ExplorationLogic:
                     self.agent._allow_attack_all_turn = self.agent._last_turn
 
             # is_on_corridor = utils.isin(level.objects, G.CORRIDOR)
-            is_on_door = utils.isin(level.objects, G.DOORS)
+            is_on_door = self.agent.object_mask(G.DOORS)
+            stone_mask = self.agent.object_mask(G.STONE)
+            wall_mask = self.agent.object_mask(G.WALL)
 
             stones = np.zeros((C.SIZE_Y, C.SIZE_X), np.int32)
             walls = np.zeros((C.SIZE_Y, C.SIZE_X), np.int32)
 
-            tmp = np.zeros((C.SIZE_Y, C.SIZE_X), dtype=self.agent.glyphs.dtype)
+            tmp = np.zeros((C.SIZE_Y, C.SIZE_X), dtype=bool)
             for dy in [-1, 0, 1]:
                 for dx in [-1, 0, 1]:
                     if dy != 0 or dx != 0:
-                        stones += utils.isin(utils.translate(level.objects, dy, dx, out=tmp), G.STONE)
-                        walls += utils.isin(utils.translate(level.objects, dy, dx, out=tmp), G.WALL)
+                        stones += utils.translate(stone_mask, dy, dx, out=tmp)
+                        walls += utils.translate(wall_mask, dy, dx, out=tmp)
 
             prio += (is_on_door & (stones > 3)) * 250
             prio += (np.stack([utils.translate(level.walkable, y, x, out=tmp).astype(np.int32)
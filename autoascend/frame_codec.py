@@ -0,0 +1,98 @@
+import numpy as np
+
+# encoded frame arrays, the frame i is decoded from the keyframe i // keyframe_interval and diffs of the following frames
+ENCODED_FIELDS = ('keyframe_chars', 'keyframe_colors', 'diff_count', 'diff_index', 'diff_chars', 'diff_colors')
+
+
+def encode_frames(chars, colors, keyframe_interval=64):
+    """ Delta-encodes a sequence of tty frames (`chars` and `colors` of shape (n, rows, columns)).
+
+    Every `keyframe_interval`-th frame (starting with the first one) is stored in full, other frames as a list
+    of cells (flat indices) that differ from the previous frame with their new values. Consecutive screens usually
+    differ in a handful of cells. Encoded sequences with lengths divisible by `keyframe_interval` can be concatenated
+    field by field (see `concatenate_encoded`).
+    """
+    n = len(chars)
+    flat_chars = chars.reshape(n, -1)
+    flat_colors = colors.reshape(n, -1)
+    assert flat_chars.shape[1] < 2 ** 16
+
+    changed = np.zeros(flat_chars.shape, bool)
+    np.not_equal(flat_chars[1:], flat_chars[:-1], out=changed[1:])
+    changed[1:] |= flat_colors[1:] != flat_colors[:-1]
+    key_rows = np.arange(0, n, keyframe_interval)
+    changed[key_rows] = False
+    rows, cells = np.nonzero(changed)
+
+    return {
+        'keyframe_chars': chars[key_rows],
+        'keyframe_colors': colors[key_rows],
+        'diff_count': np.bincount(rows, minlength=n).astype(np.uint16),
+        'diff_index': cells.astype(np.uint16),
+        'diff_chars': flat_chars[rows, cells],
+        'diff_colors': flat_colors[rows, cells],
+    }
+
+
+def concatenate_encoded(encoded):
+    return {k: np.concatenate([e[k] for e in encoded]) for k in ENCODED_FIELDS}
+
+
+class FrameDecoder:
+    """ Random access to delta-encoded frames (see `encode_frames`).
+
+    Arrays may be anything sliceable into numpy arrays (e.g. h5py datasets), only the needed parts are read.
+    Decoding a range costs reading its keyframe and the diffs since it, so keep `keyframe_interval` short
+    if the frames are sampled randomly.
+    """
+
+    def __init__(self, encoded, keyframe_interval):
+        self.encoded = encoded
+        self.keyframe_interval = keyframe_interval
+        diff_count = np.asarray(encoded['diff_count'][:], np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(diff_count)])
+        self.frame_shape = tuple(encoded['keyframe_chars'].shape[1:])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def decode(self, start=0, stop=None):
+        """ Returns (chars, colors) of frames start:stop """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return (np.zeros((0, *self.frame_shape), self.encoded['keyframe_chars'].dtype),
+                    np.zeros((0, *self.frame_shape), self.encoded['keyframe_colors'].dtype))
+
+        interval = self.keyframe_interval
+        first = start // interval * interval
+        n = stop - first
+        key_rows = np.arange(0, n, interval)
+        keyframes = slice(first // interval, (stop - 1) // interval + 1)
+        lo, hi = self.offsets[first], self.offsets[stop]
+        rows = np.repeat(np.arange(n), np.diff(self.offsets[first:stop + 1]))
+        cells = np.asarray(self.encoded['diff_index'][lo:hi], np.int64)
+
+        # every cell takes the value of its last write (a keyframe or a diff)
+        last_write = np.zeros((n, np.prod(self.frame_shape)), np.int32)
+        last_write[key_rows] = key_rows[:, None]
+        last_write[rows, cells] = rows
+        np.maximum.accumulate(last_write, axis=0, out=last_write)
+        last_write = last_write[start - first:]
+        cell_range = np.arange(last_write.shape[1])
+
+        ret = []
+        for name in ['chars', 'colors']:
+            frames = np.zeros((n, last_write.shape[1]), self.encoded[f'keyframe_{name}'].dtype)
+            frames[key_rows] = np.asarray(self.encoded[f'keyframe_{name}'][keyframes]).reshape(len(key_rows), -1)
+            frames[rows, cells] = self.encoded[f'diff_{name}'][lo:hi]
+            ret.append(frames[last_write, cell_range].reshape(-1, *self.frame_shape))
+        return tuple(ret)
+
+    def __getitem__(self, i):
+        chars, colors = self.decode(i, i + 1)
+        return chars[0], colors[0]
+
+
+def decode_frames(encoded, keyframe_interval):
+    """ Decodes the whole encoded sequence into (chars, colors) """
+    return FrameDecoder(encoded, keyframe_interval).decode()
@@ -165,14 +165,14 @@ class GlobalLogic:
 
     def update(self):
         if not self.agent.character.prop.hallu:
-            if utils.isin(self.agent.glyphs, G.ORACLE).any():
+            if self.agent.glyph_mask(G.ORACLE).any():
                 if self.oracle_level is None:
                     self.oracle_level = self.agent.current_level().key()
                 else:
                     assert self.oracle_level == self.agent.current_level().key()
 
             if self.agent.current_level().dungeon_number == Level.GNOMISH_MINES and \
-                    utils.isin(self.agent.glyphs, G.SHOPKEEPER).any():
+                    self.agent.glyph_mask(G.SHOPKEEPER).any():
                 if self.minetown_level is None:
                     self.minetown_level = self.agent.current_level().key()
                 else:
@@ -182,7 +182,7 @@ class GlobalLogic:
     @Strategy.wrap
     def solve_sokoban_strategy(self):
         # TODO: refactor
-        if not utils.isin(self.agent.current_level().objects, G.TRAPS).any():
+        if not self.agent.object_mask(G.TRAPS).any():
             yield False
         yield True
         self.agent.current_strategy = "solve_sokoban_strategy"
@@ -224,7 +224,7 @@ class GlobalLogic:
                 self.agent.exploration.explore1(None).run()
 
         while 1:
-            wall_map = utils.isin(self.agent.current_level().objects, G.WALL)
+            wall_map = self.agent.object_mask(G.WALL)
             for smap, answer in soko_solver.maps.items():
                 sokomap = soko_solver.convert_map(smap)
                 offset = np.array(min(zip(*wall_map.nonzero()))) - \
@@ -239,7 +239,7 @@ class GlobalLogic:
             possible_mimics = set()
             last_resort_move = None
             for (y, x), (dy, dx) in answer:
-                boulder_map = utils.isin(self.agent.glyphs, G.BOULDER)
+                boulder_map = self.agent.glyph_mask(G.BOULDER)
                 mask = boulder_map[offset[0] : offset[0] + sokomap.sokomap.shape[0],
                                    offset[1] : offset[1] + sokomap.sokomap.shape[1]]
                 ty, tx = offset[0] + y - dy, offset[1] + x - dx,
@@ -266,7 +266,7 @@ class GlobalLogic:
 
                                 def clear_neighbors():
                                     to_visit_mask[self.agent.blstats.y, self.agent.blstats.x] = 0
-                                    to_visit_mask[utils.isin(self.agent.glyphs, G.VISIBLE_FLOOR)] = 0
+                                    to_visit_mask[self.agent.glyph_mask(G.VISIBLE_FLOOR)] = 0
                                     return not to_visit_mask[vy, vx]
 
                                 self.agent.go_to(vy, vx, callback=clear_neighbors)
@@ -277,7 +277,7 @@ class GlobalLogic:
                     possible_mimics = set()
                     last_resort_move = None
 
-                    if not utils.isin(self.agent.current_level().objects, G.TRAPS).any():
+                    if not self.agent.object_mask(G.TRAPS).any():
                         return
 
                 else:
@@ -337,12 +337,12 @@ class GlobalLogic:
     @utils.debug_log('identify_items_on_altar')
     @Strategy.wrap
     def identify_items_on_altar(self):
-        mask = utils.isin(self.agent.current_level().objects, G.ALTAR)
+        mask = self.agent.object_mask(G.ALTAR)
         if not mask.any():
             yield False
 
         dis = self.agent.bfs()
-        mask &= dis != -1
+        mask = mask & (dis != -1)
         if not mask.any():
             yield False
 
@@ -371,7 +371,7 @@ class GlobalLogic:
             yield False
 
         dis = self.agent.bfs()
-        mask = utils.isin(self.agent.current_level().objects, G.FOUNTAIN) & (dis != -1)
+        mask = self.agent.object_mask(G.FOUNTAIN) & (dis != -1)
         if not mask.any():
             yield False
 
@@ -492,7 +492,7 @@ class GlobalLogic:
     @utils.debug_log('follow_guard')
     @Strategy.wrap
     def follow_guard(self):
-        if not utils.isin(self.agent.glyphs, G.GUARD).any():
+        if not self.agent.glyph_mask(G.GUARD).any():
             yield False
 
         if any(item.category == nh.COIN_CLASS for item in flatten_items(self.agent.inventory.items)):
@@ -504,7 +504,7 @@ class GlobalLogic:
             self.agent.inventory.arrange_items().run()
             return
 
-        ys, xs = utils.isin(self.agent.glyphs, G.GUARD).nonzero()
+        ys, xs = self.agent.glyph_mask(G.GUARD).nonzero()
         y, x = ys[0], xs[0]
 
         if utils.adjacent((y, x), (self.agent.blstats.y, self.agent.blstats.x)):
@@ -551,7 +551,7 @@ class GlobalLogic:
             elif self.milestone == Milestone.SOLVE_SOKOBAN:
                 # TODO: fix the condition, monster can destroy doors
                 condition = lambda: self.agent.current_level().key() == (Level.SOKOBAN, 1) and \
-                                    not utils.isin(self.agent.current_level().objects, G.DOOR_CLOSED).any()
+                                    not self.agent.object_mask(G.DOOR_CLOSED).any()
                 level = (Level.SOKOBAN, 1)
 
             elif self.milestone == Milestone.FIND_MINES_END:
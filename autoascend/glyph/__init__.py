@@ -1,4 +1,5 @@
 import nle.nethack as nh
+import numpy as np
 
 from . import monster as MON
 from . import screen_symbols as SS
@@ -106,6 +107,28 @@ class G:  # Glyphs
 
     DICT = {k: v for k, v in locals().items() if not k.startswith('_')}
 
+    @classmethod
+    def bits(cls, *categories):
+        """ Bitmask of `PROPERTIES` of any of the categories (sets of `G`) """
+        ret = np.uint64(0)
+        for category in categories:
+            ret |= cls.CATEGORY_BITS[category]
+        return ret
+
+    @classmethod
+    def features(cls, glyphs):
+        """ Glyph feature plane -- properties of every glyph of the array (-1 has no properties) """
+        return cls.PROPERTIES[glyphs]
+
+    @classmethod
+    def mask(cls, features, *categories):
+        """ Same as `utils.isin(glyphs, *categories)` for a feature plane of the glyphs """
+        return (features & cls.bits(*categories)) != 0
+
+    @classmethod
+    def isin(cls, glyphs, *categories):
+        return cls.mask(cls.features(glyphs), *categories)
+
     @classmethod
     def assert_map(cls, glyphs, chars):
         for glyph, char in zip(glyphs.reshape(-1), chars.reshape(-1)):
@@ -116,3 +139,13 @@ class G:  # Glyphs
 
 G.INV_DICT = {i: [k for k, v in G.DICT.items() if i in v]
               for i in set.union(*map(set, G.DICT.values()))}
+
+# bit i of `G.PROPERTIES[glyph]` is set if the glyph belongs to the i-th category of `G.DICT`,
+# the additional last entry is for -1 (an unknown glyph, e.g. in `Level.objects`)
+G.CATEGORY_BITS = {}
+G.PROPERTIES = np.zeros(nh.MAX_GLYPH + 1, np.uint64)
+assert len(G.DICT) <= 64
+for i, category in enumerate(G.DICT.values()):
+    G.CATEGORY_BITS.setdefault(category, np.uint64(0))
+    G.CATEGORY_BITS[category] |= np.uint64(1 << i)
+    G.PROPERTIES[list(category)] |= np.uint64(1 << i)
@@ -0,0 +1,165 @@
+from pathlib import Path
+
+import numpy as np
+
+from autoascend.frame_codec import decode_frames, encode_frames
+
+
+class EpisodeHistory:
+    """ Per-step record of the screen (tty), the action and the strategy of an episode.
+
+    Steps are stored in preallocated chunks of contiguous arrays (`FIELDS`), strategies are int-coded
+    (see `strategy_names`). With `max_steps` only (at least) the last `max_steps` steps are kept and the arrays
+    of dropped chunks are reused. With `spill_dir` every full chunk is saved there (`chunk_<n>.npz`) and released
+    from memory, so the whole trajectory is kept at a constant memory cost. With `sink` every full chunk
+    is passed to `sink(chunk)` (a dict of arrays, valid only during the call) and released, `flush` passes
+    the last partial chunk (e.g. see `simulation.dataset.EpisodeWriter`).
+    With `keyframe_interval` screens of full chunks are delta-encoded (see `frame_codec.encode_frames`),
+    which makes them an order of magnitude smaller, also in the ring, on the disk and in the sink.
+    """
+
+    TTY_SHAPE = (24, 80)  # NLE terminal
+    FIELDS = {
+        'step': ((), np.int32),
+        'tty_chars': (TTY_SHAPE, np.uint8),
+        'tty_colors': (TTY_SHAPE, np.int8),
+        'tty_cursor': ((2,), np.uint8),
+        'strategy': ((), np.int16),
+        'act': ((), np.uint8),
+    }
+    CHUNK_SIZE = 1024  # default number of steps in a chunk
+
+    def __init__(self, chunk_size=CHUNK_SIZE, max_steps=None, spill_dir=None, sink=None, keyframe_interval=None):
+        assert sum(x is not None for x in [max_steps, spill_dir, sink]) <= 1, \
+            'ring mode, spilling to disk and sink are exclusive'
+        assert keyframe_interval is None or chunk_size % keyframe_interval == 0, \
+            'every chunk has to start with a keyframe'
+        self.chunk_size = chunk_size
+        self.keyframe_interval = keyframe_interval
+        self.max_steps = max_steps
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self.sink = sink
+        self.strategy_names = []
+        self._strategy_codes = {}
+        self.clear()
+
+    def clear(self):
+        self._chunks = []  # in-memory chunks, the last one is being filled
+        self._free_chunks = []
+        self._fill = self.chunk_size  # number of steps in the last chunk
+        self._first_index = 0  # index of the first step in the memory
+        self._spilled_chunks = 0
+        if self.spill_dir is not None:
+            for path in self.spill_dir.glob('chunk_*.npz'):
+                path.unlink()
+
+    def __len__(self):
+        """ Number of recorded steps (including dropped and spilled ones) """
+        return self._first_index + (len(self._chunks) - 1) * self.chunk_size + self._fill if self._chunks \
+            else self._first_index
+
+    def _new_chunk(self):
+        if self._free_chunks:
+            return self._free_chunks.pop()
+        return {k: np.zeros((self.chunk_size, *shape), dtype) for k, (shape, dtype) in self.FIELDS.items()}
+
+    def _release(self, chunk):
+        if 'tty_chars' in chunk:
+            self._free_chunks.append(chunk)
+
+    def _encoded(self, chunk, size):
+        """ Returns the first `size` steps of a raw chunk with delta-encoded screens """
+        ret = encode_frames(chunk['tty_chars'][:size], chunk['tty_colors'][:size], self.keyframe_interval)
+        ret.update({k: chunk[k][:size].copy() for k in self.FIELDS if k not in ('tty_chars', 'tty_colors')})
+        return ret
+
+    def _decoded(self, chunk):
+        if 'tty_chars' in chunk:
+            return chunk
+        ret = {k: chunk[k] for k in self.FIELDS if k not in ('tty_chars', 'tty_colors')}
+        ret['tty_chars'], ret['tty_colors'] = decode_frames(chunk, self.keyframe_interval)
+        return ret
+
+    def _on_full_chunk(self):
+        if self.keyframe_interval is not None:
+            chunk = self._chunks[-1]
+            self._chunks[-1] = self._encoded(chunk, self.chunk_size)
+            self._release(chunk)
+
+        if self.sink is not None:
+            self.sink(self._chunks[0])
+            self._release(self._chunks.pop(0))
+            self._first_index += self.chunk_size
+        elif self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            np.savez(self.spill_dir / f'chunk_{self._spilled_chunks}.npz', **self._chunks[0])
+            self._spilled_chunks += 1
+            self._release(self._chunks.pop(0))
+            self._first_index += self.chunk_size
+        elif self.max_steps is not None:
+            while (len(self._chunks) - 1) * self.chunk_size >= self.max_steps:
+                self._release(self._chunks.pop(0))
+                self._first_index += self.chunk_size
+
+    def flush(self):
+        """ Passes the steps in the memory to the sink (call it at the end of the episode) """
+        assert self.sink is not None
+        if self._chunks and self._fill:
+            chunk = self._chunks.pop()
+            if self.keyframe_interval is not None:
+                self.sink(self._encoded(chunk, self._fill))
+            else:
+                self.sink({k: v[:self._fill] for k, v in chunk.items()})
+            self._release(chunk)
+            self._first_index += self._fill
+        self._fill = self.chunk_size
+
+    def strategy_code(self, strategy):
+        code = self._strategy_codes.get(strategy)
+        if code is None:
+            code = self._strategy_codes[strategy] = len(self.strategy_names)
+            self.strategy_names.append(strategy)
+        return code
+
+    def append(self, step, observation, strategy, action):
+        if self._fill == self.chunk_size:
+            if self._chunks:
+                self._on_full_chunk()
+            self._chunks.append(self._new_chunk())
+            self._fill = 0
+        chunk, i = self._chunks[-1], self._fill
+        chunk['step'][i] = step
+        chunk['tty_chars'][i] = observation['tty_chars']
+        chunk['tty_colors'][i] = observation['tty_colors']
+        chunk['tty_cursor'][i] = observation['tty_cursor']
+        chunk['strategy'][i] = self.strategy_code(strategy)
+        chunk['act'][i] = int(action)
+        self._fill += 1
+
+    def _iter_chunks(self):
+        """ Yields chunks trimmed to the filled part, in order (spilled ones are loaded from the disk) """
+        for n in range(self._spilled_chunks):
+            with np.load(self.spill_dir / f'chunk_{n}.npz') as data:
+                yield self._decoded({k: data[k] for k in data.files})
+        for i, chunk in enumerate(self._chunks):
+            size = self._fill if i == len(self._chunks) - 1 else self.chunk_size
+            yield {k: v[:size] for k, v in self._decoded(chunk).items()}
+
+    def arrays(self):
+        """ Returns a dict of arrays with all available steps (strategies are codes of `strategy_names`) """
+        chunks = list(self._iter_chunks())
+        if not chunks:
+            return {k: np.zeros((0, *shape), dtype) for k, (shape, dtype) in self.FIELDS.items()}
+        return {k: np.concatenate([c[k] for c in chunks]) for k in self.FIELDS}
+
+    def __iter__(self):
+        """ Yields per-step dicts (with the strategy name), mostly for debugging """
+        for chunk in self._iter_chunks():
+            for i in range(len(chunk['step'])):
+                ret = {k: chunk[k][i] for k in self.FIELDS}
+                ret['strategy'] = self.strategy_names[ret['strategy']]
+                yield ret
+
+    @property
+    def nbytes(self):
+        return sum(v.nbytes for chunk in self._chunks + self._free_chunks for v in chunk.values())
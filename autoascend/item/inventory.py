@@ -1213,13 +1213,13 @@ class Inventory:
     @utils.debug_log('inventory.check_items')
     @Strategy.wrap
     def check_items(self):
-        mask = utils.isin(self.agent.glyphs, G.OBJECTS, G.BODIES, G.STATUES)
+        mask = self.agent.glyph_mask(G.OBJECTS, G.BODIES, G.STATUES)
         if not mask.any():
             yield False
 
         dis = self.agent.bfs()
 
-        mask &= self.agent.current_level().item_count == 0
+        mask = mask & (self.agent.current_level().item_count == 0)
         if not mask.any():
             yield False
 
@@ -66,7 +66,8 @@ class InventoryItems:
         if force or self._previous_inv_strs is None or \
                 (self.agent.last_observation['inv_strs'] != self._previous_inv_strs).any():
             self._clear()
-            self._previous_inv_strs = self.agent.last_observation['inv_strs']
+            # observation buffers are reused (see `ObservationBuffers`)
+            self._previous_inv_strs = self.agent.last_observation['inv_strs'].copy()
             previous_inv_strs = self._previous_inv_strs
 
             # For some reasons sometime the inventory entries in last_observation may be duplicated
@@ -1,4 +1,5 @@
 from collections import defaultdict
+from functools import partial
 
 import numpy as np
 
@@ -41,7 +42,8 @@ class Level:
         self.stair_destination = {}  # {(y, x) -> ((dungeon, level), (y, x))}
         self.altars = {}  # {(y, x) -> alignment}
 
-        self.corpses_to_eat = defaultdict(lambda: defaultdict(lambda: -10000))  # {(y, x) -> {monster_id -> age_turn}}
+        # {(y, x) -> {monster_id -> age_turn}} (no lambdas, so that levels can be pickled in checkpoints)
+        self.corpses_to_eat = defaultdict(partial(defaultdict, partial(int, -10000)))
 
         # e.g. ad aerarium -- avoid valut entrance
         self.forbidden = np.zeros((C.SIZE_Y, C.SIZE_X), bool)
@@ -59,7 +61,7 @@ class Level:
             elems.append(G.STAIR_DOWN)
         if up:
             elems.append(G.STAIR_UP)
-        mask = utils.isin(self.objects, *elems)
+        mask = G.isin(self.objects, *elems)
         return {(y, x): self.stair_destination.get((y, x), None) for y, x in zip(*mask.nonzero())}
 
     def is_light_level(self):
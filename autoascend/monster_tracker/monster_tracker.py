@@ -18,9 +18,10 @@ class MonsterTracker:
         self._last_glyphs = None
         self.peaceful_monster_mask = np.zeros((C.SIZE_Y, C.SIZE_X), bool)
         self.monster_mask = np.zeros((C.SIZE_Y, C.SIZE_X), bool)
+        self.agent.step_cache.clear()
 
     def take_all_monsters(self):
-        if utils.any_in(self.agent.glyphs, G.SWALLOW):
+        if self.agent.glyph_mask(G.SWALLOW).any():
             return {}
         with self.agent.atom_operation():
             self.agent.step(A.Command.WHATIS, iter(['M']))
@@ -46,9 +47,9 @@ class MonsterTracker:
         return monsters
 
     def _get_current_masks(self):
-        new_monster_mask = utils.isin(self.agent.glyphs, G.MONS, G.INVISIBLE_MON)
+        new_monster_mask = self.agent.glyph_mask(G.MONS, G.INVISIBLE_MON).copy()
         new_monster_mask[self.agent.blstats.y, self.agent.blstats.x] = 0
-        pet_mask = utils.isin(self.agent.glyphs, G.PETS)
+        pet_mask = self.agent.glyph_mask(G.PETS)
 
         return new_monster_mask, pet_mask
 
@@ -84,3 +85,4 @@ class MonsterTracker:
 
         assert (~self.peaceful_monster_mask | self.monster_mask).all()
         self._last_glyphs = self.agent.glyphs.copy()
+        self.agent.step_cache.clear()
@@ -0,0 +1,52 @@
+import numpy as np
+
+# observation keys read by the agent, the other ones (e.g. screen_descriptions, the biggest one) aren't copied
+AGENT_OBSERVATION_KEYS = ('glyphs', 'blstats', 'message', 'misc', 'specials', 'tty_chars', 'tty_cursor',
+                          'inv_glyphs', 'inv_letters', 'inv_oclasses', 'inv_strs')
+
+
+class ObservationBuffers:
+    """ Preallocated copies of observations for the agent.
+
+    NLE overwrites its observation arrays in place on every step, so the agent has to keep copies. Only `keys`
+    are copied, into one of reused buffers (dicts of arrays, allocated on the first use).
+
+    Ownership: a buffer is owned by the agent as long as any of its arrays is referenced by one of the objects
+    passed as `in_use` to `copy` (e.g. `last_observation` and `_previous_glyphs`), otherwise it may be overwritten
+    by the next observation. Usually the current, the last and the previous observation are alive, so three buffers
+    are enough, more are allocated when needed. Whatever has to survive longer than these references
+    (e.g. to detect changes later) has to be copied.
+    """
+
+    def __init__(self, keys=AGENT_OBSERVATION_KEYS):
+        self.keys = keys
+        self._buffers = []
+        self._next = 0
+
+    @staticmethod
+    def _ids(in_use):
+        ret = set()
+        for obj in in_use:
+            if isinstance(obj, dict):
+                ret.update(map(id, obj.values()))
+            elif obj is not None:
+                ret.add(id(obj))
+        return ret
+
+    def _free_buffer(self, observation, in_use):
+        in_use_ids = self._ids(in_use)
+        for _ in range(len(self._buffers)):
+            buffer = self._buffers[self._next]
+            self._next = (self._next + 1) % len(self._buffers)
+            if not any(id(v) in in_use_ids for v in buffer.values()):
+                return buffer
+        buffer = {k: np.empty_like(observation[k]) for k in self.keys}
+        self._buffers.append(buffer)
+        return buffer
+
+    def copy(self, observation, in_use=()):
+        """ Returns a copy of the observation (only `keys`) in a buffer not referenced by `in_use` """
+        buffer = self._free_buffer(observation, in_use)
+        for k in self.keys:
+            np.copyto(buffer[k], observation[k])
+        return buffer
@@ -0,0 +1,6 @@
+from . import bench, profiling, warmup
+from .live_stats import LiveStats, P2Quantile, RunningMoments
+from .local_pool import LocalPool
+from .memory import MemoryProfiler
+from .results import ResultsStore, load_results, load_summaries, compact, merge
+from .scheduler import ROLE_SEED_SHIFT, DurationEstimator, EtaTracker, longest_first
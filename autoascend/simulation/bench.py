@@ -0,0 +1,112 @@
+import json
+import statistics
+from pathlib import Path
+
+# Pinned benchmark episodes: role -> base seeds (the first game of the role from the seed is used,
+# see `prepare_env` in bin/main.py). Don't change them, otherwise results aren't comparable with stored baselines.
+BENCH_SEEDS = {
+    'val': [0, 1],
+    'sam': [0, 1],
+    'wiz': [0, 1],
+    'hea': [0],
+    'arc': [0],
+}
+
+BENCH_VERSION = 1
+
+# metric -> whether higher values are better
+METRICS = {
+    'steps_per_second': True,
+    'turns_per_second': True,
+    'time_per_step': False,
+}
+
+
+def _ratio(a, b):
+    """ a / b, or nan if b is 0 (e.g. a trial that failed before its first step) """
+    return a / b if b else float('nan')
+
+
+def _metrics(duration, steps, turns):
+    return {
+        'duration': duration,
+        'steps': steps,
+        'turns': turns,
+        'steps_per_second': _ratio(steps, duration),
+        'turns_per_second': _ratio(turns, duration),
+        'time_per_step': _ratio(duration, steps),
+    }
+
+
+def episode_key(role, seed):
+    return f'{role}-{seed}'
+
+
+def aggregate(episodes):
+    """ Reduces timed episodes (dicts with role, seed, trial, duration, steps, turns) to a benchmark report.
+
+    Per seed the median over trials is reported (robust to a single disturbed trial).
+    The aggregate is computed from per-trial totals over all seeds, and the median of trials is taken as well.
+    """
+    per_seed = {}
+    for key in sorted({episode_key(e['role'], e['seed']) for e in episodes}):
+        trials = [e for e in episodes if episode_key(e['role'], e['seed']) == key]
+        per_seed[key] = {k: statistics.median(_metrics(e['duration'], e['steps'], e['turns'])[k] for e in trials)
+                         for k in ['duration', 'steps', 'turns', *METRICS]}
+        per_seed[key]['trials'] = len(trials)
+
+    trial_totals = []
+    for trial in sorted({e['trial'] for e in episodes}):
+        trial_episodes = [e for e in episodes if e['trial'] == trial]
+        trial_totals.append(_metrics(sum(e['duration'] for e in trial_episodes),
+                                     sum(e['steps'] for e in trial_episodes),
+                                     sum(e['turns'] for e in trial_episodes)))
+    total = {k: statistics.median(t[k] for t in trial_totals) for k in trial_totals[0]}
+    total['trials'] = len(trial_totals)
+    return {'per_seed': per_seed, 'aggregate': total}
+
+
+def compare(baseline, current, threshold=0.1):
+    """ Returns a list of (name, metric, baseline value, current value, relative change) of metrics
+    that are worse in `current` by more than `threshold` (relative).
+    """
+    pairs = [('aggregate', baseline['aggregate'], current['aggregate'])]
+    for key, stats in current['per_seed'].items():
+        if key in baseline['per_seed']:
+            pairs.append((key, baseline['per_seed'][key], stats))
+
+    regressions = []
+    for name, old, new in pairs:
+        for metric, higher_is_better in METRICS.items():
+            change = _ratio(new[metric], old[metric]) - 1
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append((name, metric, old[metric], new[metric], change))
+    return regressions
+
+
+def format_comparison(baseline, current):
+    lines = []
+    for key in ['step_limit', 'machine']:
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            lines.append(f'WARNING: different {key}: {baseline["meta"].get(key)} -> {current["meta"].get(key)}')
+    lines.append(f'{"":12s} ' + ' '.join(f'{m:>31s}' for m in METRICS))
+    names = ['aggregate'] + [k for k in current['per_seed'] if k in baseline['per_seed']]
+    for name in names:
+        old = baseline['aggregate'] if name == 'aggregate' else baseline['per_seed'][name]
+        new = current['aggregate'] if name == 'aggregate' else current['per_seed'][name]
+        lines.append(f'{name:12s} ' + ' '.join(
+            f'{old[m]:9.4g} -> {new[m]:9.4g} ({_ratio(new[m], old[m]) - 1:+6.1%})' for m in METRICS))
+    return lines
+
+
+def save_report(report, path):
+    with Path(path).open('w') as f:
+        json.dump({'version': BENCH_VERSION, **report}, f, indent=2)
+
+
+def load_report(path):
+    with Path(path).open('r') as f:
+        report = json.load(f)
+    if report.get('version') != BENCH_VERSION:
+        raise ValueError(f'{path}: unsupported benchmark report version: {report.get("version")}')
+    return report
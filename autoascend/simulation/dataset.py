@@ -0,0 +1,101 @@
+import os
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from autoascend.frame_codec import ENCODED_FIELDS, FrameDecoder
+
+# `EpisodeHistory` field -> dataset name, fields that aren't listed keep their names
+DATASET_NAMES = {
+    'act': 'action',
+    'keyframe_chars': 'tty_keyframe_chars',
+    'keyframe_colors': 'tty_keyframe_colors',
+    'diff_count': 'tty_diff_count',
+    'diff_index': 'tty_diff_index',
+    'diff_chars': 'tty_diff_chars',
+    'diff_colors': 'tty_diff_colors',
+}
+# datasets that don't have one entry per step
+UNALIGNED_DATASETS = tuple(DATASET_NAMES[k] for k in ENCODED_FIELDS if k != 'diff_count')
+
+
+class EpisodeWriter:
+    """ Writes the trajectory of a single episode into its own HDF5 file while the episode is played.
+
+    It's meant to be the sink of `EpisodeHistory` (see `write_chunk`), so only one history chunk is kept in memory.
+    Datasets are chunked along the steps with the history chunk size and compressed. The file is written under
+    a temporary name and renamed in `close`, so an existing episode file is always complete.
+    The layout of the group is the same as the one of the datasets created by the former `track_aa.py`
+    (`strategy` holds codes of `strategy_names`), unless screens are delta-encoded by the history
+    (`keyframe_interval`), then `tty_chars` and `tty_colors` are replaced by `tty_keyframe_*` and `tty_diff_*`
+    datasets and the interval is saved in the group attributes (use `read_frames`).
+    """
+
+    def __init__(self, path, name, chunk_size=1024, compression='lzf', keyframe_interval=None):
+        self.path = Path(path)
+        self.name = name
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.file = h5py.File(self.tmp_path, 'w')
+        self.group = self.file.create_group(name)
+        if keyframe_interval is not None:
+            self.group.attrs['keyframe_interval'] = keyframe_interval
+        self.length = 0
+
+    def write_chunk(self, chunk):
+        for field, data in chunk.items():
+            if field == 'step':
+                continue
+            name = DATASET_NAMES.get(field, field)
+            if name not in self.group:
+                self.group.create_dataset(name, shape=(0, *data.shape[1:]), maxshape=(None, *data.shape[1:]),
+                                          dtype=data.dtype, compression=self.compression,
+                                          chunks=True if name in UNALIGNED_DATASETS
+                                          else (self.chunk_size, *data.shape[1:]))
+            dataset = self.group[name]
+            dataset.resize(len(dataset) + len(data), axis=0)
+            dataset[len(dataset) - len(data):] = data
+        self.length += len(chunk['step'])
+
+    def close(self, strategy_names, summary, run_info):
+        self.group.create_dataset('strategy_names', data=np.array(strategy_names, dtype=h5py.string_dtype()))
+        self.group.create_dataset('score', data=summary['score'])
+        self.group.create_dataset('turns', data=summary['turns'])
+        self.group.create_dataset('steps', data=self.length)
+        self.group.create_dataset('run_info', data=run_info)
+        self.group.create_dataset('seed', data=summary['seed'])
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+def read_frames(group, start=0, stop=None):
+    """ Returns (tty_chars, tty_colors) of steps start:stop of an episode group, raw or delta-encoded """
+    if 'tty_chars' in group:
+        return group['tty_chars'][start:stop], group['tty_colors'][start:stop]
+    encoded = {k: group[DATASET_NAMES[k]] for k in ENCODED_FIELDS}
+    return FrameDecoder(encoded, int(group.attrs['keyframe_interval'])).decode(start, stop)
+
+
+def build_index(index_path, episode_paths):
+    """ Creates an HDF5 file linking groups of all episode files (external links, no data is copied),
+    so the dataset can be read as a single file (e.g. `f[seed]['tty_chars']`)
+    """
+    index_path = Path(index_path)
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    count = 0
+    with h5py.File(tmp_path, 'w') as f:
+        for path in sorted(episode_paths):
+            path = Path(path)
+            with h5py.File(path, 'r') as episode:
+                names = list(episode.keys())
+            for name in names:
+                f[name] = h5py.ExternalLink(os.path.relpath(path, index_path.parent), f'/{name}')
+                count += 1
+    os.replace(tmp_path, index_path)
+    return count
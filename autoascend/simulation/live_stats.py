@@ -0,0 +1,199 @@
+import numpy as np
+
+
+def _ratio(a, b):
+    """ a / b with numpy semantics for b == 0 (inf or nan) instead of ZeroDivisionError """
+    if b == 0:
+        return float('nan') if a == 0 else float('inf') if a > 0 else float('-inf')
+    return a / b
+
+
+class RunningMoments:
+    """ Running count, sum, mean and variance (Welford's algorithm) """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.
+        self.mean = 0.
+        self._m2 = 0.
+
+    def update(self, value):
+        self.count += 1
+        self.sum += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return (self._m2 / self.count) ** 0.5 if self.count else float('nan')
+
+
+class P2Quantile:
+    """ Streaming quantile estimate in O(1) memory and time (the P^2 algorithm by Jain & Chlamtac).
+    Exact for up to 5 values.
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self.count = 0
+        self._heights = []
+        self._pos = [0, 1, 2, 3, 4]
+        self._desired = [0, 2 * q, 4 * q, 2 + 2 * q, 4]
+        self._increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def update(self, value):
+        self.count += 1
+        h = self._heights
+        if len(h) < 5:
+            h.append(value)
+            h.sort()
+            return
+
+        n = self._pos
+        if value < h[0]:
+            h[0] = value
+            k = 0
+        elif value >= h[4]:
+            h[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= h[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in range(1, 4):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                new_h = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if not h[i - 1] < new_h < h[i + 1]:
+                    new_h = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = new_h
+                n[i] += d
+
+    @property
+    def value(self):
+        h = self._heights
+        if not h:
+            return float('nan')
+        if self.count <= 5:
+            return float(np.quantile(h, self.q))
+        return h[2]
+
+
+class LiveStats:
+    """ Statistics of a simulation sweep updated in (amortized) O(1) per episode.
+
+    Scores are kept in a growable array only for the bootstrap of the median score std, which is recomputed
+    in vectorized batches whenever the number of episodes grows by `bootstrap_growth` (so the total cost stays
+    linear in the number of episodes). The dashboard gets a bounded reservoir sample of episodes
+    (see `snapshot`) instead of all results. Episodes can be added with only the fields of `results.summarize`
+    (e.g. of resumed runs) with `sample=False`, then they aren't in the reservoir.
+    """
+
+    SCORE_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+    def __init__(self, reservoir_size=2000, bootstrap_samples=1024, bootstrap_growth=1.1, seed=0):
+        self.count = 0
+        self.duration = RunningMoments()
+        self.turns = RunningMoments()
+        self.score = RunningMoments()
+        self.panic_num = RunningMoments()
+        self.panic_num_median = P2Quantile(0.5)
+        self.score_quantiles = {q: P2Quantile(q) for q in self.SCORE_QUANTILES}
+        self.end_reasons = {'exceptions': 0, 'steplimit': 0, 'timeout': 0}
+
+        self._rng = np.random.RandomState(seed)
+        self._scores = np.zeros(1024, np.float64)
+
+        self.bootstrap_samples = bootstrap_samples
+        self.bootstrap_growth = bootstrap_growth
+        self.median_score_std = float('nan')
+        self._next_bootstrap = 1
+
+        self.reservoir_size = reservoir_size
+        self._reservoir = []
+        self._sampled = 0
+
+    def update(self, record, sample=True):
+        self.count += 1
+        self.duration.update(record['duration'])
+        self.turns.update(record['turns'])
+        self.score.update(record['score'])
+        self.panic_num.update(record['panic_num'])
+        self.panic_num_median.update(record['panic_num'])
+        for quantile in self.score_quantiles.values():
+            quantile.update(record['score'])
+
+        end_reason = record['end_reason']
+        if end_reason.startswith('exception'):
+            self.end_reasons['exceptions'] += 1
+        if end_reason.startswith('steplimit') or end_reason.startswith('ABORT'):
+            self.end_reasons['steplimit'] += 1
+        if end_reason.startswith('timeout'):
+            self.end_reasons['timeout'] += 1
+
+        if self.count > len(self._scores):
+            self._scores = np.concatenate([self._scores, np.zeros_like(self._scores)])
+        self._scores[self.count - 1] = record['score']
+        if self.count >= self._next_bootstrap:
+            self._bootstrap_median_std()
+            self._next_bootstrap = max(self.count + 1, int(self.count * self.bootstrap_growth))
+
+        # reservoir sampling (algorithm R)
+        if not sample:
+            return
+        self._sampled += 1
+        if len(self._reservoir) < self.reservoir_size:
+            self._reservoir.append(record)
+        else:
+            i = self._rng.randint(self._sampled)
+            if i < self.reservoir_size:
+                self._reservoir[i] = record
+
+    def _bootstrap_median_std(self, max_batch_elements=2 ** 22):
+        scores = self._scores[:self.count]
+        size = max(1, self.count // 2)
+        batch = max(1, max_batch_elements // size)
+        medians = []
+        for i in range(0, self.bootstrap_samples, batch):
+            n = min(batch, self.bootstrap_samples - i)
+            medians.append(np.median(scores[self._rng.randint(self.count, size=(n, size))], axis=1))
+        self.median_score_std = float(np.std(np.concatenate(medians)))
+
+    def snapshot(self, keys=('score', 'steps', 'turns', 'level_num', 'experience_level', 'milestone',
+                             'character')):
+        """ Returns a dict of lists (the format of `utils.plot_dashboard`) for a bounded sample of episodes """
+        return {k: [r[k] for r in self._reservoir] for k in keys}
+
+    def text(self, multi_count, total_duration):
+        """ `multi_count` -- number of episodes finished in this run (excluding resumed ones) """
+        count = self.count
+        score_q = {q: v.value for q, v in self.score_quantiles.items()}
+        text = []
+        text.append(f'count                         : {count}')
+        text.append(f'time_per_simulation           : {self.duration.mean}')
+        text.append(f'simulations_per_hour          : {_ratio(3600, self.duration.mean)}')
+        text.append(f'simulations_per_hour(multi)   : {_ratio(3600 * multi_count, total_duration)}')
+        text.append(f'time_per_turn                 : {_ratio(self.duration.sum, self.turns.sum)}')
+        text.append(f'turns_per_second              : {_ratio(self.turns.sum, self.duration.sum)}')
+        text.append(f'turns_per_second(multi)       : {_ratio(self.turns.sum, total_duration)}')
+        text.append(f'panic_num_per_game(median)    : {self.panic_num_median.value}')
+        text.append(f'panic_num_per_game(mean)      : {_ratio(self.panic_num.sum, count)}')
+        text.append(f'score_median                  : {score_q[0.5]:.1f} +/- '
+                    f'{self.median_score_std:.1f}')
+        text.append(f'score_mean                    : {self.score.mean:.1f} +/- '
+                    f'{_ratio(self.score.std, self.score.count ** 0.5):.1f}')
+        text.append(f'score_05-95                   : {score_q[0.05]} {score_q[0.95]}')
+        text.append(f'score_25-75                   : {score_q[0.25]} {score_q[0.75]}')
+        text.append(f'exceptions                    : {self.end_reasons["exceptions"]}')
+        text.append(f'steplimit                     : {self.end_reasons["steplimit"]}')
+        text.append(f'timeout                       : {self.end_reasons["timeout"]}')
+        return text
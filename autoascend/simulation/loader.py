@@ -0,0 +1,239 @@
+import multiprocessing
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from autoascend.simulation.dataset import read_frames
+
+FIELDS = ('tty_chars', 'tty_colors', 'tty_cursor', 'action', 'strategy')
+
+
+def _prefetch_loop(loader, batch_size, blocks_per_batch, seed, queue):
+    loader.rng = np.random.default_rng(seed)
+    while 1:
+        queue.put(loader.sample(batch_size, blocks_per_batch))
+
+
+class TransitionLoader:
+    """ Random access to transitions of a trajectory dataset (see `bin/generate_dataset.py`).
+
+    A global index of transitions of all episodes is built once (an index file with links to episodes or a single
+    file with episode groups, also the ones of the former `track_aa.py`). Strategies are mapped to codes
+    of `strategy_names` shared by all episodes.
+    Transitions are read in blocks of steps (HDF5 chunks of the episode). Blocks of uncompressed datasets are
+    memory-mapped directly from the episode files, so random access costs almost nothing. Compressed
+    or delta-encoded blocks are read and decoded as a whole and kept in an LRU cache of `cache_blocks` blocks,
+    for these `blocks_per_batch` in `sample` (drawing a batch from a few random blocks) is much faster
+    than uniform sampling.
+    """
+
+    def __init__(self, path, block_size=1024, cache_blocks=256, seed=None):
+        """ `block_size` -- block of datasets that aren't chunked """
+        self.path = Path(path)
+        self.default_block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.rng = np.random.default_rng(seed)
+        self._file = None
+        self._pid = None
+        self._build_index()
+
+    def _open(self):
+        # h5py handles can't be shared with forked processes
+        if self._pid != os.getpid():
+            self._file = h5py.File(self.path, 'r')
+            self._pid = os.getpid()
+            self._groups = {}
+            self._chunk_offsets = {}
+            self._file_maps = {}
+            self._cache = OrderedDict()
+        return self._file
+
+    def close(self):
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        self._file = None
+        self._pid = None
+
+    def _build_index(self):
+        f = self._open()
+        self.strategy_names = []
+        strategy_codes = {}
+
+        def code(name):
+            if name not in strategy_codes:
+                strategy_codes[name] = len(self.strategy_names)
+                self.strategy_names.append(name)
+            return strategy_codes[name]
+
+        self.episode_names = []
+        self._strategy_maps = []
+        lengths = []
+        block_sizes = []
+        for name in f.keys():
+            group = f[name]
+            length = len(group['action'])
+            if length == 0:
+                continue
+            if 'strategy_names' in group:
+                names = [s.decode() if isinstance(s, bytes) else s for s in group['strategy_names'][()]]
+                strategy_map = np.array([code(s) for s in names], np.int16)
+            else:
+                # strategy names stored in each step
+                strategy_map = {s: code(s.decode() if isinstance(s, bytes) else s)
+                                for s in np.unique(group['strategy'][()])}
+            chunks = group['action'].chunks
+            self.episode_names.append(name)
+            self._strategy_maps.append(strategy_map)
+            lengths.append(length)
+            block_sizes.append(chunks[0] if chunks is not None else self.default_block_size)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.block_sizes = np.array(block_sizes, np.int64)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def locate(self, indices):
+        """ Returns (episodes, steps) of global transition indices """
+        episodes = np.searchsorted(self.offsets, indices, side='right') - 1
+        return episodes, indices - self.offsets[episodes]
+
+    def _group(self, episode):
+        group = self._groups.get(episode)
+        if group is None:
+            group = self._groups[episode] = self._open()[self.episode_names[episode]]
+        return group
+
+    def _mapped(self, dataset, start, stop):
+        """ Returns a memory-mapped view of rows start:stop of a dataset, or None if the data isn't stored
+        as raw bytes or the rows aren't in a single chunk (datasets may be chunked differently than `action`)
+        """
+        if dataset.compression is not None or dataset.shuffle or dataset.fletcher32 or \
+                dataset.scaleoffset is not None or dataset.dtype.kind not in 'iub' or \
+                (dataset.chunks is not None and dataset.chunks[1:] != dataset.shape[1:]):
+            return None
+        key = (dataset.file.filename, dataset.name)
+        if key not in self._chunk_offsets:
+            if dataset.chunks is None:
+                offsets = [dataset.id.get_offset()]
+            else:
+                rows = dataset.chunks[0]
+                offsets = [dataset.id.get_chunk_info_by_coord((i * rows,) + (0,) * (dataset.ndim - 1)).byte_offset
+                           for i in range((len(dataset) + rows - 1) // rows)]
+            self._chunk_offsets[key] = offsets
+        offsets = self._chunk_offsets[key]
+        rows = dataset.chunks[0] if dataset.chunks is not None else len(dataset)
+        chunk = start // rows
+        if chunk != (stop - 1) // rows or chunk >= len(offsets) or offsets[chunk] is None:
+            return None
+        if dataset.file.filename not in self._file_maps:
+            self._file_maps[dataset.file.filename] = np.memmap(dataset.file.filename, np.uint8, 'r')
+        row_shape = dataset.shape[1:]
+        row_bytes = dataset.dtype.itemsize * int(np.prod(row_shape))
+        begin = offsets[chunk] + (start - chunk * rows) * row_bytes
+        data = self._file_maps[dataset.file.filename][begin:begin + (stop - start) * row_bytes]
+        return data.view(dataset.dtype).reshape(stop - start, *row_shape)
+
+    def _read(self, dataset, start, stop):
+        ret = self._mapped(dataset, start, stop)
+        return ret if ret is not None else dataset[start:stop]
+
+    def _block(self, episode, block):
+        """ Returns arrays of FIELDS of the block (LRU cached) """
+        key = (episode, block)
+        ret = self._cache.get(key)
+        if ret is not None:
+            self._cache.move_to_end(key)
+            return ret
+
+        group = self._group(episode)
+        block_size = self.block_sizes[episode]
+        start = block * block_size
+        stop = min(start + block_size, self.offsets[episode + 1] - self.offsets[episode])
+        ret = {}
+        if 'tty_chars' in group:
+            ret['tty_chars'] = self._read(group['tty_chars'], start, stop)
+            ret['tty_colors'] = self._read(group['tty_colors'], start, stop)
+        else:
+            ret['tty_chars'], ret['tty_colors'] = read_frames(group, start, stop)
+        ret['tty_cursor'] = self._read(group['tty_cursor'], start, stop)
+        ret['action'] = self._read(group['action'], start, stop)
+        strategy_map = self._strategy_maps[episode]
+        if isinstance(strategy_map, dict):
+            names, inverse = np.unique(group['strategy'][start:stop], return_inverse=True)
+            ret['strategy'] = np.array([strategy_map[s] for s in names], np.int16)[inverse]
+        else:
+            ret['strategy'] = strategy_map[self._read(group['strategy'], start, stop)]
+
+        self._cache[key] = ret
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return ret
+
+    def get(self, indices):
+        """ Returns a dict of FIELDS arrays of transitions with given global indices """
+        indices = np.asarray(indices, np.int64)
+        episodes, steps = self.locate(indices)
+        blocks = steps // self.block_sizes[episodes]
+        keys = episodes * 2 ** 32 + blocks
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+
+        ret = None
+        for positions in np.split(order, bounds):
+            episode, block = episodes[positions[0]], blocks[positions[0]]
+            data = self._block(episode, block)
+            rows = steps[positions] - block * self.block_sizes[episode]
+            if ret is None:
+                ret = {k: np.empty((len(indices), *v.shape[1:]), v.dtype) for k, v in data.items()}
+            for k, v in data.items():
+                ret[k][positions] = v[rows]
+        return ret
+
+    def sample(self, batch_size, blocks_per_batch=None):
+        """ Returns a random minibatch (see `get`). With `blocks_per_batch` transitions are drawn from only
+        this number of random blocks (faster when the blocks have to be decoded, but less random)
+        """
+        if blocks_per_batch is None:
+            indices = self.rng.integers(0, len(self), batch_size)
+        else:
+            block_starts = self.rng.integers(0, len(self), blocks_per_batch)
+            episodes, steps = self.locate(block_starts)
+            block_sizes = self.block_sizes[episodes]
+            starts = self.offsets[episodes] + steps // block_sizes * block_sizes
+            stops = np.minimum(starts + block_sizes, self.offsets[episodes + 1])
+            which = self.rng.integers(0, blocks_per_batch, batch_size)
+            indices = starts[which] + (self.rng.random(batch_size) * (stops - starts)[which]).astype(np.int64)
+        return self.get(np.sort(indices))
+
+    def batches(self, batch_size, count=None, blocks_per_batch=None, workers=0, prefetch=8):
+        """ Yields `count` (infinitely many if None) random minibatches. With `workers` they are sampled
+        in forked processes in the background and up to `prefetch` batches are kept ready
+        """
+        if workers == 0:
+            n = 0
+            while count is None or n < count:
+                yield self.sample(batch_size, blocks_per_batch)
+                n += 1
+            return
+
+        self.close()
+        ctx = multiprocessing.get_context('fork')
+        queue = ctx.Queue(prefetch)
+        seeds = self.rng.integers(0, 2 ** 32, workers)
+        processes = [ctx.Process(target=_prefetch_loop, args=(self, batch_size, blocks_per_batch, seed, queue),
+                                 daemon=True) for seed in seeds]
+        for process in processes:
+            process.start()
+        try:
+            n = 0
+            while count is None or n < count:
+                yield queue.get()
+                n += 1
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
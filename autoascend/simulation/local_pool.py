@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import pickle
+import select
+import signal
+import sys
+import time
+import traceback
+from collections import deque
+from multiprocessing.connection import wait
+
+
+def _run(func, task):
+    try:
+        return func(*task), None
+    except BaseException as e:
+        return None, ''.join(traceback.format_exception(None, e, e.__traceback__))
+
+
+def _run_forked(func, task, timeout):
+    """ Runs the task in a child process forked from the current one (which keeps its pristine state) """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # child
+        os.close(read_fd)
+        try:
+            data = pickle.dumps(_run(func, task))
+        except BaseException as e:
+            data = pickle.dumps((None, ''.join(traceback.format_exception(None, e, e.__traceback__))))
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(data)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+    os.close(write_fd)
+    deadline = None if timeout is None else time.time() + timeout
+    chunks = []
+    with os.fdopen(read_fd, 'rb') as f:
+        while 1:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                return None, 'timeout (episode process killed)'
+            if not select.select([f], [], [], remaining)[0]:
+                continue
+            chunk = os.read(f.fileno(), 1 << 20)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    _, status = os.waitpid(pid, 0)
+    if not chunks:
+        return None, f'episode process died (status: {status})'
+    return pickle.loads(b''.join(chunks))
+
+
+def _worker_loop(func, conn, initializer, fork_per_task, timeout):
+    # make the worker a process group leader, so that killing the group kills also the forked episodes
+    os.setpgrp()
+    if initializer is not None:
+        initializer()
+    while 1:
+        task = conn.recv()
+        if task is None:
+            break
+        if fork_per_task:
+            conn.send(_run_forked(func, task, timeout))
+        else:
+            conn.send(_run(func, task))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, ctx, func, initializer, fork_per_task, timeout):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_loop, daemon=True,
+                                   args=(func, child_conn, initializer, fork_per_task, timeout))
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.start_time = None
+        self.episodes_done = 0
+
+    def submit(self, task):
+        self.task = task
+        self.start_time = time.time()
+        self.conn.send(task)
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            # the worker didn't manage to create its process group
+            pass
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class LocalPool:
+    """ A persistent pool of forked workers running `func(*task)` on a single machine.
+
+    Workers don't get a static share of tasks. Every idle worker is fed the next task from a central queue
+    as soon as it reports a result, so a few long episodes never block the rest of the sweep.
+    The driver enforces a hard per-task timeout (on top of the soft one in `single_simulation`) by killing
+    and respawning the worker. Pipes are used instead of a shared `multiprocessing.Queue`, so a killed worker
+    can't leave a lock held and stall the other workers.
+
+    `initializer` is called once in every worker. With `fork_per_task` the worker becomes a template process:
+    every task runs in a fresh child forked from it (so the state initialized once is shared and no state
+    leaks between tasks), and the worker itself kills the child after `timeout`.
+    """
+
+    def __init__(self, func, processes=None, timeout=None, max_tasks_per_worker=None,
+                 initializer=None, fork_per_task=False):
+        self.func = func
+        self.processes = processes or os.cpu_count()
+        self.timeout = timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.initializer = initializer
+        self.fork_per_task = fork_per_task
+        self._ctx = multiprocessing.get_context('fork')
+        self._workers = []
+
+    @property
+    def _driver_timeout(self):
+        if self.timeout is None:
+            return None
+        if self.fork_per_task:
+            # the template process kills the episode by itself, the driver is only a fallback
+            # (the margin includes the initialization of the worker)
+            return self.timeout + 120
+        return self.timeout
+
+    def _spawn(self):
+        worker = _Worker(self._ctx, self.func, self.initializer, self.fork_per_task, self.timeout)
+        self._workers.append(worker)
+        return worker
+
+    def imap_unordered(self, tasks):
+        """ Yields tuples (task, result, error) in the order of completion.
+        `error` is None if the task succeeded, otherwise it contains the reason of the failure.
+        """
+        pending = deque(tasks)
+        try:
+            while len(self._workers) < min(self.processes, len(pending)):
+                self._spawn()
+            for worker in self._workers:
+                if pending:
+                    worker.submit(pending.popleft())
+
+            while any(w.task is not None for w in self._workers):
+                busy = [w for w in self._workers if w.task is not None]
+                ready = wait([w.conn for w in busy] + [w.process.sentinel for w in busy], timeout=1)
+
+                for worker in busy:
+                    task = worker.task
+                    ret, error = None, None
+                    if worker.conn in ready:
+                        try:
+                            ret, error = worker.conn.recv()
+                        except EOFError:
+                            worker.process.join()
+                            error = f'worker died (exitcode: {worker.process.exitcode})'
+                    elif worker.process.sentinel in ready:
+                        worker.process.join()
+                        error = f'worker died (exitcode: {worker.process.exitcode})'
+                    elif self._driver_timeout is not None and \
+                            time.time() - worker.start_time > self._driver_timeout:
+                        error = 'timeout (worker killed)'
+                        worker.kill()
+                    else:
+                        continue
+
+                    worker.task = None
+                    worker.episodes_done += 1
+                    if self.max_tasks_per_worker is not None and worker.episodes_done >= self.max_tasks_per_worker \
+                            and worker.process.is_alive():
+                        worker.stop()
+                    if not worker.process.is_alive():
+                        self._workers.remove(worker)
+                        worker = self._spawn() if pending else None
+                    if worker is not None and pending:
+                        worker.submit(pending.popleft())
+
+                    yield task, ret, error
+        finally:
+            self.close()
+
+    def close(self):
+        for worker in self._workers:
+            if worker.task is not None:
+                worker.kill()
+            else:
+                worker.stop()
+        self._workers = []
@@ -0,0 +1,116 @@
+import os
+import resource
+import tracemalloc
+
+import numpy as np
+
+
+def current_rss():
+    """ Resident set size of the process in bytes """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # not Linux, fall back to the peak
+        return max_rss()
+
+
+def max_rss():
+    """ Peak resident set size of the process (during its whole lifetime) in bytes """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _nbytes(obj):
+    return sum(v.nbytes for v in vars(obj).values() if isinstance(v, np.ndarray))
+
+
+def object_counts(env):
+    """ Sizes of the structures that grow during an episode (`env` is an `EnvWrapper`) """
+    agent = env.agent
+    counts = {'actions': len(env.actions)}
+    if env.history is not None:
+        counts.update({'history': len(env.history), 'history_mb': round(env.history.nbytes / 2 ** 20, 2)})
+    if agent is not None:
+        levels = list(agent.levels.values())
+        counts.update({
+            'message_history': len(agent._message_history),
+            'gold_log': len(agent.stats_logger.gold),
+            'levels': len(levels),
+            'level_item_cells': sum(int((level.item_count != 0).sum()) for level in levels),
+            'level_arrays_mb': round(sum(_nbytes(level) for level in levels) / 2 ** 20, 2),
+            'panics': len(agent.all_panics),
+        })
+    return counts
+
+
+class MemoryProfiler:
+    """ Samples RSS, traced allocations (tracemalloc) and object counts of an episode every `every` steps.
+
+    tracemalloc slows the agent down noticeably, so it's used only on request (see `--memory-profile`).
+    Allocation sites are reported both by the size at the end of the episode and by the growth since
+    the first sample, which points to leaks.
+    """
+
+    def __init__(self, every=1000, top=10, trace_frames=1):
+        self.every = every
+        self.top = top
+        self.trace_frames = trace_frames
+        self.samples = []  # [step, rss_mb, traced_mb]
+        self.peak_rss = 0
+        self._first_snapshot = None
+        self._started_tracing = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+            self._started_tracing = True
+        self._first_snapshot = None
+        self.samples = []
+        self.peak_rss = current_rss()
+
+    def sample(self, step):
+        rss = current_rss()
+        self.peak_rss = max(self.peak_rss, rss)
+        traced, _ = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        self.samples.append([step, round(rss / 2 ** 20, 1), round(traced / 2 ** 20, 1)])
+        if self._first_snapshot is None and tracemalloc.is_tracing():
+            self._first_snapshot = tracemalloc.take_snapshot()
+
+    def maybe_sample(self, step):
+        if step % self.every == 0:
+            self.sample(step)
+
+    @staticmethod
+    def _format_stats(stats, top, size_attr, count_attr):
+        ret = []
+        for stat in stats[:top]:
+            frame = stat.traceback[0]
+            ret.append([f'{frame.filename}:{frame.lineno}', round(getattr(stat, size_attr) / 2 ** 10, 1),
+                        getattr(stat, count_attr)])
+        return ret
+
+    def summary(self, env):
+        """ Takes the last sample, stops tracing (if it was started here) and returns fields of the episode summary """
+        self.sample(env.step_count)
+        ret = {
+            'memory_peak_rss_mb': round(self.peak_rss / 2 ** 20, 1),
+            'memory_process_max_rss_mb': round(max_rss() / 2 ** 20, 1),
+            'memory_samples': self.samples,
+            'memory_objects': object_counts(env),
+        }
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            ])
+            # [site, KiB, number of blocks]
+            ret['memory_top_allocations'] = self._format_stats(
+                snapshot.statistics('lineno'), self.top, 'size', 'count')
+            if self._first_snapshot is not None:
+                ret['memory_top_growth'] = self._format_stats(
+                    snapshot.compare_to(self._first_snapshot, 'lineno'), self.top, 'size_diff', 'count_diff')
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self._first_snapshot = None
+        return ret
@@ -0,0 +1,173 @@
+import json
+from pathlib import Path
+
+# functions of strategy and callback wrappers that only obscure call stacks
+WRAPPER_FUNCTIONS = ('f', 'f2', 'run', 'wrapper')
+# agent functions at which call stacks are cut in the cumulative view
+AGENT_ROOT_FUNCTIONS = ('step', 'preempt', 'call_update_functions')
+
+
+def collapse_stack(frames, mode, root_path=None):
+    """ Shortens a pyinstrument call stack (a list of 'function\\0module\\0line' identifiers, from the root).
+
+    'cumulative' -- drops strategy/callback wrappers and starts the stack at the innermost `Agent.step`,
+        `Agent.preempt` or `Agent.call_update_functions`, so the time of a function is summed over
+        all the places (strategies) it's called from.
+    'total' -- starts the stack at the innermost frame inside `root_path`.
+    The first frame (the root) is kept.
+    """
+    ret_frames = []
+    for frame in frames[1:][::-1]:
+        func, module, line = frame.split('\0')
+        if mode == 'cumulative':
+            if func in WRAPPER_FUNCTIONS:
+                continue
+            ret_frames.append(frame)
+            if module.endswith('agent.py') and func in AGENT_ROOT_FUNCTIONS:
+                break
+        elif mode == 'total':
+            ret_frames.append(frame)
+            if str(Path(module).absolute()).startswith(str(root_path)):
+                break
+        else:
+            assert 0, mode
+    ret_frames.append(frames[0])
+    return ret_frames[::-1]
+
+
+def collapse_records(session, mode, root_path=None):
+    """ Returns a list of (collapsed stack, time in seconds), merging identical stacks """
+    times = {}
+    for frames, t in session.frame_records:
+        key = tuple(collapse_stack(frames, mode, root_path))
+        times[key] = times.get(key, 0) + t
+    return [(list(frames), t) for frames, t in times.items()]
+
+
+def collapse_session(session, mode, root_path=None):
+    """ Returns a copy of a pyinstrument session with collapsed stacks (see `collapse_stack`)
+    and times in percents of the session duration
+    """
+    from pyinstrument.session import Session
+
+    records = [(frames, t / session.duration * 100) for frames, t in collapse_records(session, mode, root_path)]
+    return Session(frame_records=records, start_time=session.start_time, duration=session.duration,
+                   sample_count=session.sample_count, start_call_stack=[session.start_call_stack[0]],
+                   program=session.program, cpu_time=session.cpu_time)
+
+
+def compact_session(session):
+    """ Merges records with identical stacks (in place), so merging many sessions doesn't grow without bound """
+    times = {}
+    for frames, t in session.frame_records:
+        key = tuple(frames)
+        times[key] = times.get(key, 0) + t
+    session.frame_records = [(list(frames), t) for frames, t in times.items()]
+    return session
+
+
+def merge_sessions(session, other):
+    """ `session` may be None """
+    from pyinstrument.session import Session
+
+    if session is None:
+        return compact_session(other)
+    return compact_session(Session.combine(session, other))
+
+
+def session_report(session, root_path, color=True):
+    """ Returns the text report of a (possibly merged) session in both views of `collapse_stack` """
+    from pyinstrument.renderers import ConsoleRenderer
+
+    return '\n'.join([
+        'Cumulative time:',
+        ConsoleRenderer(unicode=True, color=color).render(collapse_session(session, 'cumulative')),
+        'Total time:',
+        ConsoleRenderer(unicode=True, color=color, show_all=True).render(
+            collapse_session(session, 'total', root_path)),
+    ])
+
+
+def _frame_label(frame):
+    func, module, line = frame.split('\0')
+    return f'{func} ({module}:{line})'
+
+
+def collapsed_stacks(session, mode, root_path=None):
+    """ Returns lines of the collapsed stack format (`frame;frame;... microseconds`), that is understood by
+    flamegraph.pl, speedscope and other tools, and is easy to diff between versions
+    """
+    lines = []
+    for frames, t in sorted(collapse_records(session, mode, root_path)):
+        lines.append(';'.join(_frame_label(f).replace(';', ',') for f in frames) + f' {round(t * 1e6)}')
+    return lines
+
+
+def speedscope_profile(session, name, root_path=None):
+    """ Returns the session in speedscope json format (https://www.speedscope.app), with both views
+    of `collapse_stack` as separate profiles
+    """
+    frames = []
+    frame_index = {}
+    profiles = []
+    for mode in ['cumulative', 'total']:
+        samples, weights = [], []
+        for stack, t in collapse_records(session, mode, root_path):
+            sample = []
+            for frame in stack:
+                if frame not in frame_index:
+                    func, module, line = frame.split('\0')
+                    frame_index[frame] = len(frames)
+                    frames.append({'name': func, 'file': module, 'line': int(line) if line.isdigit() else 0})
+                sample.append(frame_index[frame])
+            samples.append(sample)
+            weights.append(t)
+        profiles.append({'type': 'sampled', 'name': f'{name} ({mode})', 'unit': 'seconds',
+                         'startValue': 0, 'endValue': sum(weights), 'samples': samples, 'weights': weights})
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'autoascend',
+        'shared': {'frames': frames},
+        'profiles': profiles,
+    }
+
+
+def export_session(session, output_dir, name, root_path=None, report=True):
+    """ Saves the session (loadable with `pyinstrument --load`), speedscope json, collapsed stacks of both views
+    and optionally the text report as `<output_dir>/<name>.*`
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with (output_dir / f'{name}.json').open('w') as f:
+        json.dump(session.to_json(), f)
+    with (output_dir / f'{name}.speedscope.json').open('w') as f:
+        json.dump(speedscope_profile(session, name, root_path), f)
+    for mode in ['cumulative', 'total']:
+        with (output_dir / f'{name}.{mode}.folded').open('w') as f:
+            f.writelines(line + '\n' for line in collapsed_stacks(session, mode, root_path))
+    if report:
+        with (output_dir / f'{name}.txt').open('w') as f:
+            f.write(session_report(session, root_path, color=False))
+
+
+class ProfileAggregator:
+    """ Merges per-episode profiles (pyinstrument sessions in json) into an aggregate and per-group sessions.
+    Every episode profile is exported to `<output_dir>/episodes` (see `export_session`).
+    """
+
+    def __init__(self, root_path, output_dir):
+        self.root_path = root_path
+        self.output_dir = Path(output_dir)
+        self.sessions = {}  # group -> merged session
+
+    def update(self, profile, name, groups=()):
+        from pyinstrument.session import Session
+
+        export_session(Session.from_json(profile), self.output_dir / 'episodes', name, self.root_path, report=False)
+        for group in ['all', *groups]:
+            self.sessions[group] = merge_sessions(self.sessions.get(group), Session.from_json(profile))
+
+    def save(self):
+        for group, session in self.sessions.items():
+            export_session(session, self.output_dir, group, self.root_path)
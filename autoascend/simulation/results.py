@@ -0,0 +1,229 @@
+import json
+import os
+from pathlib import Path
+
+
+def _json_default(v):
+    # numpy scalars and arrays
+    if hasattr(v, 'tolist'):
+        return v.tolist()
+    raise TypeError(f'Object of type {type(v).__name__} is not JSON serializable')
+
+
+# fields of summaries kept in the index (besides the seed, the status and the offset)
+SUMMARY_FIELDS = (('duration', float), ('character', str), ('turns', int), ('score', float), ('panic_num', int))
+
+
+def end_reason_class(end_reason):
+    """ Returns one of 'exception', 'timeout', 'steplimit', 'ok' """
+    if end_reason.startswith('exception'):
+        return 'exception'
+    if end_reason.startswith('timeout'):
+        return 'timeout'
+    if end_reason.startswith('steplimit') or end_reason.startswith('ABORT'):
+        return 'steplimit'
+    return 'ok'
+
+
+def summarize(record):
+    """ Returns the part of the record needed by `LiveStats` and `DurationEstimator` (see `ResultsStore.summaries`),
+    the end reason is replaced with its class and the character with the role
+    """
+    ret = {'seed': [record['seed'][0]], 'end_reason': end_reason_class(record['end_reason'])}
+    for k, _ in SUMMARY_FIELDS:
+        if k in record:
+            ret[k] = record[k]
+    if 'character' in ret:
+        ret['character'] = ret['character'][:3]
+    return ret
+
+
+def _dedup(records):
+    """ Keep only the last record for every seed (later runs supersede earlier ones) """
+    by_seed = {}
+    for record in records:
+        by_seed.pop(record['seed'][0], None)
+        by_seed[record['seed'][0]] = record
+    return list(by_seed.values())
+
+
+class ResultsStore:
+    """ Append-only simulation results, one json record (episode summary) per line.
+
+    Every record is written with a single `write` call to a file opened with O_APPEND, so a killed driver
+    leaves at most one truncated line at the end, which is ignored (and terminated) on the next run.
+    A sidecar `<path>.index` file holds `seed status end_offset` lines of completed episodes followed by
+    the fields of `summarize` (status is the class of the end reason), so resuming (`done_seeds`, `summaries`)
+    doesn't require parsing the (potentially large) records. The index is only a cache -- records appended
+    after the last indexed offset are re-indexed on load.
+    If a seed occurs multiple times, the last record wins.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.index')
+
+    def _iter_records(self, start=0):
+        """ Yields tuples (end_offset, record) """
+        try:
+            f = self.path.open('rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if line.endswith(b'\n'):
+                    try:
+                        yield offset + len(line), json.loads(line)
+                    except json.JSONDecodeError:
+                        print(f'{self.path}: skipping corrupted record at offset {offset}')
+                offset += len(line)
+
+    def load(self):
+        return _dedup(record for _, record in self._iter_records())
+
+    @staticmethod
+    def _parse_index_line(line):
+        """ Returns (seed, status, end_offset, summary), the summary is None in lines of older versions """
+        values = line.split()
+        seed, status, end_offset = int(values[0]), values[1], int(values[2])
+        summary = None
+        if len(values) == 3 + len(SUMMARY_FIELDS):
+            summary = {'seed': [seed], 'end_reason': status}
+            for (k, parse), v in zip(SUMMARY_FIELDS, values[3:]):
+                summary[k] = parse(v)
+        return seed, status, end_offset, summary
+
+    def _read_index(self):
+        entries = []
+        try:
+            with self.index_path.open('r') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    entries.append(self._parse_index_line(line))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    @staticmethod
+    def _index_line(record, end_offset):
+        summary = summarize(record)
+        values = [record['seed'][0], summary['end_reason'], end_offset]
+        if all(k in summary for k, _ in SUMMARY_FIELDS):
+            values.extend(summary[k] for k, _ in SUMMARY_FIELDS)
+        return ' '.join(map(str, values)) + '\n'
+
+    def _index(self):
+        """ Returns index entries (see `_parse_index_line`) of all records, indexing the ones not indexed yet """
+        entries = self._read_index()
+        start = entries[-1][2] if entries else 0
+        if not self.path.exists() or start > self.path.stat().st_size:
+            # stale index
+            self.index_path.unlink(missing_ok=True)
+            entries, start = [], 0
+
+        lines = [self._index_line(record, end_offset) for end_offset, record in self._iter_records(start)]
+        if lines:
+            _append(self.index_path, ''.join(lines).encode())
+        entries.extend(map(self._parse_index_line, lines))
+        return entries
+
+    def done_seeds(self, skip_exceptions=False):
+        """ Returns seeds of episodes present in the store.
+        If `skip_exceptions` is set, seeds whose last run finished with an exception are not returned.
+        """
+        status = {}
+        for seed, s, _, _ in self._index():
+            status[seed] = s
+        return {seed for seed, s in status.items() if not skip_exceptions or s != 'exception'}
+
+    def summaries(self):
+        """ Returns `summarize` of the last record of every seed. Records are parsed only if the index
+        was written by an older version (without summaries).
+        """
+        last = {}
+        for entry in self._index():
+            last.pop(entry[0], None)
+            last[entry[0]] = entry
+        ret = [summary for _, _, _, summary in last.values() if summary is not None]
+        legacy_offsets = {end_offset for _, _, end_offset, summary in last.values() if summary is None}
+        if legacy_offsets:
+            ret.extend(summarize(record) for end_offset, record in self._iter_records()
+                       if end_offset in legacy_offsets)
+        return ret
+
+    def append(self, record):
+        data = json.dumps(record, default=_json_default).encode() + b'\n'
+        end_offset = _append(self.path, data, fsync=True)
+        _append(self.index_path, self._index_line(record, end_offset).encode())
+
+
+def _append(path, data, fsync=False):
+    """ Appends data with a single write call and returns the file size after the write """
+    fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        size = os.fstat(fd).st_size
+        if size and os.pread(fd, 1, size - 1) != b'\n':
+            # terminate a truncated line left by a killed process
+            os.write(fd, b'\n')
+            size += 1
+        os.write(fd, data)
+        if fsync:
+            os.fsync(fd)
+        return size + len(data)
+    finally:
+        os.close(fd)
+
+
+def load_results(path):
+    """ Returns a list of records from either a results store (.jsonl) or a legacy results json (dict of lists) """
+    path = Path(path)
+    if path.suffix == '.json':
+        with path.open('r') as f:
+            res = json.load(f)
+        keys = list(res)
+        return _dedup(dict(zip(keys, values)) for values in zip(*[res[k] for k in keys]))
+    return ResultsStore(path).load()
+
+
+def load_summaries(path):
+    """ Returns `summarize` of records of either a results store or a legacy results json (see `load_results`) """
+    path = Path(path)
+    if path.suffix == '.json':
+        return [summarize(record) for record in load_results(path)]
+    return ResultsStore(path).summaries()
+
+
+def write_results(records, path):
+    """ Atomically (re)writes a results store, rebuilding its index """
+    store = ResultsStore(path)
+    tmp_path = store.path.with_name(store.path.name + '.tmp')
+    offset = 0
+    index = []
+    with tmp_path.open('wb') as f:
+        for record in records:
+            data = json.dumps(record, default=_json_default).encode() + b'\n'
+            f.write(data)
+            offset += len(data)
+            index.append(store._index_line(record, offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, store.path)
+    with store.index_path.open('w') as f:
+        f.writelines(index)
+
+
+def compact(path, output_path=None):
+    """ Removes superseded and corrupted records. Don't run it on a store that is being written to """
+    records = load_results(path)
+    write_results(records, output_path or path)
+    return len(records)
+
+
+def merge(paths, output_path):
+    """ Merges results stores (or legacy results json files). For duplicated seeds the last file wins """
+    records = _dedup(record for path in paths for record in load_results(path))
+    write_results(records, output_path)
+    return len(records)
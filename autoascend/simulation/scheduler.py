@@ -0,0 +1,91 @@
+import time
+from collections import defaultdict
+
+from .live_stats import RunningMoments
+
+# seeds that were shifted to match the requested role (see `prepare_env` in bin/main.py) keep the base seed modulo,
+# so base seeds of sweeps have to be smaller (see `parse_args` in bin/main.py)
+ROLE_SEED_SHIFT = 10 ** 9
+
+
+class DurationEstimator:
+    """ Expected episode durations based on results of previous runs.
+
+    The estimate for a seed is (in order of preference): the duration of the same seed (with the matching role),
+    the mean duration of the requested roles, the mean duration of all episodes, `default`.
+    """
+
+    def __init__(self, records=(), default=1.):
+        self.default = default
+        self._by_seed = defaultdict(dict)  # base seed -> {role -> duration}
+        self._by_role = defaultdict(RunningMoments)
+        self._all = RunningMoments()
+        for record in records:
+            self.update(record)
+
+    def update(self, record):
+        if 'duration' not in record:
+            # results from before the duration was recorded
+            return
+        role = record['character'][:3]
+        self._by_seed[record['seed'][0] % ROLE_SEED_SHIFT][role] = record['duration']
+        self._by_role[role].update(record['duration'])
+        self._all.update(record['duration'])
+
+    def estimate(self, seed, roles=None):
+        durations = self._by_seed.get(seed % ROLE_SEED_SHIFT, {})
+        durations = [d for role, d in durations.items() if roles is None or role in roles]
+        if durations:
+            return sum(durations) / len(durations)
+
+        if roles is not None:
+            role_stats = [self._by_role[role] for role in roles if role in self._by_role]
+            if role_stats:
+                return sum(s.sum for s in role_stats) / sum(s.count for s in role_stats)
+
+        if self._all.count:
+            return self._all.mean
+        return self.default
+
+
+def longest_first(seed_offsets, estimates):
+    """ Orders episodes by the expected duration, so that long games don't end up at the tail of the sweep.
+    The order of episodes with equal estimates is preserved.
+    """
+    return sorted(seed_offsets, key=lambda s: -estimates[s])
+
+
+class EtaTracker:
+    """ Estimates the remaining time of a sweep.
+
+    The remaining expected work is scaled by the ratio of actual to estimated durations of finished episodes
+    (estimates from another machine or agent version may be biased) and divided by `concurrency`
+    or, if it's not known, by the observed parallelism (the sum of durations of finished episodes per second
+    of wall time).
+    """
+
+    def __init__(self, estimates, concurrency=None):
+        self.concurrency = concurrency
+        self.estimates = dict(estimates)
+        self.remaining = sum(self.estimates.values())
+        self.start_time = time.time()
+        self._done_estimated = 0.
+        self._done_actual = 0.
+
+    def update(self, seed_offset, duration):
+        estimate = self.estimates.pop(seed_offset)
+        self.remaining -= estimate
+        self._done_estimated += estimate
+        self._done_actual += duration
+
+    def eta(self):
+        elapsed = time.time() - self.start_time
+        if not self._done_actual or not elapsed:
+            return None
+        if not self.estimates:
+            return 0.
+        bias = self._done_actual / self._done_estimated if self._done_estimated else 1.
+        parallelism = self._done_actual / elapsed
+        if self.concurrency is not None:
+            parallelism = min(self.concurrency, len(self.estimates))
+        return max(0., self.remaining) * bias / parallelism
@@ -0,0 +1,45 @@
+import time
+
+# duration of the `warmup` call in this process (None if it wasn't called)
+warmup_duration = None
+
+
+def warmup():
+    """ Does all the work that is otherwise repeated at the beginning of every episode in a fresh process:
+    imports the agent (that builds `glyph.G` and loads `objects.data`), compiles/loads numba kernels
+    by calling them on dummy data and loads NLE by creating an environment.
+    Processes forked afterwards get it all for free.
+    """
+    global warmup_duration
+    start_time = time.perf_counter()
+
+    import gym
+    import numpy as np
+
+    from .. import agent  # noqa: F401
+    from .. import utils
+    from ..distance_cache import DistanceCache, Walkability, repair_distances
+    from ..glyph import C, G
+    from ..monster_tracker import kernels
+
+    glyphs = np.zeros((C.SIZE_Y, C.SIZE_X), np.int16)
+    mask = np.zeros((C.SIZE_Y, C.SIZE_X), bool)
+    # `utils.bfs` is compiled lazily for every type of the coordinates
+    for coord_type in [int, np.int64, np.int32]:
+        utils.bfs(coord_type(0), coord_type(0), walkable=mask, walkable_diagonally=mask, can_squeeze=False)
+    # `Agent.bfs` passes read-only arrays, these are compiled separately too
+    walkability = Walkability(mask.copy(), mask.copy(), False)
+    dis = DistanceCache().get(0, 0, walkability)
+    repair_distances(dis, walkability.walkable, walkability.walkable_diagonally,
+                     walkability.walkable, walkability.walkable_diagonally, False, 0, 0)
+    utils.shortest_path(dis, 0, 0, 0, 0, 0)
+    utils.bfs_path(0, 0, 0, 0, walkability.walkable, walkability.walkable_diagonally, False, 0)
+    for elems in G.DICT.values():
+        utils.isin(glyphs, elems)
+    kernels.disappearance_mask(glyphs, glyphs, 1)
+    kernels.figure_out_monster_movement(glyphs, glyphs, glyphs, 2)
+
+    gym.make('NetHackChallenge-v0').close()
+
+    warmup_duration = time.perf_counter() - start_time
+    return warmup_duration
@@ -0,0 +1,211 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+# temporary directories of the parent process, kept alive in forked processes, so that they aren't removed there
+_inherited_tempdirs = []
+
+
+def _copy_vardir(nle_env):
+    """ Returns a private copy of the NetHack directory (a copy of the game writes level files there) """
+    vardir = tempfile.mkdtemp(prefix='nlesnapshot_')
+    shutil.copytree(nle_env._vardir, vardir, dirs_exist_ok=True)
+    return vardir
+
+
+def _reset_vardir(nle_env, vardir):
+    """ Makes a used copy of the NetHack directory equal to the snapshot's one again. Only files that differ
+    (in the size or the modification time, copies keep the original one) are copied, usually none or a few level files.
+    """
+    src = nle_env._vardir
+    for root, dirs, files in os.walk(vardir):
+        rel = os.path.relpath(root, vardir)
+        for name in files:
+            if not os.path.exists(os.path.join(src, rel, name)):
+                os.remove(os.path.join(root, name))
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        os.makedirs(os.path.join(vardir, rel), exist_ok=True)
+        for name in files:
+            src_stat = os.stat(os.path.join(root, name))
+            path = os.path.join(vardir, rel, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            if stat is None or stat.st_size != src_stat.st_size or stat.st_mtime_ns != src_stat.st_mtime_ns:
+                shutil.copy2(os.path.join(root, name), path)
+
+
+def _use_vardir(nle_env, vardir):
+    """ Switches the (forked) process to the directory """
+    _inherited_tempdirs.append(nle_env._tempdir)
+    nle_env._vardir = vardir
+    os.chdir(vardir)
+
+
+def _format_exception(e):
+    return ''.join(traceback.format_exception(None, e, e.__traceback__))
+
+
+def _fork():
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return os.fork()
+
+
+def _detach_side_effects(env):
+    """ A copy of the game mustn't write checkpoints, datasets, videos or compare actions with a log """
+    env.checkpoint_path = None
+    env.history = None
+    env.visualizer = None
+    env.shadow_log = None
+
+
+class GameSnapshot:
+    """ A frozen copy of the running game (NLE and the agent) that can be played from many times.
+
+    The snapshot is a process forked at creation, waiting in the middle of the agent code. `evaluate` runs a function
+    (e.g. plays a candidate action sequence) in a branch -- another fork of it, so the snapshot isn't changed.
+    A played branch can't be reused, so the next branch is forked (with its own copy of the NetHack directory) while
+    the current one runs, and finished branches exit in the background. Copies of the directory are recycled,
+    only files written by a finished branch are restored (see `_reset_vardir`). With more cores the fork overlaps
+    with the function. Measured on a single core with a 200 MB process and a 2 MB directory (not NLE): a snapshot and
+    4 branches running 20 ms each took 112 ms (139 ms with a fork and a copy of the directory per branch),
+    a branch of an empty function 3.7 ms (4.5 ms).
+    The game in this process isn't affected at all. Functions, their arguments and results are passed through a pipe,
+    so they have to be picklable (e.g. module level functions).
+    """
+
+    def __init__(self, env):
+        """ `env` -- `EnvWrapper` """
+        self.env = env
+        vardir = _copy_vardir(env.env.env)
+        self._conn, child_conn = multiprocessing.Pipe()
+        self.pid = _fork()
+        if self.pid == 0:
+            self._conn.close()
+            try:
+                _use_vardir(env.env.env, vardir)
+                _detach_side_effects(env)
+                self._serve(child_conn)
+            finally:
+                shutil.rmtree(vardir, ignore_errors=True)
+                os._exit(0)
+        child_conn.close()
+
+    def _fork_branch(self, free_vardirs):
+        """ Forks a branch process with a clean copy of the NetHack directory, waiting for a task.
+        Returns (pid, connection, directory).
+        """
+        vardir = free_vardirs.pop() if free_vardirs else _copy_vardir(self.env.env.env)
+        branch_conn, child_conn = multiprocessing.Pipe()
+        pid = _fork()
+        if pid == 0:
+            try:
+                branch_conn.close()
+                self._run_branch(child_conn, vardir)
+            finally:
+                os._exit(0)
+        child_conn.close()
+        return pid, branch_conn, vardir
+
+    def _run_branch(self, conn, vardir):
+        _use_vardir(self.env.env.env, vardir)
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args = task
+        try:
+            ret = (func(self.env, *args), None)
+        except BaseException as e:
+            ret = (None, _format_exception(e))
+        try:
+            # pickling errors happen before anything is written
+            conn.send(ret)
+        except BaseException as e:
+            conn.send((None, f'cannot send the result: {_format_exception(e)}'))
+
+    def _serve(self, conn):
+        free_vardirs = []
+        finished = []  # (pid, directory) of branches that may be still exiting
+        spare = None
+        try:
+            while 1:
+                try:
+                    task = conn.recv()
+                except EOFError:
+                    return
+                if task is None:
+                    return
+                if spare is None:
+                    spare = self._fork_branch(free_vardirs)
+                (pid, branch_conn, vardir), spare = spare, None
+                branch_conn.send(task)
+
+                # prepare the next branch while this one runs
+                for pid_vardir in list(finished):
+                    if os.waitpid(pid_vardir[0], os.WNOHANG)[0]:
+                        finished.remove(pid_vardir)
+                        _reset_vardir(self.env.env.env, pid_vardir[1])
+                        free_vardirs.append(pid_vardir[1])
+                spare = self._fork_branch(free_vardirs)
+
+                try:
+                    ret = branch_conn.recv()
+                except EOFError:
+                    ret = (None, f'branch process died (status: {os.waitpid(pid, 0)[1]})')
+                    pid = None
+                branch_conn.close()
+                conn.send(ret)
+                if pid is None:
+                    _reset_vardir(self.env.env.env, vardir)
+                    free_vardirs.append(vardir)
+                else:
+                    finished.append((pid, vardir))
+        finally:
+            if spare is not None:
+                pid, branch_conn, vardir = spare
+                branch_conn.close()
+                finished.append((pid, vardir))
+            for pid, vardir in finished:
+                os.waitpid(pid, 0)
+                free_vardirs.append(vardir)
+            for vardir in free_vardirs:
+                shutil.rmtree(vardir, ignore_errors=True)
+
+    def evaluate(self, func, *args):
+        """ Returns (func(env, *args), None) run on a fresh copy of the snapshot, or (None, traceback) on error """
+        assert self.pid is not None, 'snapshot closed'
+        self._conn.send((func, args))
+        return self._conn.recv()
+
+    def close(self):
+        if self.pid is None:
+            return
+        try:
+            self._conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._conn.close()
+        os.waitpid(self.pid, 0)
+        self.pid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def play_actions(env, actions, evaluate):
+    """ Plays actions with the agent and returns `evaluate(agent)` (see `Agent.lookahead`) """
+    for action in actions:
+        env.agent.step(action)
+    return evaluate(env.agent)
@@ -4,6 +4,11 @@ import numpy as np
 
 from . import character
 
+# columns of `strategy_stats` and `strategy_chain_stats` in the summary: wall time between env steps,
+# agent CPU time (process CPU time between env steps without the env steps), time inside env steps,
+# env steps and game turns
+STRATEGY_STATS_COLUMNS = ('wall', 'cpu', 'env', 'steps', 'turns')
+
 
 class StatsLogger:
     def __init__(self):
@@ -37,6 +42,15 @@ class StatsLogger:
 
         self.gold = []
 
+        # phase of `Agent.update_state` -> accumulated time (in seconds, including nested env steps),
+        # number of calls and number of env steps made inside the phase
+        self.phase_time = defaultdict(float)
+        self.phase_calls = defaultdict(int)
+        self.phase_steps = defaultdict(int)
+
+        # strategy chain (e.g. 'current_strategy/fight2') -> list of STRATEGY_STATS_COLUMNS values
+        self.strategy_chains = {}
+
     def log_cumulative_value(self, name, key, value):
         self._cumulative_values[name][key] += value
 
@@ -46,6 +60,29 @@ class StatsLogger:
     def log_gold(self, amount):
         self.gold.append(amount)
 
+    def log_phase(self, name, duration, steps, calls=1):
+        self.phase_time[name] += duration
+        self.phase_calls[name] += calls
+        self.phase_steps[name] += steps
+
+    def log_strategy_step(self, chain, wall, cpu, env, turns):
+        stats = self.strategy_chains.get(chain)
+        if stats is None:
+            stats = self.strategy_chains[chain] = [0., 0., 0., 0, 0]
+        stats[0] += wall
+        stats[1] += cpu
+        stats[2] += env
+        stats[3] += 1
+        stats[4] += turns
+
+    def get_strategy_stats(self):
+        """ Returns the stats aggregated by the innermost strategy of chains """
+        ret = {}
+        for chain, stats in self.strategy_chains.items():
+            name = chain.rsplit('/', 1)[-1]
+            ret[name] = [a + b for a, b in zip(ret.get(name, [0] * len(stats)), stats)]
+        return ret
+
     def log_max_value(self, name, value):
         self._max_values[name] = max(self._max_values[name], value)
 
@@ -54,6 +91,13 @@ class StatsLogger:
         ret.update(self._values)
         ret.update(self._max_values)
         ret.update({k: max(v.values()) for k, v in self._cumulative_values.items()})
+        for name in self.phase_time:
+            ret[f'phase_time_{name}'] = self.phase_time[name]
+            ret[f'phase_calls_{name}'] = self.phase_calls[name]
+            ret[f'phase_steps_{name}'] = self.phase_steps[name]
+        round_stats = lambda stats: [round(v, 4) if isinstance(v, float) else v for v in stats]
+        ret['strategy_stats'] = {k: round_stats(v) for k, v in self.get_strategy_stats().items()}
+        ret['strategy_chain_stats'] = {k: round_stats(v) for k, v in self.strategy_chains.items()}
 
         for stat in self.gold_stats:
             try:
@@ -0,0 +1,26 @@
+import numpy as np
+
+
+class StepCache:
+    """ Values derived from the current observation and the level map (e.g. masks), computed lazily once.
+
+    The agent clears it on every new observation and after every update of the level map (see `Agent.update`,
+    `Agent.update_level` and `MonsterTracker.update`). Cached arrays are read-only, copy them before modifying.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def get(self, key, func, *args):
+        """ Returns the value cached under `key`, or computes it with `func(*args)` """
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        value = self._values[key] = func(*args)
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+        return value
+
+    def clear(self):
+        self._values.clear()
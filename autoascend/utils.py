@@ -14,10 +14,13 @@ from .strategy import Strategy
 
 
 @nb.njit(cache=True)
-def bfs(y, x, *, walkable, walkable_diagonally, can_squeeze):
+def _bfs(y, x, to_y, to_x, walkable, walkable_diagonally, can_squeeze):
+    """ BFS distances, stopped when (to_y, to_x) is reached (all cells closer than it are final then) """
     dis = np.zeros(walkable.shape, dtype=np.int32)
     dis[:] = -1
     dis[y, x] = 0
+    if y == to_y and x == to_x:
+        return dis
 
     buf = np.zeros((walkable.shape[0] * walkable.shape[1], 2), dtype=np.uint32)
     index = 0
@@ -37,12 +40,56 @@ def bfs(y, x, *, walkable, walkable_diagonally, can_squeeze):
                               (can_squeeze or walkable[py, x] or walkable[y, px])))):
                         if dis[py, px] == -1:
                             dis[py, px] = dis[y, x] + 1
+                            if py == to_y and px == to_x:
+                                return dis
                             buf[size] = (py, px)
                             size += 1
 
     return dis
 
 
+@nb.njit(cache=True)
+def bfs(y, x, *, walkable, walkable_diagonally, can_squeeze):
+    return _bfs(y, x, -1, -1, walkable, walkable_diagonally, can_squeeze)
+
+
+@nb.njit(cache=True)
+def shortest_path(dis, from_y, from_x, to_y, to_x, seed):
+    """ Returns an array of (y, x) of a shortest path from (from_y, from_x) to (to_y, to_x) along `bfs`
+    distances from the former. Ties are broken uniformly at random (deterministically for the seed).
+    """
+    np.random.seed(seed)
+    length = dis[to_y, to_x]
+    assert length >= 0
+    path = np.zeros((length + 1, 2), dtype=np.int64)
+    candidates = np.zeros((8, 2), dtype=np.int64)
+    y, x = to_y, to_x
+    path[length] = (y, x)
+    for i in range(length - 1, -1, -1):
+        count = 0
+        for dy in [-1, 0, 1]:
+            for dx in [-1, 0, 1]:
+                py, px = y + dy, x + dx
+                if 0 <= py < dis.shape[0] and 0 <= px < dis.shape[1] and (dy != 0 or dx != 0) and \
+                        dis[py, px] == i:
+                    candidates[count] = (py, px)
+                    count += 1
+        assert count > 0
+        y, x = candidates[np.random.randint(0, count)]
+        path[i] = (y, x)
+    assert y == from_y and x == from_x
+    return path
+
+
+@nb.njit(cache=True)
+def bfs_path(y, x, to_y, to_x, walkable, walkable_diagonally, can_squeeze, seed):
+    """ `shortest_path` to (to_y, to_x) with the BFS terminated early, an empty array if it's unreachable """
+    dis = _bfs(y, x, to_y, to_x, walkable, walkable_diagonally, can_squeeze)
+    if dis[to_y, to_x] == -1:
+        return np.zeros((0, 2), dtype=np.int64)
+    return shortest_path(dis, y, x, to_y, to_x, seed)
+
+
 def translate(array, y_offset, x_offset, out=None):
     if out is None:
         out = np.zeros_like(array)
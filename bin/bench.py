@@ -0,0 +1,26 @@
+import sys
+from argparse import ArgumentParser
+
+from autoascend.simulation import bench
+
+
+def main():
+    parser = ArgumentParser(description='Compares benchmark reports (see `bin/main.py bench`). '
+                                        'Exits with status 1 if there is a regression')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown considered a regression')
+    args = parser.parse_args()
+
+    baseline = bench.load_report(args.baseline)
+    current = bench.load_report(args.current)
+    print('\n'.join(bench.format_comparison(baseline, current)))
+    regressions = bench.compare(baseline, current, args.threshold)
+    for name, metric, old, new, change in regressions:
+        print(f'REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
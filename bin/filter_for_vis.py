@@ -2,6 +2,8 @@ import json
 
 import pandas as pd
 
+from autoascend.simulation import load_results
+
 
 def interesting_reason(txt):
     return True
@@ -26,11 +28,10 @@ def interesting_reason(txt):
             and 'quit' not in txt)
 
 
-def process(path='/tmp/nh_sim.json'):
+def process(path='/tmp/nh_sim.jsonl'):
     ret = dict()
 
-    with open(path, 'r') as f:
-        df = pd.DataFrame(json.load(f))
+    df = pd.DataFrame.from_records(load_results(path))
     df['role'] = [ch[:3] for ch in df.character]
 
     for row in df.itertuples():
@@ -0,0 +1,103 @@
+import time
+import traceback
+from argparse import ArgumentParser
+from pathlib import Path
+
+import gym
+
+from autoascend.env_wrapper import EnvWrapper
+from autoascend.simulation import LocalPool, warmup
+from autoascend.simulation.dataset import EpisodeWriter, build_index
+
+
+def episode_path(args, seed):
+    return args.output_dir / 'episodes' / f'{seed}.hdf5'
+
+
+def generate_episode(args, seed):
+    """ Plays a single episode streaming its trajectory into the episode file """
+    start_time = time.time()
+    keyframe_interval = args.keyframe_interval or None
+    writer = EpisodeWriter(episode_path(args, seed), str(seed), chunk_size=args.chunk_size,
+                           compression=None if args.compression == 'none' else args.compression,
+                           keyframe_interval=keyframe_interval)
+    env = EnvWrapper(gym.make('NetHackChallenge-v0', character=args.character, no_progress_timeout=1000),
+                     time_limit=args.timeout,
+                     history_args=dict(chunk_size=args.chunk_size, sink=writer.write_chunk,
+                                       keyframe_interval=keyframe_interval))
+    try:
+        env.seed(seed, seed)
+        try:
+            env.main()
+            run_info = 'timeout' if env.end_reason == 'timeout' else 'success'
+        except Exception as e:
+            run_info = f"failed: {''.join(traceback.format_exception(None, e, e.__traceback__))}"
+        env.history.flush()
+        if env.agent is not None:
+            summary = env.get_summary()
+        else:
+            summary = {'score': env.score, 'turns': 0, 'seed': env.env.get_seeds()}
+        writer.close(env.history.strategy_names, summary, run_info)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        env.env.close()
+
+    return {'seed': seed, 'steps': writer.length, 'score': summary['score'], 'run_info': run_info,
+            'duration': time.time() - start_time}
+
+
+def main():
+    parser = ArgumentParser(description='Generates a dataset of agent trajectories (tty frames, actions, strategies). '
+                                        'Every episode is written to its own file by a pool of workers while it is '
+                                        'played, and the files are linked in a single index file at the end. '
+                                        'Existing episodes are skipped, so an interrupted run can be continued')
+    parser.add_argument('output_dir', type=Path)
+    parser.add_argument('-n', '--episodes', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first episode')
+    parser.add_argument('--workers', type=int, default=None, help='number of workers (default: number of CPUs)')
+    parser.add_argument('--character', default='mon-hum-neu')
+    parser.add_argument('--timeout', type=int, default=720, help='episode time limit in seconds')
+    parser.add_argument('--chunk-size', type=int, default=1024, help='number of steps in a HDF5 chunk')
+    parser.add_argument('--compression', choices=('lzf', 'gzip', 'none'), default='lzf')
+    parser.add_argument('--keyframe-interval', type=int, default=64,
+                        help='store screens as keyframes every this number of steps and diffs of changed cells '
+                             'between them (a divisor of --chunk-size, 0 stores raw screens)')
+    parser.add_argument('--prewarm', action='store_true',
+                        help='workers warm up the agent once, and fork a fresh process from that state for every '
+                             'episode')
+    parser.add_argument('--index', type=Path, default=None,
+                        help='path of the index file linking all episodes (default: <output_dir>/index.hdf5)')
+    args = parser.parse_args()
+    # every chunk starts with a keyframe
+    if args.keyframe_interval < 0 or (args.keyframe_interval and args.chunk_size % args.keyframe_interval):
+        parser.error('--keyframe-interval has to be 0 or a divisor of --chunk-size')
+
+    (args.output_dir / 'episodes').mkdir(parents=True, exist_ok=True)
+    seeds = [seed for seed in range(args.seed, args.seed + args.episodes) if not episode_path(args, seed).exists()]
+    print(f'episodes to generate: {len(seeds)} (already generated: {args.episodes - len(seeds)})')
+
+    pool = LocalPool(generate_episode, processes=args.workers, timeout=args.timeout + 120,
+                     initializer=warmup.warmup if args.prewarm else None, fork_per_task=args.prewarm)
+    start_time = time.time()
+    done = failed = steps = 0
+    for (_, seed), res, error in pool.imap_unordered([(args, seed) for seed in seeds]):
+        done += 1
+        if error is not None or res['run_info'] != 'success':
+            failed += 1
+            print(f'Seed {seed} failed:', error if error is not None else res['run_info'])
+        if res is not None:
+            steps += res['steps']
+        duration = time.time() - start_time
+        print(f'{done}/{len(seeds)} episodes, failed: {failed}, steps: {steps}, '
+              f'steps/s: {steps / duration:.0f}, episodes/h: {done / duration * 3600:.1f}')
+
+    index_path = args.index or args.output_dir / 'index.hdf5'
+    count = build_index(index_path, (args.output_dir / 'episodes').glob('*.hdf5'))
+    print(f'fail ratio: {failed / max(done, 1)}')
+    print(f'index of {count} episodes saved to {index_path}')
+
+
+if __name__ == '__main__':
+    main()
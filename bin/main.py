@@ -1,5 +1,8 @@
+import copy
 import json
-import multiprocessing
+import platform
+import queue
+import shutil
 import os
 import subprocess
 import sys
@@ -10,7 +13,6 @@ import tty
 import warnings
 from argparse import ArgumentParser
 from multiprocessing import Process, Queue
-from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from pprint import pprint
 
@@ -19,11 +21,23 @@ import nle.nethack as nh
 import numpy as np
 
 from autoascend import agent as agent_lib
+from autoascend import checkpoint as checkpoint_lib
+from autoascend.action_log import ActionLog, replay
 from autoascend.env_wrapper import EnvWrapper
+from autoascend.history import EpisodeHistory
+from autoascend.simulation import bench, profiling, MemoryProfiler, ROLE_SEED_SHIFT, DurationEstimator, EtaTracker, LiveStats, LocalPool, ResultsStore, load_summaries, \
+    longest_first, warmup
 from autoascend.utils import plot_dashboard
 
 
-def prepare_env(args, seed):
+def get_checkpoint_path(args, seed_offset):
+    if args.checkpoint_dir is None:
+        return None
+    return args.checkpoint_dir / f'{args.seed + seed_offset}.ckpt'
+
+
+def prepare_env(args, seed, timeout=None):
+    checkpoint_path = get_checkpoint_path(args, seed)
     seed += args.seed
 
     if args.role:
@@ -35,7 +49,7 @@ def prepare_env(args, seed):
             character_glyph = obs['glyphs'][blstats.y, blstats.x]
             if any([nh.permonst(nh.glyph_to_mon(character_glyph)).mname.startswith(role) for role in args.role]):
                 break
-            seed += 10 ** 9
+            seed += ROLE_SEED_SHIFT
             env.close()
 
     if args.visualize_ends is not None:
@@ -50,34 +64,69 @@ def prepare_env(args, seed):
                            frame_skipping=None if not visualize_with_simulate else 1,
                            output_video_path=(args.output_video_dir / f'{seed}.mp4'
                                               if args.output_video_dir is not None else None))
+    # the history is only recorded on request in sweeps, otherwise it only costs memory
+    history_args = None
+    if args.mode not in ('simulate', 'resume', 'bench') or args.record_history:
+        history_args = dict(max_steps=args.history_max_steps,
+                            spill_dir=args.history_spill_dir / str(seed) if args.history_spill_dir else None,
+                            keyframe_interval=args.history_keyframe_interval or None)
     env = EnvWrapper(gym.make('NetHackChallenge-v0', no_progress_timeout=1000),
                      to_skip=args.skip_to, visualizer_args=visualizer_args,
+                     step_limit=args.step_limit, time_limit=timeout,
                      agent_args=dict(panic_on_errors=args.panic_on_errors,
                                      verbose=args.mode == 'run'),
-                     interactive=args.mode == 'run')
+                     interactive=args.mode == 'run',
+                     checkpoint_path=checkpoint_path,
+                     checkpoint_every=args.checkpoint_every if checkpoint_path is not None else None,
+                     memory_profiler=MemoryProfiler(every=args.memory_profile_every) if args.memory_profile else None,
+                     history_args=history_args)
     env.env.seed(seed, seed)
     return env
 
 
 def single_simulation(args, seed_offset, timeout=720):
     start_time = time.time()
-    env = prepare_env(args, seed_offset)
+    env = prepare_env(args, seed_offset, timeout)
+    checkpoint = None
+    if env.checkpoint_path is not None and env.checkpoint_path.exists():
+        try:
+            checkpoint = checkpoint_lib.load_checkpoint(env.checkpoint_path)
+        except Exception as e:
+            print(f'Seed {args.seed + seed_offset}: cannot load the checkpoint: {e!r}')
+    startup_time = time.time()
+
+    if args.profile:
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
 
     try:
-        if timeout is not None:
-            with ThreadPool(1) as pool:
-                pool.apply_async(env.main).get(timeout)
-        else:
+        # on timeout the agent is stopped by `EnvWrapper` with `end_reason` set to 'timeout'
+        try:
+            env.main(checkpoint)
+        except checkpoint_lib.CheckpointMismatch as e:
+            print(f'Seed {args.seed + seed_offset}: cannot resume from the checkpoint, starting from scratch: {e}')
+            env.env.close()
+            env = prepare_env(args, seed_offset, timeout)
             env.main()
-    except multiprocessing.context.TimeoutError:
-        env.end_reason = f'timeout'
     except BaseException as e:
         env.end_reason = f'exception: {"".join(traceback.format_exception(None, e, e.__traceback__))}'
         print(f'Seed {env.env.get_seeds()}, step {env.step_count}:', env.end_reason)
 
     end_time = time.time()
     summary = env.get_summary()
+    if args.profile:
+        # shipped to the driver with the summary, but not stored in the results (see `run_simulations`)
+        summary['profile'] = profiler.stop().to_json()
     summary['duration'] = end_time - start_time
+    summary['startup_duration'] = startup_time - start_time
+
+    if args.action_log_dir is not None:
+        env.get_action_log().save(args.action_log_dir / f'{args.seed + seed_offset}.aalog')
+
+    if env.checkpoint_path is not None and not env.end_reason.startswith('exception'):
+        # checkpoints of episodes finished with an exception are kept to reproduce them (and for `resume` mode)
+        env.checkpoint_path.unlink(missing_ok=True)
 
     if args.visualize_ends is not None:
         env.visualizer.save_end_history()
@@ -99,11 +148,117 @@ def run_single_interactive_game(args):
         os.system('stty sane')
 
 
+def run_replay(args):
+    action_log = ActionLog.load(args.action_log)
+    actions = action_log.actions[:args.replay_until]
+
+    env = gym.make('NetHackChallenge-v0', no_progress_timeout=1000)
+    env.seed(*action_log.seeds)
+    start_time = time.perf_counter()
+    obs = env.reset()
+    obs, steps, done = replay(env, obs, actions)
+    env_duration = time.perf_counter() - start_time
+    env.render()
+    env.close()
+
+    print('seeds                 :', action_log.seeds)
+    print('steps                 :', f'{steps} / {len(action_log)}', '(game ended)' if done else '')
+    print('env_duration          :', env_duration)
+    print('env_steps_per_second  :', steps / env_duration)
+    if not args.shadow:
+        return
+
+    # run the agent on the same game and check that it makes the same decisions
+    env = EnvWrapper(gym.make('NetHackChallenge-v0', no_progress_timeout=1000),
+                     agent_args=dict(panic_on_errors=args.panic_on_errors),
+                     shadow_log=ActionLog(action_log.seeds, actions))
+    env.env.seed(*action_log.seeds)
+    start_time = time.perf_counter()
+    try:
+        env.main()
+    except BaseException as e:
+        env.end_reason = f'exception: {"".join(traceback.format_exception(None, e, e.__traceback__))}'
+    shadow_duration = time.perf_counter() - start_time
+    env.env.close()
+
+    print('shadow_end_reason     :', env.end_reason)
+    print('shadow_matched_steps  :', f'{env.step_count} / {len(actions)}')
+    print('shadow_duration       :', shadow_duration)
+    # None if nothing was replayed (an empty log or --replay-until 0)
+    env_time_per_step = env_duration / steps if steps else None
+    agent_time_per_step = None
+    if env.step_count and steps:
+        agent_time_per_step = (shadow_duration - env_time_per_step * env.step_count) / env.step_count
+    print('agent_time_per_step   :', agent_time_per_step)
+    print('env_time_per_step     :', env_time_per_step)
+
+
+def run_bench(args):
+    warmup.warmup()
+    pinned = [(role, seed) for role, seeds in bench.BENCH_SEEDS.items() if not args.role or role in args.role
+              for seed in seeds]
+
+    def run_episode(role, seed):
+        bench_args = copy.copy(args)
+        bench_args.role = [role]
+        bench_args.seed = seed
+        res = single_simulation(bench_args, 0, timeout=None)
+        if res['end_reason'].startswith('exception'):
+            print(f'WARNING: {role}-{seed} finished with an exception')
+        return res
+
+    # warm-up episodes (caches, lazily imported modules, ...) are excluded from the results
+    for i in range(args.bench_warmup):
+        run_episode(*pinned[i % len(pinned)])
+
+    episodes = []
+    # trials are the outer loop, so that a temporary disturbance affects all seeds similarly
+    for trial in range(args.bench_trials):
+        for role, seed in pinned:
+            res = run_episode(role, seed)
+            episodes.append(dict(role=role, seed=seed, trial=trial, steps=res['steps'], turns=res['turns'],
+                                 duration=res['duration'] - res['startup_duration'],
+                                 end_reason=res['end_reason']))
+            print(f'trial {trial} {bench.episode_key(role, seed)}: {episodes[-1]["steps"]} steps in '
+                  f'{episodes[-1]["duration"]:.1f}s')
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        commit = None
+    report = {
+        'meta': dict(commit=commit, python=platform.python_version(), machine=platform.node(),
+                     cpu_count=os.cpu_count(), step_limit=args.step_limit, trials=args.bench_trials,
+                     warmup=args.bench_warmup, time=time.time()),
+        'episodes': episodes,
+        **bench.aggregate(episodes),
+    }
+    bench.save_report(report, args.bench_output)
+    print()
+    print('steps_per_second :', report['aggregate']['steps_per_second'])
+    print('turns_per_second :', report['aggregate']['turns_per_second'])
+    print('time_per_step    :', report['aggregate']['time_per_step'])
+    print('report saved to', args.bench_output)
+
+    if args.bench_baseline is not None:
+        baseline = bench.load_report(args.bench_baseline)
+        print()
+        print('\n'.join(bench.format_comparison(baseline, report)))
+        regressions = bench.compare(baseline, report, args.bench_threshold)
+        for name, metric, old, new, change in regressions:
+            print(f'REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})')
+        if regressions:
+            sys.exit(1)
+
+
 def run_profiling(args):
     if args.profiler == 'cProfile':
         import cProfile, pstats
     elif args.profiler == 'pyinstrument':
-        from pyinstrument import Profiler
+        # every episode is profiled separately in `single_simulation`
+        args.profile = True
+        profiles = profiling.ProfileAggregator(Path(__file__).parent.absolute(), args.profile_dir)
     elif args.profiler == 'none':
         pass
     else:
@@ -111,18 +266,14 @@ def run_profiling(args):
 
     if args.profiler == 'cProfile':
         pr = cProfile.Profile()
-    elif args.profiler == 'pyinstrument':
-        profiler = Profiler()
-    elif args.profiler == 'none':
+    elif args.profiler in ['pyinstrument', 'none']:
         pass
     else:
         assert 0
 
     if args.profiler == 'cProfile':
         pr.enable()
-    elif args.profiler == 'pyinstrument':
-        profiler.start()
-    elif args.profiler == 'none':
+    elif args.profiler in ['pyinstrument', 'none']:
         pass
     else:
         assert 0
@@ -132,12 +283,14 @@ def run_profiling(args):
     for i in range(args.episodes):
         print(f'starting {i + 1} game...')
         res.append(single_simulation(args, i, timeout=None))
+        if args.profiler == 'pyinstrument':
+            profiles.update(res[-1].pop('profile'), str(args.seed + i))
     duration = time.time() - start_time
 
     if args.profiler == 'cProfile':
         pr.disable()
     elif args.profiler == 'pyinstrument':
-        session = profiler.stop()
+        profiles.save()
     elif args.profiler == 'none':
         pass
     else:
@@ -154,58 +307,133 @@ def run_profiling(args):
         stats.print_stats(30)
         stats = pstats.Stats(pr).sort_stats(pstats.SortKey.TIME)
         stats.print_stats(30)
-        stats.dump_stats('/tmp/nethack_stats.profile')
-
-        subprocess.run('gprof2dot -f pstats /tmp/nethack_stats.profile -o /tmp/calling_graph.dot'.split())
-        subprocess.run('xdot /tmp/calling_graph.dot'.split())
+        args.profile_dir.mkdir(parents=True, exist_ok=True)
+        stats_path = args.profile_dir / 'nethack_stats.profile'
+        stats.dump_stats(stats_path)
+        print('stats saved to', stats_path)
+
+        # the call graph can only be shown with a display (e.g. not on headless machines)
+        if shutil.which('gprof2dot') is not None:
+            dot_path = args.profile_dir / 'calling_graph.dot'
+            subprocess.run(['gprof2dot', '-f', 'pstats', str(stats_path), '-o', str(dot_path)])
+            if os.environ.get('DISPLAY') and shutil.which('xdot') is not None:
+                subprocess.run(['xdot', str(dot_path)])
     elif args.profiler == 'pyinstrument':
-        frame_records = session.frame_records
-
-        new_records = []
-        for record in frame_records:
-            ret_frames = []
-            for frame in record[0][1:][::-1]:
-                func, module, line = frame.split('\0')
-                if func in ['f', 'f2', 'run', 'wrapper']:
-                    continue
-                ret_frames.append(frame)
-                if module.endswith('agent.py') and func in ['step', 'preempt', 'call_update_functions']:
-                    break
-            ret_frames.append(record[0][0])
-            new_records.append((ret_frames[::-1], record[1] / session.duration * 100))
-        session.frame_records = new_records
-        session.start_call_stack = [session.start_call_stack[0]]
-
-        print('Cumulative time:')
-        profiler._last_session = session
-        print(profiler.output_text(unicode=True, color=True))
-
-        new_records = []
-        for record in frame_records:
-            ret_frames = []
-            for frame in record[0][1:][::-1]:
-                func, module, line = frame.split('\0')
-                ret_frames.append(frame)
-                if str(Path(module).absolute()).startswith(str(Path(__file__).parent.absolute())):
-                    break
-            ret_frames.append(record[0][0])
-            new_records.append((ret_frames[::-1], record[1] / session.duration * 100))
-        session.frame_records = new_records
-        session.start_call_stack = [session.start_call_stack[0]]
-
-        print('Total time:')
-        profiler._last_session = session
-        print(profiler.output_text(unicode=True, color=True, show_all=True))
+        print(profiling.session_report(profiles.sessions['all'], profiles.root_path))
+        print('profiles (pyinstrument sessions, speedscope json, collapsed stacks) saved to', args.profile_dir)
     elif args.profiler == 'none':
         pass
     else:
         assert 0
 
 
-def run_simulations(args):
+def simulation_timeout(args, timeout=500):
+    if args.output_video_dir is not None:
+        timeout = 4 * 24 * 60 * 60
+    return timeout
+
+
+def failed_summary(args, seed_offset, end_reason, duration):
+    """ Summary of an episode whose process was killed or died, so that nothing is known about the game """
+    seed = args.seed + seed_offset
+    return {
+        'score': 0,
+        'steps': 0,
+        'turns': 0,
+        'level_num': 0,
+        'experience_level': 0,
+        'milestone': 0,
+        'panic_num': 0,
+        'character': 'unknown',
+        'end_reason': end_reason,
+        'seed': (seed, seed, False),
+        'duration': duration,
+    }
+
+
+def ray_simulations(args, seed_offsets):
     import ray
     ray.init(address='auto')
 
+    @ray.remote(num_gpus=1 / 4 if args.with_gpu else 0)
+    def remote_simulation(args, seed_offset):
+        # I think there is some nondeterminism in nle environment when playing
+        # multiple episodes (maybe bones?). That should do the trick
+        q = Queue()
+
+        timeout = simulation_timeout(args)
+        start_time = time.time()
+
+        def sim():
+            q.put(single_simulation(args, seed_offset, timeout=timeout))
+
+        try:
+            p = Process(target=sim, daemon=False)
+            p.start()
+            # the hard timeout only matters if the soft one in `single_simulation` didn't manage to stop the game
+            # (e.g. the agent loops without calling `env.step`)
+            try:
+                return q.get(timeout=timeout + 120)
+            except queue.Empty:
+                return failed_summary(args, seed_offset, 'timeout (episode process killed)',
+                                      time.time() - start_time)
+        finally:
+            p.terminate()
+            p.join()
+
+        # uncomment to debug why join doesn't work properly
+        # from multiprocessing.pool import ThreadPool
+        # with ThreadPool(1) as thrpool:
+        #     def fun():
+        #         import time
+        #         while True:
+        #             time.sleep(1)
+        #             print(p.pid, p.is_alive(), p.exitcode, p)
+        #     thrpool.apply_async(fun)
+        # p.join(timeout=timeout + 1)
+        # assert not q.empty()
+
+    try:
+        pending = list(seed_offsets)[::-1]
+        refs = {}
+        while pending or refs:
+            while pending and (args.max_concurrency is None or len(refs) < args.max_concurrency):
+                seed_offset = pending.pop()
+                refs[remote_simulation.remote(args, seed_offset)] = seed_offset
+            ref, _ = ray.wait(list(refs), num_returns=1, timeout=None)
+            yield refs.pop(ref[0]), ray.get(ref[0])
+    finally:
+        ray.shutdown()
+
+
+def local_simulation(args, seed_offset):
+    summary = single_simulation(args, seed_offset, timeout=simulation_timeout(args))
+    if warmup.warmup_duration is not None:
+        # the time that a fresh process would spend on imports, compilation and loading the game data
+        summary['prewarm_saved'] = warmup.warmup_duration
+    return summary
+
+
+def local_simulations(args, seed_offsets):
+    # the hard timeout only matters if the soft one in `single_simulation` didn't manage to stop the game
+    processes = min(filter(None, [args.workers or os.cpu_count(), args.max_concurrency]))
+    timeout = simulation_timeout(args) + 120
+    pool = LocalPool(local_simulation, processes=processes, timeout=timeout,
+                     initializer=warmup.warmup if args.prewarm else None, fork_per_task=args.prewarm)
+    for (_, seed_offset), single_res, error in pool.imap_unordered([(args, s) for s in seed_offsets]):
+        if error is not None:
+            print(f'Seed {args.seed + seed_offset} failed:', error)
+            # recorded like episodes finished by the agent, so that the remaining count and the ETA converge
+            # and the seed is repeated only when exceptions are (see `ResultsStore.done_seeds`);
+            # the duration of a dead process is unknown
+            if error.startswith('timeout'):
+                single_res = failed_summary(args, seed_offset, error, timeout)
+            else:
+                single_res = failed_summary(args, seed_offset, f'exception: {error}', 0.)
+        yield seed_offset, single_res
+
+
+def run_simulations(args):
     start_time = time.time()
     plot_queue = Queue()
 
@@ -237,131 +465,97 @@ def run_simulations(args):
         plt_process = Process(target=plot_thread_func)
         plt_process.start()
 
-    refs = []
-
-    @ray.remote(num_gpus=1 / 4 if args.with_gpu else 0)
-    def remote_simulation(args, seed_offset, timeout=500):
-        # I think there is some nondeterminism in nle environment when playing
-        # multiple episodes (maybe bones?). That should do the trick
-        q = Queue()
-
-        if args.output_video_dir is not None:
-            timeout = 4 * 24 * 60 * 60
-
-        def sim():
-            q.put(single_simulation(args, seed_offset, timeout=timeout))
-
-        try:
-            p = Process(target=sim, daemon=False)
-            p.start()
-            return q.get()
-        finally:
-            p.terminate()
-            p.join()
-
-        # uncomment to debug why join doesn't work properly
-        # from multiprocessing.pool import ThreadPool
-        # with ThreadPool(1) as thrpool:
-        #     def fun():
-        #         import time
-        #         while True:
-        #             time.sleep(1)
-        #             print(p.pid, p.is_alive(), p.exitcode, p)
-        #     thrpool.apply_async(fun)
-        # p.join(timeout=timeout + 1)
-        # assert not q.empty()
-
-    try:
-        with args.simulation_results.open('r') as f:
-            all_res = json.load(f)
-        print('Continue running: ', (len(all_res['seed'])))
-    except FileNotFoundError:
-        all_res = {}
-
-    done_seeds = set()
-    if 'seed' in all_res:
-        done_seeds = set(s[0] for s in all_res['seed'])
-
-    # remove runs finished with exceptions if rerunning with --panic-on-errors
-    if args.panic_on_errors and all_res:
-        idx_to_repeat = set()
-        for i, (seed, reason) in enumerate(zip(all_res['seed'], all_res['end_reason'])):
-            if reason.startswith('exception'):
-                idx_to_repeat.add(i)
-                done_seeds.remove(seed[0])
-        print('Repeating idx:', idx_to_repeat)
-        for k, v in all_res.items():
-            all_res[k] = [v for i, v in enumerate(v) if i not in idx_to_repeat]
+    results_store = ResultsStore(args.simulation_results)
+    # repeat runs finished with exceptions if rerunning with --panic-on-errors or resuming from checkpoints
+    done_seeds = results_store.done_seeds(skip_exceptions=args.panic_on_errors or args.mode == 'resume')
+    stats = LiveStats()
+    duration_estimator = DurationEstimator()
+    # only summaries from the index, records of previous runs aren't parsed
+    for path in args.duration_history:
+        for summary in load_summaries(path):
+            duration_estimator.update(summary)
+    for summary in results_store.summaries():
+        duration_estimator.update(summary)
+        if summary['seed'][0] in done_seeds:
+            # not in the dashboard sample (the summary lacks the fields)
+            stats.update(summary, sample=False)
+    if done_seeds:
+        print('Continue running: ', len(done_seeds))
 
     print('skipping seeds', done_seeds)
-    for seed_offset in range(args.episodes):
+    if args.mode == 'resume':
+        candidate_offsets = sorted(int(path.stem) - args.seed for path in args.checkpoint_dir.glob('*.ckpt'))
+    else:
+        candidate_offsets = range(args.episodes)
+    seed_offsets = []
+    for seed_offset in candidate_offsets:
         seed = args.seed + seed_offset
         if seed in done_seeds:
             continue
         if args.seeds and seed not in args.seeds:
             continue
-        if args.visualize_ends is None or seed_offset in [k % 10 ** 9 for k in args.visualize_ends]:
-            refs.append(remote_simulation.remote(args, seed_offset))
+        if args.visualize_ends is None or seed_offset in [k % ROLE_SEED_SHIFT for k in args.visualize_ends]:
+            seed_offsets.append(seed_offset)
 
-    count = len(done_seeds)
-    initial_count = count
-    for handle in refs:
-        ref, refs = ray.wait(refs, num_returns=1, timeout=None)
-        single_res = ray.get(ref[0])
-
-        if not all_res:
-            all_res = {key: [] for key in single_res}
-        assert all_res.keys() == single_res.keys()
+    estimates = {s: duration_estimator.estimate(args.seed + s, args.role) for s in seed_offsets}
+    if args.schedule == 'longest-first':
+        seed_offsets = longest_first(seed_offsets, estimates)
+    elif args.schedule != 'fifo':
+        assert 0
+    eta_tracker = EtaTracker(estimates, concurrency=args.max_concurrency or
+                             (args.workers or os.cpu_count() if args.backend == 'local' else None))
 
-        count += 1
-        for k, v in single_res.items():
-            all_res[k].append(v if not hasattr(v, 'item') else v.item())
+    if args.backend == 'ray':
+        results = ray_simulations(args, seed_offsets)
+    elif args.backend == 'local':
+        results = local_simulations(args, seed_offsets)
+    else:
+        assert 0
 
-        plot_queue.put(all_res)
+    initial_count = stats.count
+    last_plot_time = 0
+    profiles = profiling.ProfileAggregator(Path(__file__).parent.absolute(), args.profile_dir) \
+        if args.profile else None
+    last_profile_save_time = time.time()
+    for seed_offset, single_res in results:
+        profile = single_res.pop('profile', None)
+        if profile is not None:
+            # hot paths differ a lot between games that ended in different phases
+            profiles.update(profile, str(args.seed + seed_offset), groups=[f'milestone-{single_res["milestone"]}'])
+            if time.time() - last_profile_save_time > 60:
+                last_profile_save_time = time.time()
+                profiles.save()
+
+        stats.update(single_res)
+        eta_tracker.update(seed_offset, single_res['duration'])
+
+        if not args.no_plot and time.time() - last_plot_time > 1:
+            last_plot_time = time.time()
+            plot_queue.put(stats.snapshot())
 
         total_duration = time.time() - start_time
-
-        median_score_std = np.std([np.median(np.random.choice(all_res["score"],
-                                                              size=max(1, len(all_res["score"]) // 2)))
-                                   for _ in range(1024)])
-
-        text = []
-        text.append(f'count                         : {count}')
-        text.append(f'time_per_simulation           : {np.mean(all_res["duration"])}')
-        text.append(f'simulations_per_hour          : {3600 / np.mean(all_res["duration"])}')
-        text.append(f'simulations_per_hour(multi)   : {3600 * (count - initial_count) / total_duration}')
-        text.append(f'time_per_turn                 : {np.sum(all_res["duration"]) / np.sum(all_res["turns"])}')
-        text.append(f'turns_per_second              : {np.sum(all_res["turns"]) / np.sum(all_res["duration"])}')
-        text.append(f'turns_per_second(multi)       : {np.sum(all_res["turns"]) / total_duration}')
-        text.append(f'panic_num_per_game(median)    : {np.median(all_res["panic_num"])}')
-        text.append(f'panic_num_per_game(mean)      : {np.sum(all_res["panic_num"]) / count}')
-        text.append(f'score_median                  : {np.median(all_res["score"]):.1f} +/- '
-                    f'{median_score_std:.1f}')
-        text.append(f'score_mean                    : {np.mean(all_res["score"]):.1f} +/- '
-                    f'{np.std(all_res["score"]) / (len(all_res["score"]) ** 0.5):.1f}')
-        text.append(f'score_05-95                   : {np.quantile(all_res["score"], 0.05)} '
-                    f'{np.quantile(all_res["score"], 0.95)}')
-        text.append(f'score_25-75                   : {np.quantile(all_res["score"], 0.25)} '
-                    f'{np.quantile(all_res["score"], 0.75)}')
-        text.append(f'exceptions                    : '
-                    f'{sum([r.startswith("exception:") for r in all_res["end_reason"]])}')
-        text.append(f'steplimit                     : '
-                    f'{sum([r.startswith("steplimit") or r.startswith("ABORT") for r in all_res["end_reason"]])}')
-        text.append(f'timeout                       : '
-                    f'{sum([r.startswith("timeout") for r in all_res["end_reason"]])}')
+        text = stats.text(stats.count - initial_count, total_duration)
+        eta = eta_tracker.eta()
+        text.append(f'remaining                     : {len(eta_tracker.estimates)}')
+        text.append(f'eta                           : '
+                    f'{"unknown" if eta is None else time.strftime("%H:%M:%S", time.gmtime(eta))}')
         print('\n'.join(text) + '\n')
 
         if args.visualize_ends is None:
-            with args.simulation_results.open('w') as f:
-                json.dump(all_res, f)
+            results_store.append(single_res)
 
+    if not args.no_plot:
+        plot_queue.put(stats.snapshot())
+    if profiles is not None and profiles.sessions:
+        profiles.save()
+        print(profiling.session_report(profiles.sessions['all'], profiles.root_path))
+        print('profiles saved to', args.profile_dir)
     print('DONE!')
-    ray.shutdown()
 
 
 def parse_args():
     parser = ArgumentParser()
-    parser.add_argument('mode', choices=('simulate', 'run', 'profile'))
+    parser.add_argument('mode', choices=('simulate', 'resume', 'run', 'profile', 'replay', 'bench'))
     parser.add_argument('--seed', type=int, help='Starting random seed')
     parser.add_argument('--seeds', nargs="*", type=int,
                         help='Run only these specific seeds (only relevant in simulate mode)')
@@ -372,6 +566,8 @@ def parse_args():
                                            'tou', 'val', 'wiz'),
                         action='append')
     parser.add_argument('--panic-on-errors', action='store_true')
+    parser.add_argument('--step-limit', type=int, default=None,
+                        help='Stop episodes after this number of steps (default: no limit, 3000 in bench mode)')
     parser.add_argument('--no-plot', action='store_true')
     parser.add_argument('--visualize-ends', type=Path, default=None,
                         help='Path to json file with dict: seed -> visualization_start_step.'
@@ -380,13 +576,100 @@ def parse_args():
     parser.add_argument('--output-video-dir', type=Path, default=None,
                         help="Episode visualization video directory -- valid only with 'simulate' mode")
     parser.add_argument('--profiler', choices=('cProfile', 'pyinstrument', 'none'), default='pyinstrument')
+    parser.add_argument('--profile', action='store_true',
+                        help='Simulation mode only. Profile every episode with pyinstrument in the worker, and merge '
+                             'the profiles (all episodes and by the final milestone) into --profile-dir')
+    parser.add_argument('--profile-dir', type=Path, default=Path('/tmp/nh_profile'),
+                        help='Output directory of profiles (simulate --profile and profile modes). Profiles are saved '
+                             'as pyinstrument sessions, speedscope json and collapsed stacks (per episode and merged)')
+    parser.add_argument('--memory-profile', action='store_true',
+                        help='Record peak RSS, tracemalloc top allocation sites and sizes of growing structures '
+                             'in the episode summary (slows the agent down)')
+    parser.add_argument('--memory-profile-every', type=int, default=1000,
+                        help='Number of steps between memory samples')
+    parser.add_argument('--record-history', action='store_true',
+                        help='Record the per-step history (screen, strategy, action) also in simulate, resume '
+                             'and bench modes')
+    parser.add_argument('--history-max-steps', type=int, default=None,
+                        help='Keep only (at least) this number of last steps of the history')
+    parser.add_argument('--history-spill-dir', type=Path, default=None,
+                        help='Save full chunks of the history to <dir>/<seed>/ instead of keeping them in memory')
+    parser.add_argument('--history-keyframe-interval', type=int, default=0,
+                        help='Delta-encode screens of full history chunks with a keyframe every this number of steps '
+                             '(a divisor of 1024, 0 keeps raw screens)')
     parser.add_argument('--with-gpu', action='store_true')
-    parser.add_argument('--simulation-results', default='nh_sim.json', type=Path,
-                        help='path to simulation results json. Only for simulation mode')
+    parser.add_argument('--backend', choices=('ray', 'local'), default='ray',
+                        help="'ray' requires a running Ray instance, 'local' runs episodes on a pool of "
+                             "forked workers on this machine. Only for simulation mode")
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of workers for the local backend (default: number of CPUs)')
+    parser.add_argument('--max-concurrency', type=int, default=None,
+                        help='Maximum number of episodes running at the same time (only for simulation mode)')
+    parser.add_argument('--schedule', choices=('longest-first', 'fifo'), default='longest-first',
+                        help='Order of episodes in simulation mode. longest-first starts the episodes expected '
+                             'to be the longest (based on durations in the results file and --duration-history) '
+                             'first, which shortens the tail of the sweep')
+    parser.add_argument('--duration-history', type=Path, nargs='*', default=[],
+                        help='Additional results files with episode durations for --schedule longest-first')
+    parser.add_argument('--prewarm', action='store_true',
+                        help='Local backend only. Workers import and warm up the agent (numba kernels, game data, NLE) '
+                             'once, and fork a fresh process from that state for every episode')
+    parser.add_argument('--checkpoint-dir', type=Path, default=None,
+                        help='Directory for episode checkpoints (only for simulation and resume modes). '
+                             'Unfinished episodes are resumed from their last checkpoint')
+    parser.add_argument('--checkpoint-every', type=int, default=5000,
+                        help='Number of steps between checkpoints')
+    parser.add_argument('--action-log-dir', type=Path, default=None,
+                        help='Directory to save action logs (seeds and actions) of episodes, that can be replayed '
+                             'in replay mode')
+    parser.add_argument('--action-log', type=Path, default=None,
+                        help='Action log to replay (only for replay mode)')
+    parser.add_argument('--replay-until', type=int, default=None,
+                        help='Replay only this number of steps (only for replay mode)')
+    parser.add_argument('--shadow', action='store_true',
+                        help='Replay mode only. After the agent-free replay, run the agent on the same game '
+                             'and check that it chooses the logged actions')
+    parser.add_argument('--bench-trials', type=int, default=3,
+                        help='Number of runs of every pinned episode (only for bench mode)')
+    parser.add_argument('--bench-warmup', type=int, default=1,
+                        help='Number of untimed episodes before the benchmark (only for bench mode)')
+    parser.add_argument('--bench-output', type=Path, default=Path('bench.json'),
+                        help='Benchmark report path (only for bench mode)')
+    parser.add_argument('--bench-baseline', type=Path, default=None,
+                        help='Benchmark report to compare with. Exits with status 1 on a regression '
+                             '(only for bench mode, see also bin/bench.py)')
+    parser.add_argument('--bench-threshold', type=float, default=0.1,
+                        help='Relative slowdown considered a regression')
+    parser.add_argument('--simulation-results', default='nh_sim.jsonl', type=Path,
+                        help='path to simulation results store (json record per line). Only for simulation mode. '
+                             'Legacy json results can be converted with bin/results.py')
 
     args = parser.parse_args()
+    if args.mode == 'resume':
+        if args.checkpoint_dir is None:
+            parser.error('resume mode requires --checkpoint-dir')
+        # checkpoints are named by seeds
+        args.seed = args.seed or 0
     if args.seed is None:
-        args.seed = np.random.randint(0, 2 ** 30)
+        args.seed = np.random.randint(0, ROLE_SEED_SHIFT - args.episodes)
+    # results of a sweep are matched with its seeds modulo the shift of seeds of other roles (see `prepare_env`)
+    if args.mode in ('simulate', 'resume') and \
+            (args.seed < 0 or args.seed + args.episodes > ROLE_SEED_SHIFT or
+             any(not 0 <= seed < ROLE_SEED_SHIFT for seed in args.seeds or [])):
+        parser.error(f'seeds of sweeps have to be in [0, {ROLE_SEED_SHIFT})')
+    if args.checkpoint_dir is not None:
+        args.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    if args.action_log_dir is not None:
+        args.action_log_dir.mkdir(parents=True, exist_ok=True)
+    if args.mode == 'bench' and args.step_limit is None:
+        args.step_limit = 3000
+    if args.mode == 'replay' and args.action_log is None:
+        parser.error('replay mode requires --action-log')
+    # every chunk of the history starts with a keyframe
+    if args.history_keyframe_interval < 0 or \
+            (args.history_keyframe_interval and EpisodeHistory.CHUNK_SIZE % args.history_keyframe_interval):
+        parser.error('--history-keyframe-interval has to be 0 or a divisor of the history chunk size '
+                     f'({EpisodeHistory.CHUNK_SIZE})')
 
     if args.visualize_ends is not None:
         with args.visualize_ends.open('r') as f:
@@ -395,18 +678,26 @@ def parse_args():
     if args.output_video_dir is not None:
         assert args.mode == 'simulate', "Video output only valid in 'simulate' mode"
 
+    if args.mode in ('simulate', 'resume') and args.simulation_results.suffix == '.json':
+        parser.error('legacy json results are read-only, convert them with: '
+                     f'bin/results.py merge {args.simulation_results.with_suffix(".jsonl")} {args.simulation_results}')
+
     print('ARGS:', args)
     return args
 
 
 def main():
     args = parse_args()
-    if args.mode == 'simulate':
+    if args.mode in ('simulate', 'resume'):
         run_simulations(args)
     elif args.mode == 'profile':
         run_profiling(args)
     elif args.mode == 'run':
         run_single_interactive_game(args)
+    elif args.mode == 'replay':
+        run_replay(args)
+    elif args.mode == 'bench':
+        run_bench(args)
     else:
         assert 0
 
@@ -0,0 +1,30 @@
+from argparse import ArgumentParser
+
+from autoascend.simulation import compact, merge
+
+
+def main():
+    parser = ArgumentParser(description='Maintenance of simulation results stores (see `bin/main.py simulate`)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_compact = subparsers.add_parser('compact', help='remove superseded and corrupted records')
+    parser_compact.add_argument('path')
+    parser_compact.add_argument('-o', '--output', default=None, help='write to another file instead of in-place')
+
+    parser_merge = subparsers.add_parser('merge', help='merge results stores or legacy results json files '
+                                                       '(for duplicated seeds the last file wins)')
+    parser_merge.add_argument('output')
+    parser_merge.add_argument('inputs', nargs='+')
+
+    args = parser.parse_args()
+    if args.command == 'compact':
+        count = compact(args.path, args.output)
+    elif args.command == 'merge':
+        count = merge(args.inputs, args.output)
+    else:
+        assert 0
+    print('records:', count)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,11 @@
-import json
 import sys
 from collections import Counter
-from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+from autoascend.simulation import load_results
+
 HEADER = '-' * 50
 
 
@@ -18,9 +18,7 @@ def extract_last_place_from_exception(text):
 
 
 def load_df(filepath):
-    with Path(filepath).open() as f:
-        df = json.load(f)
-    df = pd.DataFrame.from_dict(df)
+    df = pd.DataFrame.from_records(load_results(filepath))
     for k in df.keys():
         df[k] = [tuple(v) if isinstance(v, list) else v for v in df[k]]
     return df
@@ -76,6 +74,81 @@ def print_end_reasons(df, ref_df):
     print()
 
 
+def print_phase_timings(df):
+    """ Where the agent time goes, from `phase_*` timers of `Agent.update_state` """
+    phases = [k[len('phase_time_'):] for k in df.keys() if k.startswith('phase_time_')]
+    if not phases:
+        return
+    df = df[df[f'phase_time_{phases[0]}'].notna()]
+    total_duration = df.duration.sum()
+    total_steps = df.steps.sum()
+    print(HEADER, f'UPDATE PHASES ({len(df)} episodes):')
+    print(f'  {"phase":16s} {"time[s]":>10s} {"% of dur":>8s} {"us/step":>8s} {"calls":>10s} {"us/call":>8s} '
+          f'{"env steps":>10s}')
+    for phase in sorted(phases, key=lambda p: -df[f'phase_time_{p}'].sum()):
+        t = df[f'phase_time_{phase}'].sum()
+        calls = df[f'phase_calls_{phase}'].sum()
+        steps = df[f'phase_steps_{phase}'].sum()
+        print(f'  {phase:16s} {t:10.1f} {t / total_duration * 100:8.1f} {t / total_steps * 1e6:8.1f} '
+              f'{calls:10.0f} {t / max(calls, 1) * 1e6:8.1f} {steps:10.0f}')
+    print()
+    print()
+
+
+def print_strategy_stats(df, key='strategy_stats', title='STRATEGIES', limit=None):
+    if key not in df.keys():
+        return
+    totals = {}
+    episodes = 0
+    for stats in df[key]:
+        if not isinstance(stats, dict):
+            continue
+        episodes += 1
+        for name, values in stats.items():
+            totals[name] = [a + b for a, b in zip(totals.get(name, [0] * len(values)), values)]
+    all_steps = sum(v[3] for v in totals.values())
+    print(HEADER, f'{title} ({episodes} episodes):')
+    print(f'  {"strategy":50s} {"steps":>10s} {"% steps":>7s} {"turns":>10s} {"wall[s]":>9s} {"cpu[s]":>9s} '
+          f'{"env[s]":>9s} {"ms/step":>7s}')
+    for name, (wall, cpu, env, steps, turns) in sorted(totals.items(), key=lambda x: -x[1][3])[:limit]:
+        print(f'  {name[-50:]:50s} {steps:10d} {steps / all_steps * 100:7.1f} {turns:10d} {wall:9.1f} {cpu:9.1f} '
+              f'{env:9.1f} {wall / steps * 1000:7.2f}')
+    print()
+    print()
+
+
+def print_memory(df):
+    if 'memory_peak_rss_mb' not in df.keys():
+        return
+    df = df[df.memory_peak_rss_mb.notna()]
+    print(HEADER, f'MEMORY ({len(df)} episodes):')
+    quantiles = ' '.join(f'{q:7.0f}' for q in np.quantile(df.memory_peak_rss_mb, [0, 0.5, 0.9, 0.99, 1]))
+    print(f'  peak_rss_mb [min 50% 90% 99% max]: {quantiles}')
+    if len(df) > 1 and df.steps.std() > 0:
+        slope, intercept = np.polyfit(df.steps, df.memory_peak_rss_mb, 1)
+        print(f'  peak_rss_mb ~= {intercept:.0f} + {slope * 1000:.2f} * steps / 1000')
+
+    for key, title in [('memory_top_allocations', 'allocated at the end'), ('memory_top_growth', 'growth')]:
+        if key not in df.keys():
+            continue
+        totals = Counter()
+        for sites in df[key]:
+            if isinstance(sites, (list, tuple)):
+                for site, size_kb, _ in sites:
+                    totals[site] += size_kb
+        print(f'  top sites by {title} (MiB summed over episodes):')
+        for site, size_kb in totals.most_common(10):
+            print(f'    {size_kb / 1024:9.1f} {site}')
+
+    objects = pd.DataFrame.from_records([o for o in df.memory_objects if isinstance(o, dict)])
+    if len(objects):
+        print('  structure sizes at the end of episodes [mean max]:')
+        for k in objects.keys():
+            print(f'    {k:20s} {objects[k].mean():10.1f} {objects[k].max():10.1f}')
+    print()
+    print()
+
+
 def print_summary(comment, df, ref_df, indent=0):
     indent_chars = '  ' * indent
 
@@ -115,9 +188,14 @@ def main(filepath):
 
     print_exceptions(df, df)
     print_end_reasons(df, df)
+    print_phase_timings(df)
+    print_strategy_stats(df)
+    print_memory(df)
+    print_strategy_stats(df, 'strategy_chain_stats', 'STRATEGY CHAINS (TOP 30)', limit=30)
 
     print(HEADER, 'SORTED BY SCORE:')
-    print(df.sort_values('score'))
+    print(df[[k for k in df.keys() if not k.startswith(('phase_', 'strategy_', 'memory_'))]]
+          .sort_values('score'))
     print()
 
     print_summary('all', df, df)
@@ -156,5 +234,5 @@ if __name__ == '__main__':
     pd.set_option('display.width', None)
     pd.set_option('display.max_colwidth', 30)
 
-    filepath = '/workspace/nh_sim.json' if len(sys.argv) <= 1 else sys.argv[1]
+    filepath = '/workspace/nh_sim.jsonl' if len(sys.argv) <= 1 else sys.argv[1]
     main(filepath)
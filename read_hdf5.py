@@ -1,26 +1,39 @@
+import time
+from argparse import ArgumentParser
+
 import h5py
 import numpy as np
 
-f = h5py.File("/storage/youngin/nld_aaa_small.hdf5", 'r')
+from autoascend.simulation.loader import TransitionLoader
 
-n = 0
-trans = []
-scores = []
-turns = []
+parser = ArgumentParser(description='Prints statistics of a trajectory dataset (see bin/generate_dataset.py) '
+                                    'and optionally measures the minibatch throughput of the loader')
+parser.add_argument('path', nargs='?', default='/storage/youngin/nld_aaa_small.hdf5')
+parser.add_argument('--batches', type=int, default=0, help='number of minibatches to read')
+parser.add_argument('--batch-size', type=int, default=256)
+parser.add_argument('--blocks-per-batch', type=int, default=None)
+parser.add_argument('--workers', type=int, default=0)
+args = parser.parse_args()
 
-for k in f.keys():
-    n += 1
-    trans.append(f[f'{k}/tty_chars'].shape[0])
-    scores.append(f[f'{k}/score'][()])
-    turns.append(f[f'{k}/turns'][()])
+loader = TransitionLoader(args.path)
 
-trans = np.array(trans)
-scores = np.array(scores)
-turns = np.array(turns)
+trans = np.diff(loader.offsets)
+with h5py.File(args.path, 'r') as f:
+    scores = np.array([f[f'{k}/score'][()] for k in loader.episode_names])
+    turns = np.array([f[f'{k}/turns'][()] for k in loader.episode_names])
 
-print(f"Total Episodes: {n}")
+print(f"Total Episodes: {len(loader.episode_names)}")
 print(f"Total Transitions: {trans.sum()}")
 print(f"Mean Episode Score: {scores.mean()}")
 print(f"Median Episode Score: {np.median(scores)}")
 print(f"Median Episode Transitions: {np.median(trans)}")
-print(f"Median Episode Turns: {np.median(turns)}")
\ No newline at end of file
+print(f"Median Episode Turns: {np.median(turns)}")
+print(f"Strategies: {len(loader.strategy_names)}")
+
+if args.batches:
+    start_time = time.time()
+    for batch in loader.batches(args.batch_size, args.batches, blocks_per_batch=args.blocks_per_batch,
+                                workers=args.workers):
+        pass
+    duration = time.time() - start_time
+    print(f"Transitions/s: {args.batches * args.batch_size / duration:.0f}")
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+# numba kernels (and the rest of `utils` dependencies)
+utils = pytest.importorskip('autoascend.utils')
+distance_cache = pytest.importorskip('autoascend.distance_cache')
+
+SHAPE = (21, 79)
+
+
+def random_walkability(rng, density):
+    walkable = rng.random(SHAPE) < density
+    walkable_diagonally = walkable & (rng.random(SHAPE) < 0.8)
+    return walkable, walkable_diagonally
+
+
+def edit(rng, walkable, walkable_diagonally, changes):
+    walkable, walkable_diagonally = walkable.copy(), walkable_diagonally.copy()
+    ys, xs = rng.integers(0, SHAPE[0], changes), rng.integers(0, SHAPE[1], changes)
+    walkable[ys, xs] = ~walkable[ys, xs]
+    walkable_diagonally[ys[::2], xs[::2]] = ~walkable_diagonally[ys[::2], xs[::2]]
+    return walkable, walkable_diagonally
+
+
+def bfs(y, x, walkable, walkable_diagonally, can_squeeze):
+    return utils.bfs(y, x, walkable=walkable, walkable_diagonally=walkable_diagonally, can_squeeze=can_squeeze)
+
+
+@pytest.mark.parametrize('can_squeeze', [False, True])
+@pytest.mark.parametrize('density', [0.5, 0.7, 0.9])
+def test_repair_equals_bfs(density, can_squeeze):
+    rng = np.random.default_rng(int(density * 10) + can_squeeze)
+    for _ in range(30):
+        walkable, walkable_diagonally = random_walkability(rng, density)
+        y, x = int(rng.integers(SHAPE[0])), int(rng.integers(SHAPE[1]))
+        dis = bfs(y, x, walkable, walkable_diagonally, can_squeeze)
+        # a chain of edits, every repair starts from the previous repaired map
+        for _ in range(5):
+            new_walkable, new_walkable_diagonally = edit(rng, walkable, walkable_diagonally, rng.integers(1, 12))
+            repaired = distance_cache.repair_distances(dis, walkable, walkable_diagonally, new_walkable,
+                                                       new_walkable_diagonally, can_squeeze, y, x)
+            expected = bfs(y, x, new_walkable, new_walkable_diagonally, can_squeeze)
+            assert (repaired == expected).all()
+            walkable, walkable_diagonally, dis = new_walkable, new_walkable_diagonally, repaired
+
+
+def test_repair_at_the_source():
+    walkable = np.ones(SHAPE, bool)
+    dis = bfs(5, 5, walkable, walkable, False)
+    # the source itself and its surroundings become non-walkable
+    new_walkable = walkable.copy()
+    new_walkable[4:7, 4:7] = False
+    repaired = distance_cache.repair_distances(dis, walkable, walkable, new_walkable, new_walkable, False, 5, 5)
+    assert (repaired == bfs(5, 5, new_walkable, new_walkable, False)).all()
+    assert repaired[5, 5] == 0 and (repaired[new_walkable] == -1).all()
+
+
+def walkability(walkable, can_squeeze=False):
+    return distance_cache.Walkability(walkable.copy(), walkable.copy(), can_squeeze)
+
+
+def test_cache():
+    cache = distance_cache.DistanceCache(max_entries=3)
+    walkable = np.ones(SHAPE, bool)
+    w = walkability(walkable)
+    assert cache.lookup(1, 1, w) is None
+
+    dis = cache.get(1, 1, w)
+    assert not dis.flags.writeable
+    assert (dis == bfs(1, 1, walkable, walkable, False)).all()
+    # equal walkability of another step gives the same (shared) map, numpy coordinates too
+    assert cache.get(np.int64(1), 1, walkability(walkable)) is dis
+    assert cache.lookup(1, 1, w) is dis
+
+    # a few changes are repaired, the result is the same as of BFS
+    walkable[3, :40] = False
+    repaired = cache.get(1, 1, walkability(walkable))
+    assert (repaired == bfs(1, 1, walkable, walkable, False)).all()
+    assert cache.get(1, 1, walkability(walkable, can_squeeze=True)) is not repaired
+
+    # LRU eviction
+    for x in range(4):
+        cache.get(2, x, w)
+    assert len(cache._entries) == 3 and cache.lookup(1, 1, w) is None
+    assert all(key in cache._entries for key in cache._latest.values())
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from autoascend.frame_codec import FrameDecoder, concatenate_encoded, decode_frames, encode_frames
+
+
+def random_frames(n, seed=0, change_prob=0.01, shape=(24, 80)):
+    """ Screens changing in a few random cells per step (like NLE tty observations) """
+    rng = np.random.default_rng(seed)
+    chars = np.zeros((n, *shape), np.uint8)
+    colors = np.zeros((n, *shape), np.int8)
+    chars[0] = rng.integers(32, 128, shape)
+    colors[0] = rng.integers(0, 16, shape)
+    for i in range(1, n):
+        chars[i] = chars[i - 1]
+        colors[i] = colors[i - 1]
+        mask = rng.random(shape) < change_prob
+        chars[i][mask] = rng.integers(32, 128, mask.sum())
+        colors[i][mask] = rng.integers(0, 16, mask.sum())
+    return chars, colors
+
+
+@pytest.mark.parametrize('n', [1, 2, 63, 64, 65, 200])
+@pytest.mark.parametrize('keyframe_interval', [1, 16, 64])
+def test_round_trip(n, keyframe_interval):
+    chars, colors = random_frames(n)
+    encoded = encode_frames(chars, colors, keyframe_interval)
+    decoded_chars, decoded_colors = decode_frames(encoded, keyframe_interval)
+    assert (decoded_chars == chars).all()
+    assert (decoded_colors == colors).all()
+    assert decoded_chars.dtype == chars.dtype and decoded_colors.dtype == colors.dtype
+
+
+def test_random_ranges():
+    keyframe_interval = 16
+    chars, colors = random_frames(300, seed=1, change_prob=0.05)
+    decoder = FrameDecoder(encode_frames(chars, colors, keyframe_interval), keyframe_interval)
+    assert len(decoder) == 300
+
+    rng = np.random.default_rng(2)
+    # ranges starting and ending at, before and after keyframes
+    boundaries = [0, 1, 15, 16, 17, 31, 32, 299, 300]
+    ranges = [(a, b) for a in boundaries for b in boundaries if a < b]
+    ranges += [tuple(sorted(rng.integers(0, 301, 2))) for _ in range(50)]
+    for start, stop in ranges:
+        decoded_chars, decoded_colors = decoder.decode(start, stop)
+        assert (decoded_chars == chars[start:stop]).all(), (start, stop)
+        assert (decoded_colors == colors[start:stop]).all(), (start, stop)
+
+    for i in rng.integers(0, 300, 20):
+        decoded_chars, decoded_colors = decoder[i]
+        assert (decoded_chars == chars[i]).all() and (decoded_colors == colors[i]).all()
+
+
+def test_empty_and_clipped_ranges():
+    chars, colors = random_frames(10)
+    decoder = FrameDecoder(encode_frames(chars, colors, 4), 4)
+    decoded_chars, decoded_colors = decoder.decode(5, 5)
+    assert decoded_chars.shape == (0, 24, 80) and decoded_colors.shape == (0, 24, 80)
+    decoded_chars, _ = decoder.decode(8, 100)
+    assert (decoded_chars == chars[8:]).all()
+
+
+def test_identical_frames_have_no_diffs():
+    chars, colors = random_frames(1)
+    chars, colors = np.repeat(chars, 10, 0), np.repeat(colors, 10, 0)
+    encoded = encode_frames(chars, colors, 8)
+    assert (encoded['diff_count'] == 0).all() and len(encoded['diff_index']) == 0
+    assert (decode_frames(encoded, 8)[0] == chars).all()
+
+
+def test_color_only_changes():
+    chars, colors = random_frames(5, change_prob=0)
+    colors[3, 2, 7] += 1
+    encoded = encode_frames(chars, colors, 64)
+    assert encoded['diff_count'].tolist() == [0, 0, 0, 1, 1]
+    assert (decode_frames(encoded, 64)[1] == colors).all()
+
+
+def test_concatenate():
+    keyframe_interval = 8
+    chars, colors = random_frames(40, seed=3)
+    parts = [encode_frames(chars[i:i + 16], colors[i:i + 16], keyframe_interval) for i in range(0, 40, 16)]
+    decoded_chars, decoded_colors = decode_frames(concatenate_encoded(parts), keyframe_interval)
+    assert (decoded_chars == chars).all() and (decoded_colors == colors).all()
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from autoascend.history import EpisodeHistory
+
+
+def observation(step):
+    rng = np.random.default_rng(step)
+    chars = np.full((24, 80), 32, np.uint8)
+    colors = np.zeros((24, 80), np.int8)
+    chars[step % 24, :10] = rng.integers(32, 128, 10)
+    colors[step % 24, :10] = rng.integers(0, 16, 10)
+    return {'tty_chars': chars, 'tty_colors': colors, 'tty_cursor': np.array([step % 24, step % 80], np.uint8)}
+
+
+def record(history, steps):
+    for step in steps:
+        history.append(step, observation(step), f'strategy{step % 3}', step % 100)
+
+
+def check_steps(arrays, steps, strategy_names):
+    assert arrays['step'].tolist() == list(steps)
+    for i, step in enumerate(steps):
+        obs = observation(step)
+        assert (arrays['tty_chars'][i] == obs['tty_chars']).all()
+        assert (arrays['tty_colors'][i] == obs['tty_colors']).all()
+        assert (arrays['tty_cursor'][i] == obs['tty_cursor']).all()
+        assert strategy_names[arrays['strategy'][i]] == f'strategy{step % 3}'
+        assert arrays['act'][i] == step % 100
+
+
+@pytest.mark.parametrize('keyframe_interval', [None, 4])
+@pytest.mark.parametrize('n', [0, 1, 15, 16, 17, 50])
+def test_unbounded(n, keyframe_interval):
+    history = EpisodeHistory(chunk_size=16, keyframe_interval=keyframe_interval)
+    record(history, range(n))
+    assert len(history) == n
+    check_steps(history.arrays(), range(n), history.strategy_names)
+    assert [s['strategy'] for s in history] == [f'strategy{i % 3}' for i in range(n)]
+
+
+@pytest.mark.parametrize('keyframe_interval', [None, 8])
+def test_ring(keyframe_interval):
+    history = EpisodeHistory(chunk_size=16, max_steps=20, keyframe_interval=keyframe_interval)
+    record(history, range(100))
+    assert len(history) == 100
+    arrays = history.arrays()
+    # at least the last `max_steps` steps, in whole chunks
+    assert 20 <= len(arrays['step']) <= 20 + 16 + 16
+    check_steps(arrays, range(100 - len(arrays['step']), 100), history.strategy_names)
+    # dropped chunks are reused
+    chunks = len(history._chunks) + len(history._free_chunks)
+    record(history, range(100, 300))
+    assert len(history._chunks) + len(history._free_chunks) <= chunks + 1
+
+
+@pytest.mark.parametrize('keyframe_interval', [None, 8])
+def test_spill(tmp_path, keyframe_interval):
+    history = EpisodeHistory(chunk_size=16, spill_dir=tmp_path / 'spill', keyframe_interval=keyframe_interval)
+    record(history, range(70))
+    assert len(list((tmp_path / 'spill').glob('chunk_*.npz'))) == 4
+    assert len(history._chunks) == 1
+    check_steps(history.arrays(), range(70), history.strategy_names)
+
+    history.clear()
+    assert len(history) == 0 and not list((tmp_path / 'spill').glob('chunk_*.npz'))
+
+
+@pytest.mark.parametrize('keyframe_interval', [None, 8])
+@pytest.mark.parametrize('n', [0, 16, 40])
+def test_sink(n, keyframe_interval):
+    chunks = []
+
+    def sink(chunk):
+        # chunks are valid only during the call
+        chunks.append({k: v.copy() for k, v in chunk.items()})
+
+    history = EpisodeHistory(chunk_size=16, sink=sink, keyframe_interval=keyframe_interval)
+    record(history, range(n))
+    history.flush()
+    assert len(history) == n
+    assert sum(len(c['step']) for c in chunks) == n
+    if keyframe_interval is not None:
+        chunks = [history._decoded(c) for c in chunks]
+    if chunks:
+        arrays = {k: np.concatenate([c[k] for c in chunks]) for k in EpisodeHistory.FIELDS}
+        check_steps(arrays, range(n), history.strategy_names)
+
+    # recording continues after a flush
+    record(history, range(n, n + 3))
+    history.flush()
+    assert chunks[-1]['step'].tolist() == list(range(n, n + 3)) and len(history) == n + 3
+
+
+def test_exclusive_modes(tmp_path):
+    with pytest.raises(AssertionError):
+        EpisodeHistory(max_steps=10, sink=lambda chunk: None)
+    with pytest.raises(AssertionError):
+        EpisodeHistory(chunk_size=16, keyframe_interval=5)
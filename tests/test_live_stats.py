@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from autoascend.simulation.live_stats import LiveStats, P2Quantile, RunningMoments
+
+
+def test_running_moments():
+    values = np.random.default_rng(0).normal(5, 2, 1000)
+    moments = RunningMoments()
+    assert np.isnan(moments.std)
+    for v in values:
+        moments.update(v)
+    assert moments.count == 1000
+    assert moments.sum == pytest.approx(values.sum())
+    assert moments.mean == pytest.approx(values.mean())
+    assert moments.std == pytest.approx(values.std())
+
+
+@pytest.mark.parametrize('q', [0.05, 0.5, 0.95])
+@pytest.mark.parametrize('n', [1, 2, 3, 4, 5])
+def test_p2_exact_for_few_values(q, n):
+    values = [7., 1., 5., 3., 9.][:n]
+    quantile = P2Quantile(q)
+    assert np.isnan(quantile.value)
+    for v in values:
+        quantile.update(v)
+    assert quantile.value == pytest.approx(np.quantile(values, q))
+
+
+@pytest.mark.parametrize('q', [0.05, 0.25, 0.5, 0.75, 0.95])
+def test_p2_estimate(q):
+    values = np.random.default_rng(1).exponential(1000, 20000)
+    quantile = P2Quantile(q)
+    for v in values:
+        quantile.update(v)
+    # the estimate is within a small fraction of the spread of the data
+    assert abs(quantile.value - np.quantile(values, q)) < 0.02 * (np.quantile(values, 0.99) - np.quantile(values, 0.01))
+
+
+def test_p2_constant_values():
+    quantile = P2Quantile(0.5)
+    for _ in range(100):
+        quantile.update(3.)
+    assert quantile.value == 3.
+
+
+def make_record(score, end_reason='death'):
+    return dict(score=score, duration=2., turns=100, panic_num=1, end_reason=end_reason, steps=10, level_num=1,
+                experience_level=1, milestone=1, character='val')
+
+
+def test_live_stats():
+    stats = LiveStats(reservoir_size=10)
+    reasons = ['death', 'exception: x', 'timeout', 'steplimit', 'ABORT']
+    for i in range(50):
+        stats.update(make_record(i, reasons[i % len(reasons)]))
+    assert stats.count == 50
+    assert stats.end_reasons == {'exceptions': 10, 'steplimit': 20, 'timeout': 10}
+    assert stats.score.mean == pytest.approx(24.5)
+    assert stats.score_quantiles[0.5].value == pytest.approx(24.5, abs=1)
+    assert stats.median_score_std > 0
+    snapshot = stats.snapshot()
+    assert len(snapshot['score']) == 10 and set(snapshot['score']) <= set(range(50))
+    text = '\n'.join(stats.text(50, 100.))
+    assert 'count                         : 50' in text
+
+
+def test_live_stats_unsampled_summaries():
+    stats = LiveStats(reservoir_size=10)
+    # summaries of resumed episodes (see `ResultsStore.summaries`) lack the dashboard fields
+    for i in range(5):
+        stats.update(dict(score=i, duration=2., turns=100, panic_num=0, end_reason='exception'), sample=False)
+    stats.update(make_record(100))
+    assert stats.count == 6 and stats.end_reasons['exceptions'] == 5
+    assert stats.snapshot()['score'] == [100]
+
+
+def test_live_stats_failed_episodes():
+    stats = LiveStats()
+    # a killed or crashed episode (see `failed_summary` in bin/main.py)
+    stats.update(dict(make_record(0, 'timeout (episode process killed)'), duration=0., turns=0))
+    text = '\n'.join(stats.text(1, 0.))
+    assert 'simulations_per_hour          : inf' in text
+    assert 'time_per_turn                 : nan' in text
+    assert 'turns_per_second(multi)       : nan' in text
+
+    stats.update(dict(make_record(0, 'exception: x'), duration=10., turns=0))
+    text = '\n'.join(stats.text(2, 10.))
+    assert 'time_per_turn                 : inf' in text
+    assert 'turns_per_second              : 0.0' in text
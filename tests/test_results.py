@@ -0,0 +1,103 @@
+import json
+
+from autoascend.simulation.results import ResultsStore, compact, load_results, merge
+
+
+def make_record(seed, end_reason='death', score=10, **kwargs):
+    return dict(seed=[seed, seed, False], end_reason=end_reason, duration=1.5, character='val-hum-fem-law',
+                turns=100, score=score, panic_num=2, steps=50, **kwargs)
+
+
+def test_append_and_load(tmp_path):
+    store = ResultsStore(tmp_path / 'results.jsonl')
+    assert store.load() == [] and store.done_seeds() == set() and store.summaries() == []
+    for seed in range(3):
+        store.append(make_record(seed))
+    store.append(make_record(1, score=99))  # the last record of a seed wins
+    records = store.load()
+    assert sorted(r['seed'][0] for r in records) == [0, 1, 2]
+    assert [r['score'] for r in records if r['seed'][0] == 1] == [99]
+    assert store.done_seeds() == {0, 1, 2}
+
+
+def test_exceptions_are_repeated(tmp_path):
+    store = ResultsStore(tmp_path / 'results.jsonl')
+    store.append(make_record(0, 'exception: Traceback ...'))
+    store.append(make_record(1, 'timeout (worker killed)'))
+    store.append(make_record(2))
+    assert store.done_seeds() == {0, 1, 2}
+    assert store.done_seeds(skip_exceptions=True) == {1, 2}
+    store.append(make_record(0))
+    assert store.done_seeds(skip_exceptions=True) == {0, 1, 2}
+
+
+def test_truncated_record(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    store = ResultsStore(path)
+    store.append(make_record(0))
+    # a driver killed in the middle of a write
+    with path.open('ab') as f:
+        f.write(json.dumps(make_record(1)).encode()[:20])
+    assert store.done_seeds() == {0}
+    assert [r['seed'][0] for r in store.load()] == [0]
+
+    # the truncated line is terminated, so the next record is intact
+    store.append(make_record(2))
+    assert store.done_seeds() == {0, 2}
+    assert sorted(r['seed'][0] for r in store.load()) == [0, 2]
+
+
+def test_resume_without_index(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    store = ResultsStore(path)
+    for seed in range(3):
+        store.append(make_record(seed))
+    store.index_path.unlink()
+    assert store.done_seeds() == {0, 1, 2}
+    assert store.index_path.exists()
+
+    # records appended by another writer after the last indexed one
+    with path.open('ab') as f:
+        f.write((json.dumps(make_record(3)) + '\n').encode())
+    assert ResultsStore(path).done_seeds() == {0, 1, 2, 3}
+
+
+def test_stale_index(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    store = ResultsStore(path)
+    for seed in range(3):
+        store.append(make_record(seed))
+    # the store was replaced by a shorter one, the index points past its end
+    path.write_text(json.dumps(make_record(5)) + '\n')
+    assert store.done_seeds() == {5}
+
+
+def test_summaries(tmp_path):
+    store = ResultsStore(tmp_path / 'results.jsonl')
+    store.append(make_record(0, 'exception: x'))
+    store.append(make_record(1, 'steplimit', score=7))
+    summaries = {s['seed'][0]: s for s in store.summaries()}
+    assert summaries[0]['end_reason'] == 'exception'
+    assert summaries[1] == {'seed': [1], 'end_reason': 'steplimit', 'duration': 1.5, 'character': 'val',
+                            'turns': 100, 'score': 7., 'panic_num': 2}
+
+    # an index of an older version (without summaries), the records are parsed instead
+    lines = store.index_path.read_text().splitlines()
+    store.index_path.write_text(''.join(' '.join(line.split()[:3]) + '\n' for line in lines))
+    assert {s['seed'][0]: s for s in store.summaries()} == summaries
+
+
+def test_compact_and_merge(tmp_path):
+    store = ResultsStore(tmp_path / 'a.jsonl')
+    store.append(make_record(0))
+    store.append(make_record(0, score=5))
+    store.append(make_record(1))
+    assert compact(store.path) == 2
+    assert len(store.path.read_text().splitlines()) == 2
+    assert store.done_seeds() == {0, 1}
+
+    legacy = tmp_path / 'b.json'
+    legacy.write_text(json.dumps({k: [v] for k, v in make_record(1, score=42).items()}))
+    assert merge([store.path, legacy], tmp_path / 'c.jsonl') == 2
+    records = {r['seed'][0]: r for r in load_results(tmp_path / 'c.jsonl')}
+    assert records[0]['score'] == 5 and records[1]['score'] == 42